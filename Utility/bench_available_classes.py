@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+""" Benchmark query_available_classes against a fake DynamoDB client that sleeps
+    a fixed round trip per call. Prints calls per request and p50/p99 latency
+    for growing catalog sizes. A request makes one GSI1 query plus one BatchGetItem
+    per 100 classes, so calls grow as 1 + ceil(n/100), 2 at 10 classes and 8 at 640,
+    instead of one query per class.
+
+    Usage: python -m Utility.bench_available_classes [ROUND_TRIP_MS] """
+
+import sys
+import time
+
+from enrollment_service import query_helper as qh
+
+
+class FakeDynamoDB:
+    def __init__(self, n_classes, round_trip):
+        self.n_classes = n_classes
+        self.round_trip = round_trip
+        self.calls = 0
+
+    def query(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.round_trip)
+        return {"Items": [
+            {
+                "GSI1_SK": {"S": f"c#open#{i:04d}"},
+                "Detail": {"M": {"Name": {"S": f"Class {i}"}, "CourseCode": {"S": "CPSC449"}}},
+            }
+            for i in range(self.n_classes)
+        ]}
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        time.sleep(self.round_trip)
+        keys = RequestItems["TitanOnlineEnrollment"]["Keys"]
+        return {"Responses": {"TitanOnlineEnrollment": [
+            {"PK": key["PK"], "GSI3_SK": {"S": "i#0001"}} for key in keys
+        ]}}
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(round_trip, sizes=(10, 40, 160, 640), requests=50):
+    print(f"{'classes':>8} {'calls':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for n_classes in sizes:
+        client = FakeDynamoDB(n_classes, round_trip)
+        samples = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            qh.query_available_classes(client, "0001")
+            samples.append((time.perf_counter() - start) * 1000)
+        calls = client.calls / requests
+        print(f"{n_classes:>8} {calls:>6.0f} {percentile(samples, 0.5):>8.2f} {percentile(samples, 0.99):>8.2f}")
+
+
+if __name__ == "__main__":
+    round_trip_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    run(round_trip_ms / 1000)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+""" Benchmark decoding a query response with the enrollment codec against the
+    previous path, TypeDeserializer per attribute plus python_data.index(item)
+    to put the ids back. Both run over the same N open class rows (10k by default),
+    the old path is quadratic so expect it to take a while at full size.
+
+    Usage: python -m Utility.bench_codec [ITEMS] [REPEAT] """
+
+import sys
+import time
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from enrollment_service import codec
+
+deserializer = TypeDeserializer()
+
+
+def make_items(n_items):
+    return [
+        {
+            "PK": {"S": f"c#{i}"},
+            "SK": {"S": "s#0001"},
+            "GSI1_PK": {"S": "s#0001"},
+            "GSI1_SK": {"S": f"c#open#{i}"},
+            "EntityType": {"S": "enrollment"},
+            "Detail": {"M": {
+                "Name": {"S": f"Class {i}"},
+                "Department": {"S": "Computer Science"},
+                "CourseCode": {"S": f"CPSC{i % 500}"},
+                "SectionNumber": {"S": str(i % 7)},
+            }},
+        }
+        for i in range(n_items)
+    ]
+
+
+def decode_typedeserializer(items):
+    formatted_response = [{'Detail': item['Detail']} for item in items]
+    ids = [{'id': item['GSI1_SK']['S'].split("#")[-1]} for item in items]
+    python_data = [{k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]
+    final_response = []
+    for item in python_data:
+        item['Detail'].update(ids[python_data.index(item)])
+        final_response.append(item['Detail'])
+    return final_response
+
+
+def decode_codec(items):
+    return [codec.ClassListing.from_open_item(item).to_dict() for item in items]
+
+
+def best_of(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def run(n_items, repeat):
+    items = make_items(n_items)
+    assert decode_typedeserializer(items) == decode_codec(items)
+    old = best_of(decode_typedeserializer, items, repeat)
+    new = best_of(decode_codec, items, repeat)
+    print(f"{'items':>8} {'old ms':>10} {'codec ms':>10} {'speedup':>8}")
+    print(f"{n_items:>8} {old:>10.2f} {new:>10.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    n_items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    run(n_items, repeat)
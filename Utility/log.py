@@ -0,0 +1,79 @@
+''' Logging setup shared by the enrollment and login services.
+    Records go through a QueueHandler, a QueueListener thread formats them and writes
+    to stderr, so a request never blocks on terminal or pipe I/O.
+    Each record carries the request id of the request that logged it.
+
+    Configured with environment variables:
+      LOG_LEVEL            root level, default INFO
+      LOG_LEVELS           per-module levels, e.g. "enrollment_service.query_helper=DEBUG,login_service=WARNING"
+      LOG_SUCCESS_SAMPLE   fraction of success messages to keep, default 0.01 '''
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+
+request_id = contextvars.ContextVar("request_id", default="-")
+SUCCESS_SAMPLE_RATE = float(os.environ.get("LOG_SUCCESS_SAMPLE", "0.01"))
+LOG_FORMAT = "%(asctime)s level=%(levelname)s logger=%(name)s request_id=%(request_id)s %(message)s"
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+def parse_levels(spec):
+    levels = {}
+    for entry in spec.split(","):
+        if "=" in entry:
+            name, level = entry.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+"""Install the queue handler on the root logger, safe to call more than once"""
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    # The request id has to be read on the thread that logged, before the record is queued
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    for name, level in parse_levels(os.environ.get("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(name)
+
+
+"""Log a success message for a sampled fraction of calls, they are too frequent to log all of"""
+def sampled(logger, message, *args):
+    if random.random() < SUCCESS_SAMPLE_RATE and logger.isEnabledFor(logging.INFO):
+        logger.info(message, *args, extra={"sample_rate": SUCCESS_SAMPLE_RATE})
+
+
+"""Use the caller's request id if it sent one, otherwise make a new one"""
+def start_request(header_value=None):
+    value = header_value or uuid.uuid4().hex
+    return value, request_id.set(value)
+
+def end_request(token):
+    request_id.reset(token)
@@ -8,6 +8,10 @@ import datetime
 
 from jwcrypto import jwk
 
+from Utility import log
+
+logger = log.get_logger(__name__)
+
 ALGORITHM = "pbkdf2_sha256"
 
 
@@ -57,7 +61,8 @@ def generate_claims(username, user_id, roles):
 
     output = json.dumps(token, indent=4)
     claim_json = json.loads(output)
-    print (claim_json)
+    # The token is a credential, log who it was issued to and not the token itself
+    logger.debug("Generated claims for %s", claim_json["access_token"]["sub"])
     return claim_json   
 
 
@@ -0,0 +1,47 @@
+''' This file contains the auth context for the enrollment service.
+    KrakenD validates the RS256 token of every request and propagates its claims to the
+    backend as headers (see propagate_claims in etc/krakend.json):
+      jti   -> x-cwid    user id, the student or instructor id
+      sub   -> x-user    username
+      roles -> x-roles   comma separated roles
+    When a student or professor calls a route for their own id, the claims already prove the
+    caller exists, so the route can skip reading the student or instructor item.
+    jti is the login service's integer uid ("1") while routes use the zero-padded DynamoDB id
+    ("0001"), both are compared as numbers.
+    The headers are only trustworthy when the service is reachable through the gateway alone,
+    so they are ignored unless TRUST_GATEWAY_CLAIMS=1, every route then reads from DynamoDB.'''
+import os
+
+from fastapi import Header
+
+TRUST_GATEWAY_CLAIMS = os.environ.get("TRUST_GATEWAY_CLAIMS", "0") == "1"
+
+
+class AuthContext:
+    __slots__ = ("user_id", "username", "roles")
+
+    def __init__(self, user_id=None, username=None, roles=()):
+        self.user_id = user_id
+        self.username = username
+        self.roles = frozenset(roles)
+
+    """True if the verified claims are for this user id in this role"""
+    def vouches_for(self, role, user_id):
+        return TRUST_GATEWAY_CLAIMS and self.user_id is not None and normalize_id(self.user_id) == normalize_id(user_id) and role in self.roles
+
+
+ANONYMOUS = AuthContext()
+
+"""Numeric ids without their zero padding, so "1" and "0001" are the same user"""
+def normalize_id(user_id):
+    user_id = str(user_id).strip()
+    return str(int(user_id)) if user_id.isdigit() else user_id
+
+def parse_roles(value):
+    return [role.strip() for role in value.split(",") if role.strip()]
+
+"""Auth context from the claims KrakenD propagated, ANONYMOUS when there are none"""
+def get_auth_context(x_cwid: str | None = Header(None), x_user: str | None = Header(None), x_roles: str | None = Header(None)):
+    if not x_cwid:
+        return ANONYMOUS
+    return AuthContext(x_cwid, x_user, parse_roles(x_roles or ""))
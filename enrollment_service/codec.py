@@ -0,0 +1,147 @@
+''' This file contains the item codec for the TitanOnlineEnrollment table.
+    It decodes DynamoDB attribute values in one pass straight into JSON-ready Python
+    values (numbers become int or float, sets become lists) and wraps the entity
+    shapes the enrollment service reads in small __slots__ classes.
+    Replaces boto3's TypeDeserializer, which dispatches through getattr per value
+    and returns Decimals and sets that FastAPI has to convert again.'''
+import base64
+
+
+def decode_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def decode_value(value):
+    # Every attribute value is a single {type: data} pair, most of ours are S, N or M
+    for tag, data in value.items():
+        if tag == "S":
+            return data
+        if tag == "N":
+            return decode_number(data)
+        if tag == "M":
+            return decode_map(data)
+        if tag == "BOOL":
+            return data
+        if tag == "L":
+            return [decode_value(v) for v in data]
+        if tag == "NULL":
+            return None
+        if tag == "SS":
+            return list(data)
+        if tag == "NS":
+            return [decode_number(v) for v in data]
+        if tag == "B":
+            return base64.b64encode(data).decode('ascii')
+        if tag == "BS":
+            return [base64.b64encode(v).decode('ascii') for v in data]
+        raise TypeError(f"Unknown DynamoDB type {tag}")
+
+def decode_map(attributes):
+    return {k: decode_value(v) for k, v in attributes.items()}
+
+"""Decode a whole item, leaving out attributes in skip"""
+def decode_item(item, skip=()):
+    return {k: decode_value(v) for k, v in item.items() if k not in skip}
+
+def key_id(key):
+    # c#1234, s#enrolled#0001, i#0001 -> the id after the last #
+    return key.rsplit("#", 1)[-1]
+
+
+KEY_ATTRIBUTES = ("PK", "SK", "EntityType", "GSI1_PK", "GSI1_SK", "GSI2_PK", "GSI2_SK", "GSI3_PK", "GSI3_SK")
+
+
+""" Class as listed for a student, from an open or enrolled row: the class Detail plus its id """
+class ClassListing:
+    __slots__ = ("id", "detail")
+
+    def __init__(self, id, detail):
+        self.id = id
+        self.detail = detail
+
+    @classmethod
+    def from_open_item(cls, item):
+        return cls(key_id(item['GSI1_SK']['S']), decode_map(item['Detail']['M']))
+
+    @classmethod
+    def from_enrolled_item(cls, item):
+        return cls(key_id(item['PK']['S']), decode_map(item['Detail']['M']))
+
+    def to_dict(self):
+        self.detail['id'] = self.id
+        return self.detail
+
+
+""" Class item c#id/c#id read through GSI3, the instructor comes from GSI3_SK
+    counter_shards is set on hot classes, their currentEnroll is the sum of the shard items """
+class ClassRecord:
+    __slots__ = ("id", "instructor_id", "detail", "current_enroll", "max_enroll", "frozen", "counter_shards")
+
+    def __init__(self, id, instructor_id, detail, current_enroll, max_enroll, frozen, counter_shards=0):
+        self.id = id
+        self.instructor_id = instructor_id
+        self.detail = detail
+        self.current_enroll = current_enroll
+        self.max_enroll = max_enroll
+        self.frozen = frozen
+        self.counter_shards = counter_shards
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            key_id(item['PK']['S']),
+            key_id(item['GSI3_SK']['S']),
+            decode_map(item['Detail']['M']) if 'Detail' in item else {},
+            decode_number(item['currentEnroll']['N']) if 'currentEnroll' in item else 0,
+            decode_number(item['maxEnroll']['N']) if 'maxEnroll' in item else 0,
+            item['Frozen']['BOOL'] if 'Frozen' in item else False,
+            decode_number(item['CounterShards']['N']) if 'CounterShards' in item else 0,
+        )
+
+    def to_dict(self):
+        class_data = {
+            "Detail": self.detail,
+            "currentEnroll": self.current_enroll,
+            "maxEnroll": self.max_enroll,
+            "Frozen": self.frozen,
+            "id": self.id,
+            "instructorId": self.instructor_id,
+        }
+        if self.counter_shards:
+            class_data["CounterShards"] = self.counter_shards
+        return class_data
+
+
+""" Student or instructor item, s#id/s#id or i#id/i#id: its own attributes plus the id """
+class Person:
+    __slots__ = ("id", "attributes")
+
+    def __init__(self, id, attributes):
+        self.id = id
+        self.attributes = attributes
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(key_id(item['PK']['S']), decode_item(item, KEY_ATTRIBUTES))
+
+    def to_dict(self):
+        self.attributes['id'] = self.id
+        return self.attributes
+
+class Student(Person):
+    __slots__ = ()
+
+class Instructor(Person):
+    __slots__ = ()
+
+
+""" Enrollment counter shard c#class_id/counter#enroll#n of a hot class, (count, cap) """
+def counter_shard(item):
+    return decode_number(item['count']['N']), decode_number(item['cap']['N'])
+
+
+""" Enrollment row c#class_id/s#state#student_id, only its student key is needed """
+def enrollment_student_key(item):
+    return item['GSI1_PK']['S']
@@ -0,0 +1,154 @@
+''' This file contains the request-scoped data context for the enrollment service.
+    Routes get one DataContext per request through FastAPI dependencies. It memoizes
+    reads by key for the length of the request, queues Redis writes on one pipeline
+    and counts every DynamoDB and Redis call the request makes.
+    Routes are async. Redis is a redis.asyncio client and is awaited directly. boto3 has
+    no async client here, so the blocking DynamoDB calls (and the class cache and jobs that
+    sit behind them on the blocking Redis client) run on backend_executor through run().
+    Independent reads of one request can be awaited together with asyncio.gather.'''
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import enrollment_service.enrolled_helper as eh
+import enrollment_service.metrics as metrics
+import enrollment_service.query_helper as qh
+from enrollment_service.auth import ANONYMOUS
+from Utility import log
+
+logger = log.get_logger(__name__)
+
+BACKEND_THREADS = int(os.environ.get("BACKEND_THREADS", "64"))
+backend_executor = ThreadPoolExecutor(max_workers=BACKEND_THREADS, thread_name_prefix="backend")
+
+
+""" Proxy that counts calls made on a backend client """
+class CountingClient:
+    def __init__(self, client, context):
+        self._client = client
+        self._context = context
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name in ('pipeline', 'register_script'):
+            return attr
+        def counted(*args, **kwargs):
+            self._context.count_call()
+            return attr(*args, **kwargs)
+        return counted
+
+
+class DataContext:
+    def __init__(self, dynamodb_client, redis_client, auth=ANONYMOUS):
+        self.auth = auth
+        self.backend_calls = 0
+        self.lock = threading.Lock()
+        self.dynamodb_client = CountingClient(dynamodb_client, self)
+        self.redis = CountingClient(redis_client, self)
+        self.reads = {}
+        self.pipeline = None
+        # student id -> {class id: enrolled} for enrollment writes this request made
+        self.enrolled_changes = {}
+
+    def count_call(self):
+        # Calls of one request can run on several backend threads at once
+        with self.lock:
+            self.backend_calls += 1
+
+    """Run a blocking DynamoDB call on backend_executor and wait for it"""
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(backend_executor, metrics.in_context(func), *args)
+
+    """Read once per request, concurrent callers of the same key share one call"""
+    async def memoize(self, key, func, *args):
+        if key not in self.reads:
+            self.reads[key] = asyncio.ensure_future(self.run(func, self.dynamodb_client, *args))
+        return await self.reads[key]
+
+    """Memoize a value the route already read some other way, e.g. in a batch"""
+    def prime(self, key, value):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self.reads[key] = future
+
+    """Drop memoized reads after a write changed them"""
+    def forget(self, *keys):
+        for key in keys:
+            self.reads.pop(key, None)
+
+    async def query_student(self, student_id):
+        return await self.memoize(("student", student_id), qh.query_student, student_id)
+
+    async def query_class(self, class_id):
+        return await self.memoize(("class", class_id), qh.query_class, class_id)
+
+    async def query_instructor(self, instructor_id):
+        return await self.memoize(("instructor", instructor_id), qh.query_instructor, instructor_id)
+
+    """Which of class_ids the student is enrolled in, from the student's Redis set
+       A missing set is rebuilt from a GSI1 keys-only query, Redis errors fall back to that query"""
+    async def enrolled_in(self, student_id, class_ids):
+        try:
+            enrolled = await eh.enrolled_members(self.redis, student_id, class_ids)
+        except Exception as error:
+            logger.warning("Enrolled set unavailable: %s", error)
+            enrolled_ids = await self.memoize(("enrolled_ids", student_id), qh.query_enrolled_class_ids, student_id)
+            return None if enrolled_ids is None else set(class_ids) & set(enrolled_ids)
+        if enrolled is not None:
+            return enrolled
+        enrolled_ids = await self.memoize(("enrolled_ids", student_id), qh.query_enrolled_class_ids, student_id)
+        if enrolled_ids is None:
+            return None
+        # The GSI1 read may predate this request's own writes, the rebuild must not undo them
+        enrolled_ids = set(enrolled_ids)
+        for class_id, enrolled in self.enrolled_changes.get(student_id, {}).items():
+            if enrolled:
+                enrolled_ids.add(class_id)
+            else:
+                enrolled_ids.discard(class_id)
+        eh.rebuild_enrolled(self.pending_redis(), student_id, enrolled_ids)
+        return set(class_ids) & enrolled_ids
+
+    """Queue an enroll or drop on the student's set, a rebuild later in the request keeps it"""
+    def enrolled_changed(self, student_id, class_id, enrolled):
+        self.enrolled_changes.setdefault(student_id, {})[class_id] = enrolled
+        if enrolled:
+            eh.add_enrolled(self.pending_redis(), student_id, class_id)
+        else:
+            eh.remove_enrolled(self.pending_redis(), student_id, class_id)
+
+    async def is_enrolled(self, student_id, class_id):
+        enrolled = await self.enrolled_in(student_id, [class_id])
+        return None if enrolled is None else class_id in enrolled
+
+    """Check a student exists, the caller's own claims answer without a read"""
+    async def student_exists(self, student_id):
+        if self.auth.vouches_for("student", student_id):
+            metrics.record_existence_check("student", "claims")
+            return True
+        metrics.record_existence_check("student", "dynamodb")
+        return bool(await self.query_student(student_id))
+
+    async def instructor_exists(self, instructor_id):
+        if self.auth.vouches_for("professor", instructor_id):
+            metrics.record_existence_check("instructor", "claims")
+            return True
+        metrics.record_existence_check("instructor", "dynamodb")
+        return bool(await self.query_instructor(instructor_id))
+
+    async def query_class_instructor(self, instructor_id, class_id):
+        return await self.memoize(("class_instructor", instructor_id, class_id), qh.query_class_instructor, instructor_id, class_id)
+
+    """Pipeline for Redis writes whose result the route doesn't need, sent by flush()"""
+    def pending_redis(self):
+        if self.pipeline is None:
+            self.pipeline = self.redis.pipeline(transaction=False)
+        return self.pipeline
+
+    async def flush(self):
+        pipeline, self.pipeline = self.pipeline, None
+        if pipeline is not None and len(pipeline):
+            self.count_call()
+            await pipeline.execute()
@@ -0,0 +1,45 @@
+''' Convert waitlist:{class_id} Redis lists into sorted sets in place.
+    Members keep their FIFO order, the scores are spaced one microsecond apart
+    just before the migration time so new joins always land after them.
+    Run from the repository root: python -m enrollment_service.database.migrate_waitlists'''
+import redis
+
+from enrollment_service import waitlist_helper as wh
+
+
+def migrate_waitlist(r, key):
+    # WATCH the key so a concurrent join/leave aborts and retries the conversion
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                if pipe.type(key) != b'list':
+                    return 0
+                members = pipe.lrange(key, 0, -1)
+                base = wh.join_score() - len(members)
+                scores = {}
+                for index, member in enumerate(members):
+                    # Keep the first occurrence if a student was pushed twice
+                    scores.setdefault(member, base + index)
+                pipe.multi()
+                pipe.delete(key)
+                if scores:
+                    pipe.zadd(key, scores)
+                pipe.execute()
+                return len(scores)
+            except redis.WatchError:
+                continue
+
+
+def migrate_waitlists(r):
+    migrated = 0
+    for key in r.scan_iter(match=wh.waitlist_key("*"), _type="list"):
+        count = migrate_waitlist(r, key)
+        print(f"Migrated {key.decode('utf-8')}: {count} students")
+        migrated += 1
+    print(f"Migrated {migrated} waitlists")
+    return migrated
+
+
+if __name__ == "__main__":
+    migrate_waitlists(redis.Redis())
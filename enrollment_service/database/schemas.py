@@ -17,6 +17,16 @@ class Class(BaseModel):
     maxEnroll: int
     InstructorId: str
 
+class ClassIdBatch(BaseModel):
+    ClassIds: List[str]
+
+class ClassRef(BaseModel):
+    ClassId: str
+
+class InstructorChange(BaseModel):
+    ClassId: str
+    InstructorId: str
+
 
 class Student(BaseModel):
     id: str
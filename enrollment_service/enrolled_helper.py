@@ -0,0 +1,53 @@
+''' This file contains the Redis enrolled-class set helpers for the enrollment service.
+    Each student's enrolled class ids are a set keyed enrolled:{student_id}, so checking
+    whether a student is enrolled in a class is one SMISMEMBER instead of a GSI1 query.
+    The set always holds a sentinel member once it has been built from GSI1, a set without
+    it (expired or never built) is a miss and is rebuilt.
+    Enroll and drop paths keep a built set up to date and refresh its TTL, an add never creates
+    a set so a partial one can't pass for complete. The TTL bounds how long a set that missed
+    a write can stay wrong. Drops are conditional in DynamoDB so a stale member can't
+    double-drop a student.'''
+
+ENROLLED_SENTINEL = "-"
+ENROLLED_TTL = 10 * 60
+
+# KEYS[1] enrolled set, ARGV[1] sentinel, ARGV[2] class id, ARGV[3] TTL
+# Adds to the set only once it has been built
+ADD_ENROLLED_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    redis.call('SADD', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def enrolled_key(student_id):
+    return f"enrolled:{student_id}"
+
+
+"""Which of class_ids the student is enrolled in, None if the student's set isn't built. r is an async client"""
+async def enrolled_members(r, student_id, class_ids):
+    found = await r.smismember(enrolled_key(student_id), [ENROLLED_SENTINEL, *class_ids])
+    if not found[0]:
+        return None
+    return {class_id for class_id, member in zip(class_ids, found[1:]) if member}
+
+"""Replace the student's set with the class ids read from GSI1, r may be a pipeline"""
+def rebuild_enrolled(r, student_id, class_ids):
+    key = enrolled_key(student_id)
+    r.delete(key)
+    r.sadd(key, ENROLLED_SENTINEL, *class_ids)
+    r.expire(key, ENROLLED_TTL)
+
+"""Record an enrollment in the student's set if it's built, r may be a pipeline
+   Sent with EVAL, a registered script only gets loaded for redis-py's own Pipeline class"""
+def add_enrolled(r, student_id, class_id):
+    r.eval(ADD_ENROLLED_SCRIPT, 1, enrolled_key(student_id), ENROLLED_SENTINEL, class_id, ENROLLED_TTL)
+
+"""Record a drop, r may be a pipeline. EXPIRE is a no-op when there's no set"""
+def remove_enrolled(r, student_id, class_id):
+    key = enrolled_key(student_id)
+    r.srem(key, class_id)
+    r.expire(key, ENROLLED_TTL)
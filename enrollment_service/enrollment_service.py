@@ -1,9 +1,63 @@
-from fastapi import FastAPI
-from enrollment_service.routes import router 
+import time
+
+from fastapi import FastAPI, Request
+from enrollment_service.routes import router
+import enrollment_service.metrics as metrics
+from Utility import log
+
+logger = log.get_logger(__name__)
 
 app = FastAPI()
 
 app.include_router(router)
+
+# Tag every log line of a request with its id, callers can pass their own X-Request-ID
+@app.middleware("http")
+async def request_id(request: Request, call_next):
+    value, token = log.start_request(request.headers.get("X-Request-ID"))
+    try:
+        response = await call_next(request)
+    finally:
+        log.end_request(token)
+    response.headers["X-Request-ID"] = value
+    return response
+
+# Send the Redis writes the request's data context queued and report how many DynamoDB/Redis calls it made.
+# Both happen before the response goes out, so a client reading right after a write doesn't get a cached
+# listing or enrolled set that misses it. A failed flush is logged and counted but the response is kept,
+# the DynamoDB write behind it is committed and the caches catch up through their TTLs and versions
+@app.middleware("http")
+async def finish_data_context(request: Request, call_next):
+    response = await call_next(request)
+    ctx = getattr(request.state, "data_context", None)
+    if ctx is not None:
+        try:
+            await ctx.flush()
+        except Exception:
+            logger.exception("Unable to write the request's Redis updates")
+            route = request.scope.get("route")
+            metrics.record_flush_error(route.path if route is not None else "unmatched")
+        response.headers["X-Backend-Calls"] = str(ctx.backend_calls)
+    return response
+
+# Record request latency and backend calls per route, and report them in Server-Timing
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    recorder = metrics.Recorder(method=request.method)
+    token = metrics.current_recorder.set(recorder)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.current_recorder.reset(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    recorder.finish(route)
+    metrics.record_request(request.method, route, response.status_code, elapsed)
+    response.headers["Server-Timing"] = ", ".join(recorder.server_timing() + [f"total;dur={elapsed * 1000:.1f}"])
+    return response
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
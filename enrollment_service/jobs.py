@@ -0,0 +1,89 @@
+''' This file contains the background job runner for long registrar operations.
+    Jobs run on a small thread pool inside the worker that accepted them, their
+    status and progress live in a Redis hash job:{job_id} so any worker can report it.
+    The job threads use the blocking Redis client, routes create and read jobs with the
+    async one through start_job_async and get_job.'''
+import contextvars
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import enrollment_service.metrics as metrics
+from Utility import log
+
+logger = log.get_logger(__name__)
+
+JOB_TTL = 24 * 60 * 60
+job_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="job")
+
+
+def job_key(job_id):
+    return f"job:{job_id}"
+
+"""Start func(*args, progress=callback) in the background, returns the job id
+   total is the number of items the job will process, used for progress reporting,
+   jobs that only find their items as they go start at 0 and call progress(0, total=n)"""
+def start_job(r, kind, total, func, *args):
+    job_id = uuid.uuid4().hex
+    create_job(r, job_id, kind, total)
+    submit_job(r, job_id, kind, func, *args)
+    return job_id
+
+"""start_job from an async route, the job hash is written with async_r before the job runs on r"""
+async def start_job_async(async_r, r, kind, total, func, *args):
+    job_id = uuid.uuid4().hex
+    pipe = async_r.pipeline(transaction=False)
+    create_job(pipe, job_id, kind, total)
+    await pipe.execute()
+    submit_job(r, job_id, kind, func, *args)
+    return job_id
+
+"""Write a queued job's hash, r may be a pipeline"""
+def create_job(r, job_id, kind, total):
+    r.hset(job_key(job_id), mapping={
+        "kind": kind,
+        "status": "queued",
+        "total": total,
+        "done": 0,
+        "created": time.time(),
+    })
+    r.expire(job_key(job_id), JOB_TTL)
+
+def submit_job(r, job_id, kind, func, *args):
+    # Keep the request id for logs, but record the job's backend calls under its own label
+    context = contextvars.copy_context()
+    context.run(metrics.current_recorder.set, metrics.Recorder(route=f"job:{kind}"))
+    job_executor.submit(context.run, run_job, r, job_id, func, *args)
+
+def run_job(r, job_id, func, *args):
+    key = job_key(job_id)
+    r.hset(key, mapping={"status": "running", "started": time.time()})
+    def progress(count, total=0):
+        if total:
+            r.hincrby(key, "total", total)
+        if count:
+            r.hincrby(key, "done", count)
+    try:
+        finished = func(*args, progress=progress)
+        r.hset(key, mapping={"status": "finished" if finished else "failed", "finished": time.time()})
+    except Exception as error:
+        logger.exception("Job %s failed", job_id)
+        r.hset(key, mapping={"status": "failed", "error": str(error), "finished": time.time()})
+
+"""Get job status as a dict, None if the job doesn't exist. r is an async client"""
+async def get_job(r, job_id):
+    job = await r.hgetall(job_key(job_id))
+    if not job:
+        return None
+    job = {k.decode('utf-8'): v.decode('utf-8') for k, v in job.items()}
+    for field in ("total", "done"):
+        job[field] = int(job[field])
+    for field in ("created", "started", "finished"):
+        if field in job:
+            job[field] = float(job[field])
+    job["id"] = job_id
+    if job["total"]:
+        job["progress"] = job["done"] / job["total"]
+    else:
+        job["progress"] = 1.0 if job["status"] == "finished" else 0.0
+    return job
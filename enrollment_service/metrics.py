@@ -0,0 +1,351 @@
+''' This file contains the backend call metrics for the enrollment service.
+    The DynamoDB and Redis clients in routes are wrapped in proxies that time every call,
+    and for DynamoDB ask for and add up the consumed capacity. Calls are labeled with the
+    route that made them and the outermost query_helper function they ran in.
+    Metrics are kept per worker process and rendered in Prometheus text format by /metrics.'''
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+# Seconds, tuned for DynamoDB/Redis round trips and whole requests
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# DynamoDB operations that accept ReturnConsumedCapacity
+CAPACITY_OPERATIONS = {
+    "get_item", "put_item", "update_item", "delete_item", "query", "scan",
+    "batch_get_item", "batch_write_item", "transact_get_items", "transact_write_items",
+}
+
+current_function = contextvars.ContextVar("metrics_function", default="-")
+current_recorder = contextvars.ContextVar("metrics_recorder", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        if index < len(BUCKETS):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+""" Counters and histograms keyed by (metric name, label tuple) """
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, kind, help_text):
+        self.help[name] = (kind, help_text)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self.histograms.items())
+        described = set()
+        for (name, labels), value in counters:
+            if name not in described:
+                lines.extend(header(name, *self.help.get(name, ("counter", name))))
+                described.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in described:
+                lines.extend(header(name, *self.help.get(name, ("histogram", name))))
+                described.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return lines
+
+def header(name, kind, help_text):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+registry = Registry()
+registry.describe("enrollment_backend_calls_total", "counter", "DynamoDB and Redis calls by route and query_helper function")
+registry.describe("enrollment_backend_errors_total", "counter", "DynamoDB and Redis calls that raised")
+registry.describe("enrollment_backend_call_seconds", "histogram", "DynamoDB and Redis call latency")
+registry.describe("enrollment_dynamodb_consumed_capacity_units_total", "counter", "DynamoDB capacity units consumed")
+registry.describe("enrollment_http_requests_total", "counter", "HTTP requests by route and status")
+registry.describe("enrollment_http_request_seconds", "histogram", "HTTP request latency")
+registry.describe("enrollment_bulk_items_total", "counter", "Registrar bulk items by operation and status")
+registry.describe("enrollment_response_cache_total", "counter", "Student listing response cache lookups by view and result")
+registry.describe("enrollment_existence_checks_total", "counter", "Student and instructor existence checks by source, gateway claims or DynamoDB")
+registry.describe("enrollment_single_flight_total", "counter", "Coalesced reads by role, leader calls the backend, follower and lease_wait share its result")
+registry.describe("enrollment_bulk_chunk_seconds", "histogram", "Registrar bulk chunk latency")
+registry.describe("enrollment_cache_flush_errors_total", "counter", "Requests whose queued Redis updates couldn't be written, the response was still sent")
+
+
+""" Collects the backend calls of one request or job
+    A request only knows its route template once routing is done, so its calls are kept
+    until finish(route). Jobs know their label up front and record straight away, their method is "-".
+    Also keeps the per-backend totals for the Server-Timing header."""
+class Recorder:
+    def __init__(self, method="-", route=None):
+        self.method = method
+        self.route = route
+        self.pending = []
+        self.lock = threading.Lock()
+        self.timings = {}
+
+    def record(self, backend, operation, function, seconds, capacity, failed):
+        with self.lock:
+            calls, total = self.timings.get(backend, (0, 0.0))
+            self.timings[backend] = (calls + 1, total + seconds)
+            if self.route is None:
+                self.pending.append((backend, operation, function, seconds, capacity, failed))
+                return
+        record_call(self.method, self.route, backend, operation, function, seconds, capacity, failed)
+
+    def finish(self, route):
+        with self.lock:
+            self.route = route
+            pending, self.pending = self.pending, []
+        for call in pending:
+            record_call(self.method, route, *call)
+
+    def server_timing(self):
+        with self.lock:
+            timings = sorted(self.timings.items())
+        return [f'{backend};dur={total * 1000:.1f};desc="{calls} calls"' for backend, (calls, total) in timings]
+
+def record_call(method, route, backend, operation, function, seconds, capacity, failed):
+    labels = (("backend", backend), ("operation", operation), ("method", method), ("route", route), ("function", function))
+    registry.inc("enrollment_backend_calls_total", labels)
+    registry.observe("enrollment_backend_call_seconds", labels, seconds)
+    if failed:
+        registry.inc("enrollment_backend_errors_total", labels)
+    if capacity:
+        registry.inc("enrollment_dynamodb_consumed_capacity_units_total", (("operation", operation), ("method", method), ("route", route), ("function", function)), capacity)
+
+def record(backend, operation, seconds, capacity=0.0, failed=False):
+    recorder = current_recorder.get()
+    if recorder is None:
+        record_call("-", "-", backend, operation, current_function.get(), seconds, capacity, failed)
+    else:
+        recorder.record(backend, operation, current_function.get(), seconds, capacity, failed)
+
+def record_request(method, route, status_code, seconds):
+    registry.inc("enrollment_http_requests_total", (("method", method), ("route", route), ("status", str(status_code))))
+    registry.observe("enrollment_http_request_seconds", (("method", method), ("route", route)), seconds)
+
+def record_flush_error(route):
+    registry.inc("enrollment_cache_flush_errors_total", (("route", route),))
+
+def record_response_cache(view, result):
+    registry.inc("enrollment_response_cache_total", (("view", view), ("result", result)))
+
+def record_existence_check(entity, source):
+    registry.inc("enrollment_existence_checks_total", (("entity", entity), ("source", source)))
+
+def record_single_flight(name, role):
+    registry.inc("enrollment_single_flight_total", (("name", name), ("role", role)))
+
+def record_bulk_chunk(operation, statuses, seconds):
+    registry.observe("enrollment_bulk_chunk_seconds", (("operation", operation),), seconds)
+    record_bulk_items(operation, statuses)
+
+"""Count bulk items by status, items rejected before a chunk was sent only go through here"""
+def record_bulk_items(operation, statuses):
+    for status_code in statuses:
+        registry.inc("enrollment_bulk_items_total", (("operation", operation), ("status", str(status_code))))
+
+
+"""Run func in a copy of the caller's context, for work submitted to a thread pool"""
+def in_context(func):
+    return functools.partial(contextvars.copy_context().run, func)
+
+def consumed_capacity(response):
+    consumed = response.get("ConsumedCapacity") if isinstance(response, dict) else None
+    if not consumed:
+        return 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(item.get("CapacityUnits", 0)) for item in consumed)
+
+
+""" Proxy around a boto3 DynamoDB client that times calls and records consumed capacity """
+class InstrumentedDynamoDB:
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith(("get_paginator", "get_waiter", "can_paginate")):
+            return attr
+        def timed(*args, **kwargs):
+            if name in CAPACITY_OPERATIONS:
+                kwargs.setdefault("ReturnConsumedCapacity", "TOTAL")
+            start = time.perf_counter()
+            try:
+                response = attr(*args, **kwargs)
+            except Exception:
+                record("dynamodb", name, time.perf_counter() - start, failed=True)
+                raise
+            record("dynamodb", name, time.perf_counter() - start, consumed_capacity(response))
+            return response
+        return timed
+
+
+""" Proxy around a redis-py client that times calls, a pipeline counts as one call when executed """
+class InstrumentedRedis:
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name == "register_script":
+            return attr
+        if name == "pipeline":
+            return lambda *args, **kwargs: InstrumentedPipeline(attr(*args, **kwargs))
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                record("redis", name, time.perf_counter() - start, failed=True)
+                raise
+            record("redis", name, time.perf_counter() - start)
+            return result
+        return timed
+
+class InstrumentedPipeline:
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def __len__(self):
+        return len(self._pipeline)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._pipeline.__exit__(*exc_info)
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            results = self._pipeline.execute(*args, **kwargs)
+        except Exception:
+            record("redis", "pipeline", time.perf_counter() - start, failed=True)
+            raise
+        record("redis", "pipeline", time.perf_counter() - start)
+        return results
+
+
+""" Proxy around a redis.asyncio client, times awaited calls like InstrumentedRedis """
+class InstrumentedAsyncRedis:
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name == "register_script":
+            return attr
+        if name == "pipeline":
+            return lambda *args, **kwargs: InstrumentedAsyncPipeline(attr(*args, **kwargs))
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await attr(*args, **kwargs)
+            except Exception:
+                record("redis", name, time.perf_counter() - start, failed=True)
+                raise
+            record("redis", name, time.perf_counter() - start)
+            return result
+        return timed
+
+class InstrumentedAsyncPipeline:
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+    def __len__(self):
+        return len(self._pipeline)
+
+    async def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            results = await self._pipeline.execute(*args, **kwargs)
+        except Exception:
+            record("redis", "pipeline", time.perf_counter() - start, failed=True)
+            raise
+        record("redis", "pipeline", time.perf_counter() - start)
+        return results
+
+
+"""Label backend calls with the outermost traced function they run in"""
+def traced(func):
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if current_function.get() != "-":
+            return func(*args, **kwargs)
+        token = current_function.set(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current_function.reset(token)
+    return wrapper
+
+"""Trace every function in a module namespace that takes dynamodb_client first"""
+def trace_functions(namespace):
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if not inspect.isfunction(value) or value.__module__ != module:
+            continue
+        parameters = list(inspect.signature(value).parameters)
+        if parameters and parameters[0] == "dynamodb_client":
+            namespace[name] = traced(value)
+
+
+"""Prometheus text for the registry plus single values passed as {metric name: (type, help, value)}"""
+def render(extra=None):
+    lines = registry.render()
+    for name, (kind, help_text, value) in (extra or {}).items():
+        lines.extend(header(name, kind, help_text))
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,9 +1,26 @@
 ''' This file contains the query for the enrollment service.'''
-from botocore.exceptions import ClientError
-from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError, ParamValidationError
+from boto3.dynamodb.types import TypeSerializer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import base64
+import copy
+import functools
+import inspect
+import json
+import os
 import random 
+import threading
+import time
+
+import enrollment_service.codec as codec
+import enrollment_service.metrics as metrics
+from enrollment_service.single_flight import RedisLease, SingleFlight
+from Utility import log
+
+logger = log.get_logger(__name__)
 
-deserializer = TypeDeserializer()
 serializer = TypeSerializer()
 
 ERROR_HELP_STRINGS = {
@@ -23,20 +40,249 @@ def handle_error(error):
     error_code = error.response['Error']['Code']
     error_message = error.response['Error']['Message']
 
-    error_help_string = ERROR_HELP_STRINGS[error_code]
+    error_help_string = ERROR_HELP_STRINGS.get(error_code, 'Unexpected error')
+
+    logger.error('[%s] %s. Error message: %s', error_code, error_help_string, error_message)
+
+
+# KEYS[1] cache entry, KEYS[2] generation key, ARGV[1] class json, ARGV[2] TTL, ARGV[3] generation read before the fetch
+# Only stores the class if no invalidate() bumped the generation while it was being read
+SET_IF_GENERATION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[3] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+""" Read-through cache for class records returned by query_class
+    First tier is an in-process LRU with a short TTL, second tier is Redis shared by all workers.
+    Writes that change a class call invalidate(), other workers may serve their local copy until the TTL runs out.
+    invalidate() also bumps the class's generation, in this worker and in Redis. A read records
+    generation() before going to DynamoDB and set() drops its result if the generation moved,
+    so a read that raced a write can't put the old class back."""
+class ClassCache:
+    def __init__(self, max_size=1024, local_ttl=2.0, redis_ttl=10):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.redis_client = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+        self.generations = {}
+        self.set_script = None
+
+    def redis_key(self, class_id):
+        return f"class_cache:{class_id}"
+
+    def generation_key(self, class_id):
+        return f"class_cache_gen:{class_id}"
+
+    """Generation of a class to pass to set(), read before fetching it"""
+    def generation(self, class_id):
+        with self.lock:
+            local = self.generations.get(class_id, 0)
+        shared = None
+        if self.redis_client is not None:
+            try:
+                shared = (self.redis_client.get(self.generation_key(class_id)) or b"").decode("ascii")
+            except Exception as error:
+                logger.warning("Class cache unavailable: %s", error)
+        return local, shared
+
+    def get(self, class_id):
+        with self.lock:
+            entry = self.entries.get(class_id)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(class_id)
+                self.local_hits += 1
+                return copy.deepcopy(entry[1])
+        if self.redis_client is not None:
+            try:
+                cached = self.redis_client.get(self.redis_key(class_id))
+            except Exception as error:
+                logger.warning("Class cache unavailable: %s", error)
+                cached = None
+            if cached is not None:
+                class_data = json.loads(cached)
+                self.set_local(class_id, class_data)
+                with self.lock:
+                    self.redis_hits += 1
+                return copy.deepcopy(class_data)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set_local(self, class_id, class_data):
+        with self.lock:
+            self.entries[class_id] = (time.monotonic() + self.local_ttl, class_data)
+            self.entries.move_to_end(class_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def set(self, class_id, class_data, generation):
+        local, shared = generation
+        with self.lock:
+            if self.generations.get(class_id, 0) != local:
+                self.stale_sets += 1
+                return
+        # Decimals from DynamoDB become plain numbers so both tiers hold the same shape
+        class_data = json.loads(json.dumps(class_data, default=decimal_default))
+        self.set_local(class_id, class_data)
+        # Without the generation from Redis there's no telling if another worker invalidated the class
+        if self.redis_client is not None and shared is not None:
+            try:
+                if self.set_script is None:
+                    self.set_script = self.redis_client.register_script(SET_IF_GENERATION_SCRIPT)
+                stored = self.set_script(keys=[self.redis_key(class_id), self.generation_key(class_id)], args=[json.dumps(class_data), self.redis_ttl, shared])
+            except Exception as error:
+                logger.warning("Class cache unavailable: %s", error)
+                return
+            if not stored:
+                with self.lock:
+                    self.entries.pop(class_id, None)
+                    self.stale_sets += 1
+
+    """Poll the Redis tier while another worker holds the read lease, None if nothing shows up in time"""
+    def wait_shared(self, class_id, timeout, interval=0.01):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            cached = self.redis_client.get(self.redis_key(class_id))
+            if cached is not None:
+                class_data = json.loads(cached)
+                self.set_local(class_id, class_data)
+                return class_data
+        return None
+
+    def invalidate(self, class_id):
+        with self.lock:
+            self.entries.pop(class_id, None)
+            self.generations[class_id] = self.generations.get(class_id, 0) + 1
+            self.invalidations += 1
+        class_flights.forget(class_id)
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                pipeline.incr(self.generation_key(class_id))
+                pipeline.expire(self.generation_key(class_id), GENERATION_TTL)
+                pipeline.delete(self.redis_key(class_id))
+                pipeline.execute()
+            except Exception as error:
+                logger.warning("Class cache unavailable: %s", error)
 
-    print('[{error_code}] {help_string}. Error message: {error_message}'
-          .format(error_code=error_code,
-                  help_string=error_help_string,
-                  error_message=error_message))
+    def stats(self):
+        with self.lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "stale_sets": self.stale_sets,
+                "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+                "size": len(self.entries),
+            }
 
+def decimal_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Generation keys outlive any read of a class by far, they only need to exist while one is in flight
+GENERATION_TTL = 24 * 60 * 60
+class_cache = ClassCache()
+
+# Concurrent misses for the same class share one fetch_class in this worker, and with the lease on
+# only one worker reads it from DynamoDB while the others wait for it to show up in the Redis tier
+CLASS_READ_LEASE_MS = int(os.environ.get("CLASS_READ_LEASE_MS", "100"))
+class_flights = SingleFlight("class")
+class_lease = RedisLease("lease:class", CLASS_READ_LEASE_MS)
+
+""" Decorator for writes that change a class record, drops the cached class once the write is done """
+def invalidates_class(func):
+    signature = inspect.signature(func)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        class_id = signature.bind(*args, **kwargs).arguments['class_id']
+        try:
+            return func(*args, **kwargs)
+        finally:
+            class_cache.invalidate(class_id)
+    return wrapper
+
+
+""" Generator over every item of a query, follows LastEvaluatedKey page by page so nothing gets cut off at 1 MB """
+def paginate_query(dynamodb_client, input):
+    input = dict(input)
+    while True:
+        response = dynamodb_client.query(**input)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        input['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+""" Run a query through the paginator
+    With no limit returns every item, otherwise one page of at most limit items starting after start_key.
+    Returns (items, last_key), last_key is None when there is nothing left to read """
+def query_items(dynamodb_client, input, limit=None, start_key=None):
+    if limit is None:
+        return list(paginate_query(dynamodb_client, input)), None
+    input = dict(input)
+    if start_key:
+        input['ExclusiveStartKey'] = start_key
+    items = []
+    while True:
+        input['Limit'] = limit - len(items)
+        try:
+            response = dynamodb_client.query(**input)
+        except (ClientError, ParamValidationError) as error:
+            # The caller's start key came from another query or was tampered with
+            if items or not start_key or (isinstance(error, ClientError) and error.response['Error']['Code'] != 'ValidationException'):
+                raise
+            raise InvalidCursor("Invalid cursor") from error
+        items.extend(response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+        if last_key is None or len(items) >= limit:
+            return items, last_key
+        input['ExclusiveStartKey'] = last_key
+
+""" Raised for a cursor that doesn't decode or that DynamoDB won't take as a start key """
+class InvalidCursor(ValueError):
+    pass
+
+""" Opaque API cursors for LastEvaluatedKey (or any small dict) """
+def encode_cursor(key):
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError) as error:
+        raise InvalidCursor("Invalid cursor") from error
+    if not isinstance(key, dict):
+        raise InvalidCursor("Invalid cursor")
+    return key
 
 
 """Query for available classes given student id"""
 def query_available_classes(dynamodb_client, student_id):
+    return query_available_classes_page(dynamodb_client, student_id)[0]
+
+"""Query one page of available classes given student id, returns (classes, last_key)"""
+def query_available_classes_page(dynamodb_client, student_id, limit=None, start_key=None):
     final_response = []
     ids = []
-    instructor_id = {}
+    last_key = None
     input = {
         "TableName": "TitanOnlineEnrollment",
         "IndexName": "GSI1",
@@ -45,61 +291,87 @@ def query_available_classes(dynamodb_client, student_id):
         "ExpressionAttributeValues": {":ec990": {"S":f"s#{student_id}"},":ec991": {"S":"c#open#"}}
     }
     try:
-        response = dynamodb_client.query(**input)
+        items, last_key = query_items(dynamodb_client, input, limit, start_key)
         # Parse data from response
-        items = response['Items']
         if items:
-            formatted_response = [{'Detail': item['Detail']} for item in items]
-            ids = [{'id': item['GSI1_SK']['S'].split("#")[-1]} for item in items]
-            python_data = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            final_response = []
-
-            for item in python_data:
-                # append ids from id to item['Detail']
-                item['Detail'].update(ids[python_data.index(item)])
-                final_response.append(item['Detail'])
-            print("Query successful.")
+            final_response = [codec.ClassListing.from_open_item(item).to_dict() for item in items]
+            log.sampled(logger, "Query successful.")
         else:
-            return None
+            return None, last_key
+    except InvalidCursor:
+        raise
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])    
-    # Get instructor id for each class
+        logger.exception("Unknown error while querying")
+    # Get instructor id for each class with one batch_get_item instead of a GSI3 query per class
     non_dupes_class_id = list(set([item['id'] for item in final_response]))
-    for class_id in non_dupes_class_id:
-        input = {
-            "TableName": "TitanOnlineEnrollment",
-            "IndexName": "GSI3",
-            "KeyConditionExpression": "#e55c0 = :e55c0 And begins_with(#e55c1, :e55c1)",
-            "ExpressionAttributeNames": {"#e55c0":"GSI3_PK","#e55c1":"GSI3_SK"},
-            "ExpressionAttributeValues": {":e55c0": {"S":f"c#{class_id}"},":e55c1": {"S":"i#"}}
-        }
-        try:
-            response = dynamodb_client.query(**input)
-            # Parse data from response
-            if len(response['Items']) > 0:
-                item = response['Items']
-                class_id = item[0]['GSI3_PK']['S'].split("c#")[1]
-                instructor_uid = item[0]['GSI3_SK']['S'].split("i#")[1]
-                instructor_id[class_id] = instructor_uid
-                print("Query successful.")
-            else:
-                return None
-        except ClientError as error:
-            handle_error(error)
-            return None
-        except BaseException as error:
-            print("Unknown error while querying: " + error.response['Error']['Message'])
-            return None
+    instructor_id = batch_query_class_instructors(dynamodb_client, non_dupes_class_id)
+    if instructor_id is None:
+        return None, None
     # Add instructor id to each class
     for item in final_response:
         if item['id'] in instructor_id:
             item['instructorId'] = instructor_id[item['id']]
-    return final_response
+    return final_response, last_key
+
+""" Query instructor ids for a list of class ids using batch_get_item on the class items
+    Returns a dict of class_id -> instructor_id """
+def batch_query_class_instructors(dynamodb_client, class_ids):
+    keys = [{"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"c#{class_id}"}} for class_id in class_ids]
+    try:
+        items = batch_get_items(dynamodb_client, keys, projection="PK, GSI3_SK")
+        log.sampled(logger, "Query successful.")
+    except ClientError as error:
+        handle_error(error)
+        return None
+    except BaseException as error:
+        logger.exception("Unknown error while querying")
+        return None
+    return {pk.split("c#")[1]: item['GSI3_SK']['S'].split("i#")[1] for pk, item in items.items() if 'GSI3_SK' in item}
+
+""" Batch get engine: splits keys into chunks of 100, runs the chunks concurrently on batch_executor
+    and retries UnprocessedKeys with exponential back-off.
+    Returns a dict of PK -> raw item, so callers can put results back in their own order.
+    Raises the ClientError, or RuntimeError if keys are still unprocessed after BATCH_GET_RETRIES """
+BATCH_GET_LIMIT = 100
+BATCH_GET_RETRIES = 5
+BATCH_GET_BACKOFF = 0.05
+batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="batch_get")
+
+def batch_get_chunk(dynamodb_client, keys, projection=None):
+    request = {"Keys": keys}
+    if projection:
+        request["ProjectionExpression"] = projection
+    request_items = {"TitanOnlineEnrollment": request}
+    items = []
+    for attempt in range(BATCH_GET_RETRIES + 1):
+        response = dynamodb_client.batch_get_item(RequestItems=request_items)
+        items.extend(response['Responses'].get('TitanOnlineEnrollment', []))
+        # Keep asking for the keys DynamoDB didn't get to
+        request_items = response.get('UnprocessedKeys')
+        if not request_items:
+            return items
+        time.sleep(BATCH_GET_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0))
+    raise RuntimeError(f"{len(request_items['TitanOnlineEnrollment']['Keys'])} keys still unprocessed after {BATCH_GET_RETRIES} retries")
+
+def batch_get_items(dynamodb_client, keys, projection=None):
+    # batch_get_item rejects duplicate keys in one request
+    unique_keys = list({key["PK"]["S"]: key for key in keys}.values())
+    chunks = [unique_keys[i:i + BATCH_GET_LIMIT] for i in range(0, len(unique_keys), BATCH_GET_LIMIT)]
+    if len(chunks) == 1:
+        results = [batch_get_chunk(dynamodb_client, chunks[0], projection)]
+    else:
+        futures = [batch_executor.submit(metrics.in_context(batch_get_chunk), dynamodb_client, chunk, projection) for chunk in chunks]
+        results = [future.result() for future in futures]
+    return {item['PK']['S']: item for chunk_items in results for item in chunk_items}
 
 """Query for enrolled classes given student id"""
 def query_enrolled_classes(dynamodb_client, student_id):
+    return query_enrolled_classes_page(dynamodb_client, student_id)[0]
+
+"""Query one page of enrolled classes given student id, returns (classes, last_key)"""
+def query_enrolled_classes_page(dynamodb_client, student_id, limit=None, start_key=None):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "IndexName": "GSI1",
@@ -108,29 +380,44 @@ def query_enrolled_classes(dynamodb_client, student_id):
         "ExpressionAttributeValues": {":ec990": {"S":f"s#{student_id}"},":ec991": {"S":"c#enrolled#"}}
     }
     try:
-        response = dynamodb_client.query(**input)
+        items, last_key = query_items(dynamodb_client, input, limit, start_key)
         # Parse data from response
-        items = response['Items']
         if items:
-            formatted_response = [{'Detail': item['Detail']} for item in items]
-            ids = [{'id': item['PK']['S'].split("#")[-1]} for item in items]
-            python_data = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            final_response = []
-
-            for item in python_data:
-                # append ids from id to item['Detail']
-                item['Detail'].update(ids[python_data.index(item)])
-                final_response.append(item['Detail'])
-            print("Query successful.")
+            final_response = [codec.ClassListing.from_enrolled_item(item).to_dict() for item in items]
+            log.sampled(logger, "Query successful.")
         else:
-            return None
+            return None, last_key
 
-        return final_response
+        return final_response, last_key
+
+    except InvalidCursor:
+        raise
+    except ClientError as error:
+        handle_error(error)
+    except BaseException as error:
+        logger.exception("Unknown error while querying")
+    return None, None
 
+""" Query the ids of the classes a student is enrolled in, reads GSI1 keys only. None on error """
+def query_enrolled_class_ids(dynamodb_client, student_id):
+    input = {
+        "TableName": "TitanOnlineEnrollment",
+        "IndexName": "GSI1",
+        "KeyConditionExpression": "#ec990 = :ec990 And begins_with(#ec991, :ec991)",
+        "ExpressionAttributeNames": {"#ec990":"GSI1_PK","#ec991":"GSI1_SK"},
+        "ExpressionAttributeValues": {":ec990": {"S":f"s#{student_id}"},":ec991": {"S":"c#enrolled#"}},
+        "ProjectionExpression": "#ec991"
+    }
+    try:
+        items, _ = query_items(dynamodb_client, input)
+        log.sampled(logger, "Query successful.")
+        return [codec.key_id(item['GSI1_SK']['S']) for item in items]
     except ClientError as error:
         handle_error(error)
+        return None
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
+        return None
 
 
 """Query for student given student id"""
@@ -146,58 +433,72 @@ def query_student(dynamodb_client, student_id):
         response = dynamodb_client.get_item(**input)
         # Parse data from response
         if "Item" in response:
-            item = response['Item']
-            student_data = {k: deserializer.deserialize(v) for k,v in item.items()}
-            # Get rid off PK and SK from student_data and add id as key
-            student_data['id'] = item['PK']['S'].split("s#")[1]
-            student_data = {k: student_data[k] for k in student_data if k not in ['PK', 'SK', 'EntityType']}
-            print("Query successful.")
+            student_data = codec.Student.from_item(response['Item']).to_dict()
+            log.sampled(logger, "Query successful.")
         else:
             return None
         return student_data
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
 
 """ Query for student given student ids using batch_get_item """
 def batch_query_student(dynamodb_client, student_ids):
-    input = {
-        "RequestItems": {
-            "TitanOnlineEnrollment": {
-                "Keys": [{"PK": {"S":f"{student_id}"}, "SK": {"S":f"{student_id}"}} for student_id in student_ids]
-            }
-        }
-    }
+    keys = [{"PK": {"S":f"{student_id}"}, "SK": {"S":f"{student_id}"}} for student_id in student_ids]
     try:
-        response = dynamodb_client.batch_get_item(**input)
-        # Parse data from response
-        if "Responses" in response:
-            items = response['Responses']['TitanOnlineEnrollment']
-            ids = [{'id': item['PK']['S'].split("s#")[1]} for item in items]
-            print(ids)
-            student_infos = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in items]        
-            final_response = []
-            # Format response
-            for item in student_infos:
-                # append ids from id, remove SK, EntityType, and PK
-                item.update(ids[student_infos.index(item)])
-                item.pop('SK', None)
-                item.pop('EntityType', None)
-                item.pop('PK', None)
-                final_response.append(item)
-            print("Query successful.")
-        else:
-            return None
+        items = batch_get_items(dynamodb_client, keys)
+        # Format response in the same order as student_ids, skipping students that don't exist
+        final_response = []
+        for student_id in student_ids:
+            item = items.get(student_id)
+            if item is None:
+                continue
+            final_response.append(codec.Student.from_item(item).to_dict())
+        log.sampled(logger, "Query successful.")
         return final_response
-    
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
 
-"""Query for class given class id"""
+"""Query for class given class id, served from class_cache when possible"""
 def query_class(dynamodb_client, class_id):
+    class_data = class_cache.get(class_id)
+    if class_data is not None:
+        return class_data
+    return class_flights.do(class_id, load_class, dynamodb_client, class_id)
+
+"""Read a class into class_cache, waits for the worker holding the class's read lease instead when there is one
+   Falls back to reading it itself if the lease holder doesn't fill the cache in time"""
+def load_class(dynamodb_client, class_id):
+    r = class_cache.redis_client
+    token = None
+    if r is not None and class_lease.lease_ms > 0:
+        try:
+            token = class_lease.acquire(r, class_id)
+            if token is None:
+                class_data = class_cache.wait_shared(class_id, class_lease.lease_ms / 1000)
+                metrics.record_single_flight("class", "lease_wait" if class_data is not None else "lease_timeout")
+                if class_data is not None:
+                    return class_data
+        except Exception as error:
+            logger.warning("Class read lease unavailable: %s", error)
+    try:
+        generation = class_cache.generation(class_id)
+        class_data = fetch_class(dynamodb_client, class_id)
+        if class_data:
+            class_cache.set(class_id, class_data, generation)
+        return class_data
+    finally:
+        if token is not None:
+            try:
+                class_lease.release(r, class_id, token)
+            except Exception as error:
+                logger.warning("Class read lease unavailable: %s", error)
+
+"""Query DynamoDB for class given class id, bypassing the cache"""
+def fetch_class(dynamodb_client, class_id):
     class_data = {}
     input = {
         "TableName": "TitanOnlineEnrollment",
@@ -210,133 +511,404 @@ def query_class(dynamodb_client, class_id):
         response = dynamodb_client.query(**input)
         # Parse data from response
         if len(response['Items']) > 0:
-            item = response['Items']
-            class_data = {k: deserializer.deserialize(v) for k,v in item[0].items()}
-            # Get rid off PK and SK from class_data and add id as key
-            class_data['id'] = item[0]['PK']['S'].split("#")[-1]
-            class_data['instructorId'] = item[0]['GSI3_SK']['S'].split("i#")[1]
-            class_data = {k: class_data[k] for k in class_data if k not in ['PK', 'SK', 'EntityType']}
-            print("Query successful.")
+            class_record = codec.ClassRecord.from_item(response['Items'][0])
+            if class_record.counter_shards:
+                class_record.current_enroll = sum(count for count, _ in query_counter_shards(dynamodb_client, class_id))
+            class_data = class_record.to_dict()
+            log.sampled(logger, "Query successful.")
         else:
             return None
     except ClientError as error:
         handle_error(error)
         return None
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
         return None
     return class_data
 
-"""Check if class exists"""
-def check_class_exists(dynamodb_client, class_id):
-    input = {
-        "TableName": "TitanOnlineEnrollment",
-        "Key": {
-            "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"c#{class_id}"}
-        }
-    }
-    try:
-        response = dynamodb_client.get_item(**input)
-        # Parse data from response
-        if "Item" in response:
-            print("Query successful.")
-            return True
-        else:
-            return False
-    except ClientError as error:
-        handle_error(error)
-    except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
-
-"""Update currentEnroll for a class"""
-def update_current_enroll(dynamodb_client, class_id, new_enroll):
+"""Atomically add amount to currentEnroll for a class (negative amount to decrement)
+   shards is the class's CounterShards as last read, hot classes take the decrement off a shard"""
+@invalidates_class
+def increment_current_enroll(dynamodb_client, class_id, amount, shards=0):
+    # Falls back to the class item below in case the class is no longer hot
+    if shards and adjust_counter_shards(dynamodb_client, class_id, shards, amount):
+        return True
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Key": {
             "PK": {"S":f"c#{class_id}"}, 
             "SK": {"S":f"c#{class_id}"}
         },
-        "UpdateExpression": "SET #ec992 = :ec992",
-        "ExpressionAttributeNames": {"#ec992":"currentEnroll"},
-        "ExpressionAttributeValues": {":ec992": {"N":str(new_enroll)}}
+        "UpdateExpression": "ADD #ec992 :ec992",
+        # A hot class counts in its shards, currentEnroll on the class item isn't used
+        "ConditionExpression": "attribute_not_exists(#ec995)",
+        "ExpressionAttributeNames": {"#ec992":"currentEnroll","#ec995":"CounterShards"},
+        "ExpressionAttributeValues": {":ec992": {"N":str(amount)}},
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD"
     }
     try:
         response = dynamodb_client.update_item(**input)
-        print("Update successful.")
+        log.sampled(logger, "Update successful.")
         return True
     except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException' and not shards:
+            # The class became hot since it was read
+            shards = codec.decode_number(error.response.get('Item', {}).get('CounterShards', {}).get('N', '0'))
+            if shards:
+                return adjust_counter_shards(dynamodb_client, class_id, shards, amount)
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while updating: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while updating")
         return False
 
-"""Update enrolled class for a student"""
-def update_enrolled_class(dynamodb_client, student_id, class_id):
-    # delete PK of c#class_id and SK of s#student_id and s#dropped#student_id if exists
-    input = {
-        "TableName": "TitanOnlineEnrollment",
-        "Key": {
-            "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"s#{student_id}"}
+""" Enroll student in class with a single conditional transaction
+    Puts the enrollment row, deletes the open/dropped rows and increments currentEnroll
+    guarded by currentEnroll < maxEnroll AND Frozen = false so concurrent workers can't overbook.
+    Hot classes take a seat from one of their counter shards instead, see enroll_student_sharded.
+    Returns one of ENROLL_OK, ENROLL_DUPLICATE, ENROLL_FULL, ENROLL_FROZEN, ENROLL_ERROR """
+ENROLL_OK = "enrolled"
+ENROLL_DUPLICATE = "duplicate"
+ENROLL_FULL = "full"
+ENROLL_FROZEN = "frozen"
+ENROLL_ERROR = "error"
+# The class switched between single and sharded counters since class_detail was read
+ENROLL_MODE_CHANGED = "mode_changed"
+
+def enroll_student_transaction(dynamodb_client, student_id, class_id, class_detail):
+    if counter_shards(class_detail):
+        result = enroll_student_sharded(dynamodb_client, student_id, class_id, class_detail)
+    else:
+        result = enroll_student_single(dynamodb_client, student_id, class_id, class_detail)
+    if result != ENROLL_MODE_CHANGED:
+        return result
+    class_detail = fetch_class(dynamodb_client, class_id)
+    if not class_detail:
+        return ENROLL_ERROR
+    if counter_shards(class_detail):
+        result = enroll_student_sharded(dynamodb_client, student_id, class_id, class_detail)
+    else:
+        result = enroll_student_single(dynamodb_client, student_id, class_id, class_detail)
+    return ENROLL_ERROR if result == ENROLL_MODE_CHANGED else result
+
+""" Enrollment row put and open/dropped row deletes, the first three items of an enroll transaction """
+def enrollment_transact_items(student_id, class_id, class_detail):
+    serialized_class_detail = serializer.serialize(class_detail['Detail'])
+    return [
+        {
+            "Put": {
+                "TableName": "TitanOnlineEnrollment",
+                "Item": {
+                    "PK": {"S":f"c#{class_id}"},
+                    "SK": {"S":f"s#enrolled#{student_id}"},
+                    "GSI1_PK": {"S":f"s#{student_id}"},
+                    "GSI1_SK": {"S":f"c#enrolled#{class_id}"},
+                    "EntityType": {"S":"enrollment"},
+                    "Detail": serialized_class_detail
+                },
+                "ConditionExpression": "attribute_not_exists(PK)"
+            }
+        },
+        {
+            "Delete": {
+                "TableName": "TitanOnlineEnrollment",
+                "Key": {
+                    "PK": {"S":f"c#{class_id}"},
+                    "SK": {"S":f"s#{student_id}"}
+                }
+            }
+        },
+        {
+            "Delete": {
+                "TableName": "TitanOnlineEnrollment",
+                "Key": {
+                    "PK": {"S":f"c#{class_id}"},
+                    "SK": {"S":f"s#dropped#{student_id}"}
+                }
+            }
         }
-    }
-    try:
-        response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
-    except ClientError as error:
+    ]
+
+def cancellation_reasons(error):
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
         handle_error(error)
-        return False
-    except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
-        return False
-    
+        return None
+    return error.response.get('CancellationReasons', [])
+
+def condition_failed(reasons, index):
+    return len(reasons) > index and reasons[index].get('Code') == 'ConditionalCheckFailed'
+
+@invalidates_class
+def enroll_student_single(dynamodb_client, student_id, class_id, class_detail):
     input = {
-    "TableName": "TitanOnlineEnrollment",
-    "Key": {
-        "PK": {"S":f"c#{class_id}"}, 
-        "SK": {"S":f"s#dropped#{student_id}"}
+        "TransactItems": enrollment_transact_items(student_id, class_id, class_detail) + [
+            {
+                "Update": {
+                    "TableName": "TitanOnlineEnrollment",
+                    "Key": {
+                        "PK": {"S":f"c#{class_id}"},
+                        "SK": {"S":f"c#{class_id}"}
+                    },
+                    "UpdateExpression": "ADD #ec992 :one",
+                    "ConditionExpression": "#ec992 < #ec993 AND #ec994 = :false AND attribute_not_exists(#ec995)",
+                    "ExpressionAttributeNames": {"#ec992":"currentEnroll","#ec993":"maxEnroll","#ec994":"Frozen","#ec995":"CounterShards"},
+                    "ExpressionAttributeValues": {":one": {"N":"1"}, ":false": {"BOOL": False}},
+                    "ReturnValuesOnConditionCheckFailure": "ALL_OLD"
+                }
+            }
+        ]
     }
-}
     try:
-        response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
+        dynamodb_client.transact_write_items(**input)
+        log.sampled(logger, "Transaction successful.")
+        return ENROLL_OK
     except ClientError as error:
-        handle_error(error)
-        return False
+        reasons = cancellation_reasons(error)
+        if reasons is None:
+            return ENROLL_ERROR
+        # Work out which condition failed from the cancellation reasons (same order as TransactItems)
+        if condition_failed(reasons, 0):
+            return ENROLL_DUPLICATE
+        if condition_failed(reasons, 3):
+            old_class = reasons[3].get('Item', {})
+            if old_class.get('Frozen', {}).get('BOOL'):
+                return ENROLL_FROZEN
+            if 'CounterShards' in old_class:
+                return ENROLL_MODE_CHANGED
+            return ENROLL_FULL
+        logger.warning("Transaction cancelled: %s", error.response['Error']['Message'])
+        return ENROLL_ERROR
     except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
-        return False
-    
+        logger.exception("Unknown error while enrolling")
+        return ENROLL_ERROR
+
+
+""" Sharded enrollment counters for hot classes
+    A hot class keeps its enrollment count in counter_shards items c#class_id/counter#enroll#n
+    instead of currentEnroll on the class item, so enrollments and drops of a popular class
+    spread their writes over several items. maxEnroll is split into a cap per shard, a seat is
+    reserved by incrementing a shard below its cap, so the shards together never exceed maxEnroll.
+    The class item's CounterShards attribute marks the class hot, reads add the shards up.
+    Enrolling in a hot class doesn't invalidate the class cache, the cached sum may lag by the
+    cache TTL, which is fine since capacity is enforced by the shard caps. """
+MAX_COUNTER_SHARDS = 32
+COUNTER_MODE_RETRIES = 5
+
+def counter_shards(class_data):
+    return class_data.get('CounterShards', 0)
 
-    # add new entry of c#class_id and s#enrolled#student_id with GSI1_PK as s#student_id and GSI1_SK as c#enrolled#class_id
-    class_detail = query_class(dynamodb_client, class_id)
-    serialized_class_detail = {k: serializer.serialize(v) for k,v in class_detail.items()}
-    print(serialized_class_detail)
+def counter_shard_key(class_id, shard):
+    return {"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"counter#enroll#{shard}"}}
+
+""" (count, cap) of every counter shard of a class """
+def query_counter_shards(dynamodb_client, class_id, consistent=False):
     input = {
         "TableName": "TitanOnlineEnrollment",
-        "Item": {
-            "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"s#enrolled#{student_id}"},
-            "GSI1_PK": {"S":f"s#{student_id}"},
-            "GSI1_SK": {"S":f"c#enrolled#{class_id}"},
-            "EntityType": {"S":"enrollment"},
-            "Detail": serialized_class_detail['Detail']
-        }
+        "KeyConditionExpression": "#cs100 = :cs100 And begins_with(#cs101, :cs101)",
+        "ExpressionAttributeNames": {"#cs100":"PK","#cs101":"SK","#cs102":"count","#cs103":"cap"},
+        "ExpressionAttributeValues": {":cs100": {"S":f"c#{class_id}"},":cs101": {"S":"counter#enroll#"}},
+        "ProjectionExpression": "#cs101, #cs102, #cs103",
+        "ConsistentRead": consistent
     }
+    items, _ = query_items(dynamodb_client, input)
+    return [codec.counter_shard(item) for item in items]
 
-    try:
-        response = dynamodb_client.put_item(**input)
-        print("Put successful.")
-        print(response)
-        return True
-    except ClientError as error:
-        handle_error(error)
-        return False
-    except BaseException as error:
-        print("Unknown error while putting: " + error.response['Error']['Message'])
-        return False
+""" Split max_enroll seats and current_enroll enrolled students over shards, returns [(count, cap)] """
+def split_counter(current_enroll, max_enroll, shards):
+    caps = [max_enroll // shards + (1 if shard < max_enroll % shards else 0) for shard in range(shards)]
+    counts = []
+    for cap in caps:
+        count = min(cap, current_enroll)
+        counts.append(count)
+        current_enroll -= count
+    # Classes enrolled past maxEnroll keep their extra students on the last shard
+    counts[-1] += current_enroll
+    return list(zip(counts, caps))
+
+def enroll_student_sharded(dynamodb_client, student_id, class_id, class_detail):
+    shards = counter_shards(class_detail)
+    # Start at a random shard so concurrent enrollments land on different items
+    for shard in random.sample(range(shards), shards):
+        input = {
+            "TransactItems": enrollment_transact_items(student_id, class_id, class_detail) + [
+                {
+                    "Update": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Key": counter_shard_key(class_id, shard),
+                        "UpdateExpression": "ADD #cs102 :one",
+                        "ConditionExpression": "#cs102 < #cs103",
+                        "ExpressionAttributeNames": {"#cs102":"count","#cs103":"cap"},
+                        "ExpressionAttributeValues": {":one": {"N":"1"}}
+                    }
+                },
+                {
+                    "ConditionCheck": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Key": {
+                            "PK": {"S":f"c#{class_id}"},
+                            "SK": {"S":f"c#{class_id}"}
+                        },
+                        "ConditionExpression": "#ec994 = :false AND attribute_exists(#ec995)",
+                        "ExpressionAttributeNames": {"#ec994":"Frozen","#ec995":"CounterShards"},
+                        "ExpressionAttributeValues": {":false": {"BOOL": False}},
+                        "ReturnValuesOnConditionCheckFailure": "ALL_OLD"
+                    }
+                }
+            ]
+        }
+        try:
+            dynamodb_client.transact_write_items(**input)
+            log.sampled(logger, "Transaction successful.")
+            return ENROLL_OK
+        except ClientError as error:
+            reasons = cancellation_reasons(error)
+            if reasons is None:
+                return ENROLL_ERROR
+            if condition_failed(reasons, 0):
+                return ENROLL_DUPLICATE
+            if condition_failed(reasons, 4):
+                old_class = reasons[4].get('Item', {})
+                if old_class.get('Frozen', {}).get('BOOL'):
+                    return ENROLL_FROZEN
+                return ENROLL_MODE_CHANGED
+            # This shard is at its cap or another transaction holds it, try the next one
+            if condition_failed(reasons, 3) or any(reason.get('Code') == 'TransactionConflict' for reason in reasons):
+                continue
+            logger.warning("Transaction cancelled: %s", error.response['Error']['Message'])
+            return ENROLL_ERROR
+        except BaseException as error:
+            logger.exception("Unknown error while enrolling")
+            return ENROLL_ERROR
+    return ENROLL_FULL
+
+""" Add amount (negative to remove) students to a hot class's shards
+    Removals come off the first shard that has enough students, additions go to a random
+    shard and only need it to exist, the caps only hold back enroll_student_sharded """
+def adjust_counter_shards(dynamodb_client, class_id, shards, amount):
+    for shard in random.sample(range(shards), shards):
+        input = {
+            "TableName": "TitanOnlineEnrollment",
+            "Key": counter_shard_key(class_id, shard),
+            "UpdateExpression": "ADD #cs102 :cs102",
+            "ConditionExpression": "#cs102 >= :cs104" if amount < 0 else "attribute_exists(#cs102)",
+            "ExpressionAttributeNames": {"#cs102":"count"},
+            "ExpressionAttributeValues": {":cs102": {"N":str(amount)}, **({":cs104": {"N":str(-amount)}} if amount < 0 else {})}
+        }
+        try:
+            dynamodb_client.update_item(**input)
+            log.sampled(logger, "Update successful.")
+            return True
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                handle_error(error)
+                return False
+        except BaseException as error:
+            logger.exception("Unknown error while updating")
+            return False
+    return False
+
+""" Make a class hot, moves its currentEnroll into shards counter items
+    Conditioned on currentEnroll not changing in between, retried if an enrollment got there first """
+@invalidates_class
+def enable_counter_shards(dynamodb_client, class_id, shards):
+    for attempt in range(COUNTER_MODE_RETRIES):
+        try:
+            response = dynamodb_client.get_item(
+                TableName="TitanOnlineEnrollment",
+                Key={"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"c#{class_id}"}},
+                ConsistentRead=True
+            )
+            if "Item" not in response or "CounterShards" in response["Item"]:
+                return False
+            class_item = response["Item"]
+            current_enroll = class_item["currentEnroll"]["N"]
+            split = split_counter(int(current_enroll), int(class_item["maxEnroll"]["N"]), shards)
+            transact_items = [
+                {
+                    "Update": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Key": {"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"c#{class_id}"}},
+                        "UpdateExpression": "SET #ec995 = :shards",
+                        "ConditionExpression": "#ec992 = :current AND attribute_not_exists(#ec995)",
+                        "ExpressionAttributeNames": {"#ec992":"currentEnroll","#ec995":"CounterShards"},
+                        "ExpressionAttributeValues": {":shards": {"N":str(shards)}, ":current": {"N":current_enroll}}
+                    }
+                }
+            ]
+            for shard, (count, cap) in enumerate(split):
+                transact_items.append({
+                    "Put": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Item": {
+                            **counter_shard_key(class_id, shard),
+                            "EntityType": {"S":"counter"},
+                            "count": {"N":str(count)},
+                            "cap": {"N":str(cap)}
+                        }
+                    }
+                })
+            dynamodb_client.transact_write_items(TransactItems=transact_items)
+            log.sampled(logger, "Transaction successful.")
+            return True
+        except ClientError as error:
+            if cancellation_reasons(error) is None:
+                return False
+        except BaseException as error:
+            logger.exception("Unknown error while sharding enrollment counter")
+            return False
+    logger.warning("Class %s kept changing, counter shards not enabled", class_id)
+    return False
+
+""" Make a hot class a regular class again, adds its shards back into currentEnroll
+    Each shard delete is conditioned on the count that was added up """
+@invalidates_class
+def disable_counter_shards(dynamodb_client, class_id):
+    for attempt in range(COUNTER_MODE_RETRIES):
+        try:
+            input = {
+                "TableName": "TitanOnlineEnrollment",
+                "KeyConditionExpression": "#cs100 = :cs100 And begins_with(#cs101, :cs101)",
+                "ExpressionAttributeNames": {"#cs100":"PK","#cs101":"SK","#cs102":"count"},
+                "ExpressionAttributeValues": {":cs100": {"S":f"c#{class_id}"},":cs101": {"S":"counter#enroll#"}},
+                "ProjectionExpression": "#cs101, #cs102",
+                "ConsistentRead": True
+            }
+            items, _ = query_items(dynamodb_client, input)
+            current_enroll = sum(codec.decode_number(item['count']['N']) for item in items)
+            transact_items = [
+                {
+                    "Update": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Key": {"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"c#{class_id}"}},
+                        "UpdateExpression": "SET #ec992 = :current REMOVE #ec995",
+                        "ConditionExpression": "attribute_exists(#ec995)",
+                        "ExpressionAttributeNames": {"#ec992":"currentEnroll","#ec995":"CounterShards"},
+                        "ExpressionAttributeValues": {":current": {"N":str(current_enroll)}}
+                    }
+                }
+            ]
+            for item in items:
+                transact_items.append({
+                    "Delete": {
+                        "TableName": "TitanOnlineEnrollment",
+                        "Key": {"PK": {"S":f"c#{class_id}"}, "SK": item['SK']},
+                        "ConditionExpression": "#cs102 = :count",
+                        "ExpressionAttributeNames": {"#cs102":"count"},
+                        "ExpressionAttributeValues": {":count": item['count']}
+                    }
+                })
+            dynamodb_client.transact_write_items(TransactItems=transact_items)
+            log.sampled(logger, "Transaction successful.")
+            return True
+        except ClientError as error:
+            reasons = cancellation_reasons(error)
+            if reasons is None or condition_failed(reasons, 0):
+                return False
+        except BaseException as error:
+            logger.exception("Unknown error while merging enrollment counter")
+            return False
+    logger.warning("Class %s kept changing, counter shards not disabled", class_id)
+    return False
 
 """Query for instructor given instructor id"""
 def query_instructor(dynamodb_client, instructor_id):
@@ -351,19 +923,15 @@ def query_instructor(dynamodb_client, instructor_id):
         response = dynamodb_client.get_item(**input)
         # Parse data from response
         if "Item" in response:
-            item = response['Item']
-            instructor_data = {k: deserializer.deserialize(v) for k,v in item.items()}
-            # Get rid off PK and SK from instructor_data and add id as key
-            instructor_data['id'] = item['PK']['S'].split("i#")[1]
-            instructor_data = {k: instructor_data[k] for k in instructor_data if k not in ['PK', 'SK', 'EntityType']}
-            print("Query successful.")
+            instructor_data = codec.Instructor.from_item(response['Item']).to_dict()
+            log.sampled(logger, "Query successful.")
         else:
             return None
         return instructor_data
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
 
 """Query to see if the class belongs to the instructor"""
 def query_class_instructor(dynamodb_client, instructor_id, class_id):
@@ -385,90 +953,141 @@ def query_class_instructor(dynamodb_client, instructor_id, class_id):
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
         return False
     
 """ Query enrolled students for a class """
 def query_enrolled_students(dynamodb_client, class_id):
+    return query_enrolled_students_page(dynamodb_client, class_id)[0]
+
+""" Query one page of enrolled students for a class, returns (students, last_key) """
+def query_enrolled_students_page(dynamodb_client, class_id, limit=None, start_key=None):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "KeyConditionExpression": "#cd420 = :cd420 And begins_with(#cd421, :cd421)",
         "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK"},
         "ExpressionAttributeValues": {":cd420": {"S":f"c#{class_id}"},":cd421": {"S":"s#enrolled"}}    }
     try:
-        response = dynamodb_client.query(**input)
+        items, last_key = query_items(dynamodb_client, input, limit, start_key)
         # Parse data from response
-        items = response['Items']
         if items:
-            formatted_response = [{'StudentId': item['GSI1_PK']} for item in items]
-            # ids = [{'id': item['PK']['S'].split("c#")[1]} for item in items]
-            student_ids = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            # Create list of student ids from student_ids
-            student_ids = [student_id["StudentId"] for student_id in student_ids]
+            student_ids = [codec.enrollment_student_key(item) for item in items]
             # Get each student's info from student ids and append to final_response
             student_info = batch_query_student(dynamodb_client, student_ids)
-            return student_info
+            return student_info, last_key
         else:
-            return None
+            return None, last_key
 
+    except InvalidCursor:
+        raise
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
+    return None, None
 
-""" Query all students for a class """
-def query_all_students(dynamodb_client, class_id):
+""" Query ids of the classes an instructor teaches through GSI2, returns a list of class ids or None on error """
+def query_instructor_classes(dynamodb_client, instructor_id):
+    input = {
+        "TableName": "TitanOnlineEnrollment",
+        "IndexName": "GSI2",
+        "KeyConditionExpression": "#77100 = :77100 And begins_with(#77101, :77101)",
+        "ExpressionAttributeNames": {"#77100":"GSI2_PK","#77101":"GSI2_SK"},
+        "ExpressionAttributeValues": {":77100": {"S":f"i#{instructor_id}"},":77101": {"S":"c#"}},
+        "ProjectionExpression": "#77101"
+    }
+    try:
+        items, _ = query_items(dynamodb_client, input)
+        log.sampled(logger, "Query successful.")
+        return [codec.key_id(item['GSI2_SK']['S']) for item in items]
+    except ClientError as error:
+        handle_error(error)
+    except BaseException as error:
+        logger.exception("Unknown error while querying")
+    return None
+
+""" Query class items for a list of class ids with batch_get_item, returns a dict of class_id -> class data """
+def batch_query_classes(dynamodb_client, class_ids):
+    keys = [{"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"c#{class_id}"}} for class_id in class_ids]
+    try:
+        class_records = [codec.ClassRecord.from_item(item) for item in batch_get_items(dynamodb_client, keys).values()]
+        for class_record in class_records:
+            if class_record.counter_shards:
+                class_record.current_enroll = sum(count for count, _ in query_counter_shards(dynamodb_client, class_record.id))
+        log.sampled(logger, "Query successful.")
+    except ClientError as error:
+        handle_error(error)
+        return None
+    except BaseException as error:
+        logger.exception("Unknown error while querying")
+        return None
+    return {class_record.id: class_record.to_dict() for class_record in class_records}
+
+""" Set of i#instructor_id keys that exist among instructor_ids, None on error """
+def query_existing_instructors(dynamodb_client, instructor_ids):
+    keys = [{"PK": {"S":f"i#{instructor_id}"}, "SK": {"S":f"i#{instructor_id}"}} for instructor_id in instructor_ids]
+    try:
+        items = batch_get_items(dynamodb_client, keys, projection="PK")
+        log.sampled(logger, "Query successful.")
+    except ClientError as error:
+        handle_error(error)
+        return None
+    except BaseException as error:
+        logger.exception("Unknown error while querying")
+        return None
+    return set(items)
+
+""" Query s#student_id keys of a class roster, state is enrolled or dropped. Reads keys only, no student details """
+def query_roster_keys(dynamodb_client, class_id, state):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "KeyConditionExpression": "#cd420 = :cd420 And begins_with(#cd421, :cd421)",
         "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK"},
-        "ExpressionAttributeValues": {":cd420": {"S":f"c#{class_id}"},":cd421": {"S":"s#"}}    }
+        "ExpressionAttributeValues": {":cd420": {"S":f"c#{class_id}"},":cd421": {"S":f"s#{state}#"}},
+        "ProjectionExpression": "#cd421"
+    }
     try:
-        response = dynamodb_client.query(**input)
-        # Parse data from response
-        items = response['Items']
-        if items:
-            formatted_response = [{'StudentId': item['SK']} for item in items]
-            student_ids = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            # Create list of student ids from student_ids
-            student_ids = [student_id["StudentId"] for student_id in student_ids]
-            return student_ids
-        else:
-            return None
-
+        items, _ = query_items(dynamodb_client, input)
+        log.sampled(logger, "Query successful.")
+        return [f"s#{codec.key_id(item['SK']['S'])}" for item in items]
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
+    return None
+
 """ Query dropped students for a class """
 def query_dropped_students(dynamodb_client, class_id):
+    return query_dropped_students_page(dynamodb_client, class_id)[0]
+
+""" Query one page of dropped students for a class, returns (students, last_key) """
+def query_dropped_students_page(dynamodb_client, class_id, limit=None, start_key=None):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "KeyConditionExpression": "#cd420 = :cd420 And begins_with(#cd421, :cd421)",
         "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK"},
         "ExpressionAttributeValues": {":cd420": {"S":f"c#{class_id}"},":cd421": {"S":"s#dropped"}}    }
     try:
-        response = dynamodb_client.query(**input)
+        items, last_key = query_items(dynamodb_client, input, limit, start_key)
         # Parse data from response
-        items = response['Items']
         if len(items) > 0:
-            formatted_response = [{'StudentId': item['GSI1_PK']} for item in items]
-            # ids = [{'id': item['PK']['S'].split("c#")[1]} for item in items]
-            student_ids = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            # Create list of student ids from student_ids
-            student_ids = [student_id["StudentId"] for student_id in student_ids]
+            student_ids = [codec.enrollment_student_key(item) for item in items]
             # Get each student's info from student ids and append to final_response
             student_info = batch_query_student(dynamodb_client, student_ids)
-            return student_info
+            return student_info, last_key
         else:
-            return None
+            return None, last_key
 
+    except InvalidCursor:
+        raise
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
+    return None, None
 
 """ Freeze enrollment for a class """
+@invalidates_class
 def freeze_enrollment(dynamodb_client, class_id):
     input = {
         "TableName": "TitanOnlineEnrollment",
@@ -482,41 +1101,51 @@ def freeze_enrollment(dynamodb_client, class_id):
     }
     try:
         response = dynamodb_client.update_item(**input)
-        print("Update successful.")
+        log.sampled(logger, "Update successful.")
         return True
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while updating: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while updating")
         return False
     
 ### Drop student from class
-def drop_student_from_class(dynamodb_client, student_id, class_id):
+DROP_OK = "dropped"
+DROP_NOT_ENROLLED = "not_enrolled"
+DROP_ERROR = "error"
+
+""" Drop student from class, returns DROP_OK, DROP_NOT_ENROLLED or DROP_ERROR
+    The enrollment row delete is conditional, a caller that checked enrollment against a stale
+    read can't drop a student twice and decrement the class count for a seat that was already free.
+    class_detail is the Detail the caller already read, the class isn't read again after the delete """
+def drop_student_from_class(dynamodb_client, student_id, class_id, class_detail):
     # delete PK of c#class_id and SK of s#enrolled#student_id if exists
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Key": {
             "PK": {"S":f"c#{class_id}"}, 
             "SK": {"S":f"s#enrolled#{student_id}"}
-        }
+        },
+        "ConditionExpression": "attribute_exists(PK)"
     }
     try:
         response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
+        log.sampled(logger, "Delete successful.")
     except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return DROP_NOT_ENROLLED
         handle_error(error)
-        return False
+        return DROP_ERROR
     except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
-        return False
+        logger.exception("Unknown error while deleting")
+        return DROP_ERROR
     
 
     # add new entry of c#class_id and s#dropped#student_id with GSI1_PK as s#student_id and GSI1_SK as c#open#class_id
-    class_detail = query_class(dynamodb_client, class_id)
-    print("Detail:", class_detail)
-    serialized_class_detail = {k: serializer.serialize(v) for k,v in class_detail.items()}
-    print(serialized_class_detail)
+    logger.debug("Class detail %s", class_detail)
+    serialized_class_detail = serializer.serialize(class_detail)
+    logger.debug("Serialized class detail %s", serialized_class_detail)
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Item": {
@@ -525,141 +1154,206 @@ def drop_student_from_class(dynamodb_client, student_id, class_id):
             "GSI1_PK": {"S":f"s#{student_id}"},
             "GSI1_SK": {"S":f"c#open#{class_id}"},
             "EntityType": {"S":"enrollment"},
-            "Detail": serialized_class_detail['Detail']
+            "Detail": serialized_class_detail
         }
     }
 
     try:
         response = dynamodb_client.put_item(**input)
-        print("Put successful.")
-        return True
+        log.sampled(logger, "Put successful.")
+        return DROP_OK
     except ClientError as error:
         handle_error(error)
-        return False
+        return DROP_ERROR
     except BaseException as error:
-        print("Unknown error while putting: " + error.response['Error']['Message'])
-        return False
+        logger.exception("Unknown error while putting")
+        return DROP_ERROR
 
 
-def change_instructor(dynamodb_client, class_id, instructor_id):
-    ## Get current instructor id for class
-    class_detail = query_class(dynamodb_client, class_id)
-    current_instructor_id = class_detail['instructorId']
-    ## Delete entry of class_id and curent_instructor_id
+""" Point the class item's GSI3_SK at a new instructor """
+@invalidates_class
+def set_class_instructor(dynamodb_client, class_id, instructor_id):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Key": {
             "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"i#{current_instructor_id}"}
-        }
+            "SK": {"S":f"c#{class_id}"}
+        },
+        "UpdateExpression": "SET #cd421 = :cd421",
+        "ExpressionAttributeNames": {"#cd421":"GSI3_SK"},
+        "ExpressionAttributeValues": {":cd421": {"S":f"i#{instructor_id}"}}
     }
     try:
-        response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
+        response = dynamodb_client.update_item(**input)
+        log.sampled(logger, "Update successful.")
+        return True
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while updating")
         return False
-    ## Update GSI3_SK with PK c#class_id SK class_id to instructor_id
+
+@invalidates_class
+def change_instructor(dynamodb_client, class_id, instructor_id):
+    ## Get current instructor id for class
+    class_detail = fetch_class(dynamodb_client, class_id)
+    current_instructor_id = class_detail['instructorId']
+    ## Delete entry of class_id and curent_instructor_id
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Key": {
             "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"c#{class_id}"}
-        },
-        "UpdateExpression": "SET #cd421 = :cd421",
-        "ExpressionAttributeNames": {"#cd421":"GSI3_SK"},
-        "ExpressionAttributeValues": {":cd421": {"S":f"i#{instructor_id}"}}
+            "SK": {"S":f"i#{current_instructor_id}"}
+        }
     }
     try:
-        response = dynamodb_client.update_item(**input)
-        print("Update successful.")
+        response = dynamodb_client.delete_item(**input)
+        log.sampled(logger, "Delete successful.")
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while updating: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while deleting")
+        return False
+    ## Update GSI3_SK with PK c#class_id SK class_id to instructor_id
+    if not set_class_instructor(dynamodb_client, class_id, instructor_id):
         return False
     ## Add new entry of class_id and instructor_id with EntityType as instructor and GSI2_PK as i#instructor_id and GSI2_SK as c#class_id
     input = {
         "TableName": "TitanOnlineEnrollment",
-        "Item": {
-            "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"i#{instructor_id}"},
-            "GSI2_PK": {"S":f"i#{instructor_id}"},
-            "GSI2_SK": {"S":f"c#{class_id}"},
-            "EntityType": {"S":"instructor"}
-        }
+        "Item": class_instructor_item(class_id, instructor_id)
     }
     try:
         response = dynamodb_client.put_item(**input)
-        print("Put successful.")
+        log.sampled(logger, "Put successful.")
         return True
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while putting: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while putting")
         return False
 
 
-""" Create class """
-def create_class(dynamodb_client, class_detail):
-    print(class_detail)
+""" Serialize a Class model, returns (serialized_class_detail, filtered_class_detail without maxEnroll and InstructorId) """
+def serialize_class_detail(class_detail):
     serialized_class_detail = {k: serializer.serialize(v) for k,v in class_detail}
     # Remove maxEnroll, instructorId  from serialized_class_detail and store in filtered_class_detail
     filtered_class_detail = {k: serialized_class_detail[k] for k in serialized_class_detail if k not in ['maxEnroll', 'InstructorId']}
-    # Auto generate class_id, make sure it's unique
-    class_id = random.randint(1000, 9999)
-    while check_class_exists(dynamodb_client, class_id):
-        class_id = random.randint(1000, 9999)
+    return serialized_class_detail, filtered_class_detail
+
+""" Hands out class ids from a counter item in the table
+    Each worker leases a block of ids with one atomic ADD and serves ids from it locally,
+    so creating a class doesn't need a round trip for its id. Ids start above the old
+    four digit range, ids of a lease a worker never used are skipped."""
+class ClassIdAllocator:
+    COUNTER_KEY = "counter#class"
+
+    def __init__(self, block_size=20, start=10000):
+        self.block_size = block_size
+        self.start = start
+        self.next_id = 0
+        self.end_id = 0
+        self.lock = threading.Lock()
+
+    def lease_block(self, dynamodb_client):
+        input = {
+            "TableName": "TitanOnlineEnrollment",
+            "Key": {
+                "PK": {"S":self.COUNTER_KEY},
+                "SK": {"S":self.COUNTER_KEY}
+            },
+            "UpdateExpression": "ADD #cd430 :cd430",
+            "ExpressionAttributeNames": {"#cd430":"allocated"},
+            "ExpressionAttributeValues": {":cd430": {"N":str(self.block_size)}},
+            "ReturnValues": "UPDATED_NEW"
+        }
+        response = dynamodb_client.update_item(**input)
+        allocated = int(response['Attributes']['allocated']['N'])
+        self.next_id = self.start + allocated - self.block_size
+        self.end_id = self.start + allocated
+
+    def allocate(self, dynamodb_client):
+        with self.lock:
+            if self.next_id >= self.end_id:
+                self.lease_block(dynamodb_client)
+            class_id = self.next_id
+            self.next_id += 1
+            return class_id
+
+class_id_allocator = ClassIdAllocator()
+
+""" Class item c#class_id/c#class_id of a new class """
+def class_item(class_id, serialized_class_detail, filtered_class_detail):
+    return {
+        "PK": {"S":f"c#{class_id}"},
+        "SK": {"S":f"c#{class_id}"},
+        "EntityType": {"S":"class"},
+        "Detail": {"M": filtered_class_detail},
+        "currentEnroll": {"N":"0"},
+        "maxEnroll": {"N":str(serialized_class_detail['maxEnroll']['N'])},
+        "Frozen": {"BOOL": False},
+        "GSI3_PK": {"S":f"c#{class_id}"},
+        "GSI3_SK": {"S":f"i#{serialized_class_detail['InstructorId']['S']}"}
+    }
+
+""" Instructor row c#class_id/i#instructor_id, GSI2 finds the classes of an instructor through it """
+def class_instructor_item(class_id, instructor_id):
+    return {
+        "PK": {"S":f"c#{class_id}"},
+        "SK": {"S":f"i#{instructor_id}"},
+        "GSI2_PK": {"S":f"i#{instructor_id}"},
+        "GSI2_SK": {"S":f"c#{class_id}"},
+        "EntityType": {"S":"instructor"}
+    }
+
+""" Create class, returns the new class id or None """
+def create_class(dynamodb_client, class_detail):
+    serialized_class_detail, filtered_class_detail = serialize_class_detail(class_detail)
+    try:
+        class_id = class_id_allocator.allocate(dynamodb_client)
+    except ClientError as error:
+        handle_error(error)
+        return None
+    except BaseException as error:
+        logger.exception("Unknown error while allocating class id")
+        return None
     input = {
         "TableName": "TitanOnlineEnrollment",
-        "Item": {
-            "PK": {"S":f"c#{class_id}"},
-            "SK": {"S":f"c#{class_id}"},
-            "EntityType": {"S":"class"},
-            "Detail": {"M": filtered_class_detail},
-            "currentEnroll": {"N":"0"},
-            "maxEnroll": {"N":str(serialized_class_detail['maxEnroll']['N'])},
-            "Frozen": {"BOOL": False},
-            "GSI3_PK": {"S":f"c#{class_id}"},
-            "GSI3_SK": {"S":f"i#{serialized_class_detail['InstructorId']['S']}"}
-        }
+        # Never overwrite a class, the counter should make this impossible
+        "ConditionExpression": "attribute_not_exists(PK)",
+        "Item": class_item(class_id, serialized_class_detail, filtered_class_detail)
     }
     try:
         response = dynamodb_client.put_item(**input)
-        print("Put successful.")
+        log.sampled(logger, "Put successful.")
     except ClientError as error:
         handle_error(error)
-        return False
+        return None
     except BaseException as error:
-        print("Unknown error while putting: " + error.response['Error']['Message'])
-        return False
+        logger.exception("Unknown error while putting")
+        return None
     
     """ Add instructor to class with PK is class_id and SK is instructor_id """
     input = {
         "TableName": "TitanOnlineEnrollment",
-        "Item": {
-            "PK": {"S":f"c#{class_id}"},
-            "SK": {"S":f"i#{serialized_class_detail['InstructorId']['S']}"},
-            "GSI2_PK": {"S":f"i#{serialized_class_detail['InstructorId']['S']}"},
-            "GSI2_SK": {"S":f"c#{class_id}"},
-            "EntityType": {"S":"instructor"}
-        }
+        "Item": class_instructor_item(class_id, serialized_class_detail['InstructorId']['S'])
     }
     try:
         response = dynamodb_client.put_item(**input)
-        print("Put successful.")
+        log.sampled(logger, "Put successful.")
     except ClientError as error:
         handle_error(error)
-        return False
+        return None
     except BaseException as error:
-        print("Unknown error while putting: " + error.response['Error']['Message'])
-        return False
-     
+        logger.exception("Unknown error while putting")
+        return None
+    return str(class_id)
+
+""" Get the students a new class is opened to, copied from the roster of the first class of student s#0001
+    Returns a list of s#student_id or None """
+def query_class_audience(dynamodb_client):
     """Get any class id from student GSI1_PK is student_id and GSI1_SK starts with c#"""
     available_class_id = ""
     input = {
@@ -670,83 +1364,110 @@ def create_class(dynamodb_client, class_detail):
         "ExpressionAttributeValues": {":ec990": {"S":f"s#0001"},":ec991": {"S":"c#"}}
     }
     try:
-        response = dynamodb_client.query(**input)
+        items, _ = query_items(dynamodb_client, input, limit=1)
         # Parse data from response
-        items = response['Items']
         if items:
             available_class_id = items[0]['GSI1_SK']['S'].split("#")[-1]
-            print("Query successful.")
+            log.sampled(logger, "Query successful.")
         else:
             return None
 
     except ClientError as error:
         handle_error(error)
+        return None
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
-
-    print("Available class id: " + available_class_id)
+        logger.exception("Unknown error while querying")
+        return None
 
     """Get all student ids from available_class_id"""
     input = {
         "TableName": "TitanOnlineEnrollment",
         "KeyConditionExpression": "#cd420 = :cd420 And begins_with(#cd421, :cd421)",
-        "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK"},
-        "ExpressionAttributeValues": {":cd420": {"S":f"c#{available_class_id}"},":cd421": {"S":"s#"}}
+        "ExpressionAttributeValues": {":cd420": {"S":f"c#{available_class_id}"},":cd421": {"S":"s#"}},
+        "ProjectionExpression": "#cd422",
+        "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK","#cd422":"GSI1_PK"}
     }
-    student_ids = []
     try:
-        response = dynamodb_client.query(**input)
+        items, _ = query_items(dynamodb_client, input)
         # Parse data from response
-        items = response['Items']
         if items:
-            formatted_response = [{'StudentId': item['GSI1_PK']} for item in items]
-            print("Formatted response: " + str(formatted_response))
-            # ids = [{'id': item['PK']['S'].split("c#")[1]} for item in items]
-            student_ids = [{ k: deserializer.deserialize(v) if isinstance(v, dict) else v for k, v in item.items()} for item in formatted_response]        
-            # Create list of student ids from student_ids
-            student_ids = [student_id["StudentId"] for student_id in student_ids]
+            # Create list of student ids from the roster rows
+            return [item['GSI1_PK']['S'] for item in items if 'GSI1_PK' in item]
         else:
             return None
     except ClientError as error:
         handle_error(error)
     except BaseException as error:
-        print("Unknown error while querying: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while querying")
 
-    ### Batch add student from student_ids to class with EntityType as enrollment and GSI1_PK as s#student_id and GSI1_SK as c#open#class_id
-    ### Also add class to student with EntityType as enrollment and GSI1_PK as c#class_id and GSI1_SK as s#student_id
-    print(student_ids)
-    for student_id in student_ids:
-        input = {
-            "TableName": "TitanOnlineEnrollment",
-            "Item": {
-                "PK": {"S":f"c#{class_id}"},
-                "SK": {"S":f"{student_id}"},
-                "GSI1_PK": {"S":f"{student_id}"},
-                "GSI1_SK": {"S":f"c#open#{class_id}"},
-                "Detail": {"M": filtered_class_detail},
-                "EntityType": {"S":"enrollment"}
+""" Open a class to students
+    Batch add student from student_ids to class with EntityType as enrollment and GSI1_PK as s#student_id and GSI1_SK as c#open#class_id """
+def open_class_for_students(dynamodb_client, class_id, class_detail, student_ids, progress=None):
+    _, filtered_class_detail = serialize_class_detail(class_detail)
+    requests = [
+        {
+            "PutRequest": {
+                "Item": {
+                    "PK": {"S":f"c#{class_id}"},
+                    "SK": {"S":f"{student_id}"},
+                    "GSI1_PK": {"S":f"{student_id}"},
+                    "GSI1_SK": {"S":f"c#open#{class_id}"},
+                    "Detail": {"M": filtered_class_detail},
+                    "EntityType": {"S":"enrollment"}
+                }
             }
         }
-        print(input)
+        for student_id in student_ids
+    ]
+    return batch_write_items(dynamodb_client, requests, progress)
+
+""" Batch write engine: splits Put/DeleteRequests into chunks of 25, writes the chunks concurrently
+    on write_executor and retries UnprocessedItems with exponential back-off.
+    progress(n) is called with the number of items written after each chunk. Returns True if everything was written """
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_RETRIES = 8
+BATCH_WRITE_BACKOFF = 0.05
+write_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="batch_write")
+# Rows delete_class collects before handing them to batch_write_items, one chunk per write thread
+DELETE_PAGE_SIZE = BATCH_WRITE_LIMIT * 8
+
+def batch_write_chunk(dynamodb_client, requests, progress=None):
+    request_items = {"TitanOnlineEnrollment": requests}
+    for attempt in range(BATCH_WRITE_RETRIES + 1):
+        response = dynamodb_client.batch_write_item(RequestItems=request_items)
+        unprocessed = response.get('UnprocessedItems') or {}
+        remaining = len(unprocessed.get('TitanOnlineEnrollment', []))
+        if progress is not None:
+            progress(len(request_items['TitanOnlineEnrollment']) - remaining)
+        if not remaining:
+            return
+        request_items = unprocessed
+        time.sleep(BATCH_WRITE_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0))
+    raise RuntimeError(f"{remaining} items still unprocessed after {BATCH_WRITE_RETRIES} retries")
+
+def batch_write_items(dynamodb_client, requests, progress=None):
+    chunks = [requests[i:i + BATCH_WRITE_LIMIT] for i in range(0, len(requests), BATCH_WRITE_LIMIT)]
+    futures = [write_executor.submit(metrics.in_context(batch_write_chunk), dynamodb_client, chunk, progress) for chunk in chunks]
+    written = True
+    for future in futures:
         try:
-            response = dynamodb_client.put_item(**input)
-            print("Put successful.")
+            future.result()
         except ClientError as error:
             handle_error(error)
-            return False
+            written = False
         except BaseException as error:
-            print("Unknown error while putting: " + error.response['Error']['Message'])
-            return False
-    return True
-
-"""Delete class"""
-def delete_class(dynamodb_client, class_id):
-    # Get class instructor id
-    class_detail = query_class(dynamodb_client, class_id)
-    instructor_id = class_detail['instructorId']
-    # Get all student ids from class
-    student_ids = query_all_students(dynamodb_client, class_id)
-    # Delete class
+            logger.exception("Unknown error while writing")
+            written = False
+    if written:
+        log.sampled(logger, "Batch write successful, %d items.", len(requests))
+    return written
+
+"""Delete class
+   Deletes the class item first so the class stops showing up, then reads the c#class_id partition
+   page by page and deletes every row with batch_write_items.
+   progress(count, total=n) reports rows found and deleted. Returns True if everything was deleted"""
+@invalidates_class
+def delete_class(dynamodb_client, class_id, progress=None):
     input = {
         "TableName": "TitanOnlineEnrollment",
         "Key": {
@@ -756,46 +1477,124 @@ def delete_class(dynamodb_client, class_id):
     }
     try:
         response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
+        log.sampled(logger, "Delete successful.")
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while deleting")
         return False
-    # Delete instructor
+    class_cache.invalidate(class_id)
+    # Delete instructor and all enrollment rows of the partition
     input = {
         "TableName": "TitanOnlineEnrollment",
-        "Key": {
-            "PK": {"S":f"c#{class_id}"}, 
-            "SK": {"S":f"i#{class_id}"}
-        }
+        "KeyConditionExpression": "#cd420 = :cd420",
+        "ExpressionAttributeNames": {"#cd420":"PK","#cd421":"SK"},
+        "ExpressionAttributeValues": {":cd420": {"S":f"c#{class_id}"}},
+        "ProjectionExpression": "#cd420, #cd421"
     }
+    deleted = True
+    page = []
     try:
-        response = dynamodb_client.delete_item(**input)
-        print("Delete successful.")
+        for item in paginate_query(dynamodb_client, input):
+            page.append({"DeleteRequest": {"Key": {"PK": item['PK'], "SK": item['SK']}}})
+            # Delete as we read so memory stays bounded for big classes
+            if len(page) == DELETE_PAGE_SIZE:
+                if progress is not None:
+                    progress(0, total=len(page))
+                deleted = batch_write_items(dynamodb_client, page, progress) and deleted
+                page = []
+        if page:
+            if progress is not None:
+                progress(0, total=len(page))
+            deleted = batch_write_items(dynamodb_client, page, progress) and deleted
     except ClientError as error:
         handle_error(error)
         return False
     except BaseException as error:
-        print("Unknown error while deleting: " + error.response['Error']['Message'])
+        logger.exception("Unknown error while deleting")
         return False
-    # Delete all enrollment
-    for student_id in student_ids:
-        input = {
-            "TableName": "TitanOnlineEnrollment",
-            "Key": {
-                "PK": {"S":f"c#{class_id}"}, 
-                "SK": {"S":f"{student_id}"}
-            }
-        }
-        try:
-            response = dynamodb_client.delete_item(**input)
-            print("Delete successful.")
-        except ClientError as error:
-            handle_error(error)
-            return False
-        except BaseException as error:
-            print("Unknown error while deleting: " + error.response['Error']['Message'])
-            return False
-    return True
+    return deleted
+
+
+""" Bulk registrar operations, each takes one chunk of items and returns one (status code, result) per item
+    Writes that BatchWriteItem can do go in one batch per chunk, updates are sent one by one """
+def create_classes(dynamodb_client, class_details):
+    instructors = query_existing_instructors(dynamodb_client, [class_detail.InstructorId for class_detail in class_details])
+    if instructors is None:
+        return [(500, "Unable to create class")] * len(class_details)
+    results = [None if f"i#{class_detail.InstructorId}" in instructors else (404, "No instructor found") for class_detail in class_details]
+    new_classes = [class_detail for class_detail, result in zip(class_details, results) if result is None]
+    try:
+        class_ids = [class_id_allocator.allocate(dynamodb_client) for _ in new_classes]
+    except ClientError as error:
+        handle_error(error)
+        return [result or (500, "Unable to allocate class id") for result in results]
+    except BaseException as error:
+        logger.exception("Unknown error while allocating class id")
+        return [result or (500, "Unable to allocate class id") for result in results]
+    requests = []
+    for class_id, class_detail in zip(class_ids, new_classes):
+        serialized_class_detail, filtered_class_detail = serialize_class_detail(class_detail)
+        requests.append({"PutRequest": {"Item": class_item(class_id, serialized_class_detail, filtered_class_detail)}})
+        requests.append({"PutRequest": {"Item": class_instructor_item(class_id, class_detail.InstructorId)}})
+    created = bool(requests) and batch_write_items(dynamodb_client, requests)
+    new_class_ids = iter(class_ids)
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = (201, str(next(new_class_ids))) if created else (500, "Unable to create class")
+    return results
+
+""" changes is a list of (class_id, instructor_id) """
+def change_instructors(dynamodb_client, changes):
+    classes = batch_query_classes(dynamodb_client, [class_id for class_id, _ in changes])
+    instructors = query_existing_instructors(dynamodb_client, [instructor_id for _, instructor_id in changes])
+    if classes is None or instructors is None:
+        return [(500, "Unable to change instructor")] * len(changes)
+    results = []
+    requests = []
+    for class_id, instructor_id in changes:
+        if class_id not in classes:
+            results.append((404, "No class found"))
+        elif f"i#{instructor_id}" not in instructors:
+            results.append((404, "No instructor found"))
+        else:
+            results.append(None)
+            current_instructor_id = classes[class_id]['instructorId']
+            if current_instructor_id != instructor_id:
+                requests.append({"DeleteRequest": {"Key": {"PK": {"S":f"c#{class_id}"}, "SK": {"S":f"i#{current_instructor_id}"}}}})
+                requests.append({"PutRequest": {"Item": class_instructor_item(class_id, instructor_id)}})
+    # Swap every instructor row of the chunk in one batch, then repoint each class item
+    if requests and not batch_write_items(dynamodb_client, requests):
+        return [result or (500, "Unable to change instructor") for result in results]
+    for index, (class_id, instructor_id) in enumerate(changes):
+        if results[index] is None:
+            changed = set_class_instructor(dynamodb_client, class_id, instructor_id)
+            results[index] = (200, "Instructor changed") if changed else (500, "Unable to change instructor")
+    return results
+
+def freeze_classes(dynamodb_client, class_ids):
+    classes = batch_query_classes(dynamodb_client, class_ids)
+    if classes is None:
+        return [(500, "Unable to freeze enrollment")] * len(class_ids)
+    results = []
+    for class_id in class_ids:
+        if class_id not in classes:
+            results.append((404, "No class found"))
+        elif classes[class_id]['Frozen']:
+            results.append((400, "Class is already frozen"))
+        elif freeze_enrollment(dynamodb_client, class_id):
+            results.append((200, "Enrollment frozen"))
+        else:
+            results.append((500, "Unable to freeze enrollment"))
+    return results
+
+""" Open many new classes to the same students, for a background job. classes is a list of (class_id, class_detail) """
+def open_classes_for_students(dynamodb_client, classes, student_ids, progress=None):
+    opened = True
+    for class_id, class_detail in classes:
+        opened = open_class_for_students(dynamodb_client, class_id, class_detail, student_ids, progress) and opened
+    return opened
+
+# Label backend calls with the query_helper function that made them
+metrics.trace_functions(globals())
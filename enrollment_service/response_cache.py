@@ -0,0 +1,66 @@
+''' This file contains the response cache for the student class listings.
+    GET /students/{id}/classes and /students/{id}/enrolled are polled all through registration,
+    their serialized responses are kept in Redis under response:{view}:{student_id}:{query}
+    together with the versions they were built from:
+      response_version:s:{student_id}   bumped when the student enrolls, drops or joins or leaves a waitlist
+      response_version:classes          bumped when classes appear, disappear or a waitlist fills up or frees up
+    An entry is only served while both versions are unchanged, so a bump invalidates every entry
+    that depends on it without having to find them. The versions are read before the response is
+    built, an entry built while a write was in flight is stored under the old versions and never served.
+    Responses carry a strong ETag of their body, If-None-Match gets a 304 from Redis alone.'''
+import hashlib
+
+RESPONSE_TTL = 5 * 60
+CLASSES_VERSION_KEY = "response_version:classes"
+
+
+def student_version_key(student_id):
+    return f"response_version:s:{student_id}"
+
+def entry_key(view, student_id, query):
+    return f"response:{view}:{student_id}:{query}"
+
+def make_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+"""True if an If-None-Match header value matches etag"""
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+"""Current versions and the cached (etag, body) if it's still valid, one MGET on the async client
+   Returns (versions, entry or None)"""
+async def lookup(r, view, student_id, query):
+    student_version, classes_version, cached = await r.mget(student_version_key(student_id), CLASSES_VERSION_KEY, entry_key(view, student_id, query))
+    versions = (int(student_version or 0), int(classes_version or 0))
+    if cached is None:
+        return versions, None
+    header, body = cached.split(b"\n", 1)
+    cached_student_version, cached_classes_version, etag = header.decode("ascii").split(" ", 2)
+    if (int(cached_student_version), int(cached_classes_version)) != versions:
+        return versions, None
+    return versions, (etag, body)
+
+"""Store a serialized response built from versions, returns its etag"""
+def store(r, view, student_id, query, versions, body):
+    etag = make_etag(body)
+    header = f"{versions[0]} {versions[1]} {etag}".encode("ascii")
+    r.set(entry_key(view, student_id, query), header + b"\n" + body, ex=RESPONSE_TTL)
+    return etag
+
+
+"""Invalidate the student's listings, r may be a pipeline"""
+def student_changed(r, student_id):
+    r.incr(student_version_key(student_id))
+
+"""Invalidate every student's listings, r may be a pipeline"""
+def classes_changed(r):
+    r.incr(CLASSES_VERSION_KEY)
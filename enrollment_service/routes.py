@@ -1,20 +1,70 @@
-import contextlib
+import asyncio
+import json
+import time
 import enrollment_service.query_helper as qh
+import enrollment_service.waitlist_helper as wh
+import enrollment_service.response_cache as rc
+import enrollment_service.jobs as jobs
+import enrollment_service.metrics as metrics
 import redis
+import redis.asyncio
 
-from fastapi import Depends, HTTPException, APIRouter, Header, status
+from fastapi import Depends, HTTPException, APIRouter, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 import boto3
-from enrollment_service.database.schemas import Class
+from enrollment_service.database.schemas import Class, ClassIdBatch, ClassRef, InstructorChange
+from enrollment_service.data_context import DataContext, backend_executor
+from enrollment_service.auth import AuthContext, get_auth_context
+from Utility import log
+
+logger = log.get_logger(__name__)
 
 router = APIRouter()
-dropped = []
 
-FREEZE = False
 MAX_WAITLIST = 3
-database = "enrollment_service/database/database.db"
-dynamodb_client = boto3.client('dynamodb', endpoint_url='http://localhost:5500')
-table_name = 'TitanOnlineEnrollment'
-r = redis.Redis()
+# Classes a student can enroll in or drop with one batch request
+MAX_BATCH_CLASSES = 10
+# Classes opened to more students than this are written by a background job
+BACKGROUND_FANOUT_THRESHOLD = 500
+# Registrar bulk requests: items per request, items per chunk and chunks in flight at once
+MAX_BULK_ITEMS = 5000
+BULK_CHUNK_SIZE = 25
+BULK_CONCURRENCY = 4
+# Status of a bulk item that doesn't parse or validate
+BULK_INVALID_ITEM = 422
+dynamodb_client = metrics.InstrumentedDynamoDB(boto3.client('dynamodb', endpoint_url='http://localhost:5500'))
+# Requests await Redis on the async client. The class cache, background jobs and bulk chunks
+# run on backend threads next to their DynamoDB calls and use the blocking one
+r = metrics.InstrumentedRedis(redis.Redis())
+async_r = metrics.InstrumentedAsyncRedis(redis.asyncio.Redis())
+qh.class_cache.redis_client = r
+
+
+# Request-scoped data context, the middleware flushes its Redis writes and reports its backend call count
+# before the response is sent, a dependency's teardown would only run after the client has its answer
+async def get_data_context(request: Request, auth: AuthContext = Depends(get_auth_context)):
+    ctx = DataContext(dynamodb_client, async_r, auth)
+    request.state.data_context = ctx
+    return ctx
+
+
+# Cursor pagination shared by the list endpoints, limit=None keeps returning everything
+class Page:
+    def __init__(self, limit: int | None = Query(None, ge=1, le=1000), cursor: str | None = None):
+        self.limit = limit
+        try:
+            self.start_key = qh.decode_cursor(cursor)
+        except qh.InvalidCursor:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    """Read one page with func(dynamodb_client, *args, limit, start_key), a start key DynamoDB rejects is a bad request"""
+    async def read(self, ctx, func, *args):
+        try:
+            return await ctx.run(func, ctx.dynamodb_client, *args, self.limit, self.start_key)
+        except qh.InvalidCursor:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
 
 #==========================================students==================================================
@@ -22,334 +72,463 @@ r = redis.Redis()
 
 # DONE: GET available classes for a student
 @router.get("/students/{student_id}/classes", tags=['Student']) 
-def get_available_classes(student_id: str):
-    # Check if student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def get_available_classes(student_id: str, request: Request, page: Page = Depends(), ctx: DataContext = Depends(get_data_context)):
+    return await cached_listing(request, ctx, "classes", student_id, lambda: build_available_classes(student_id, page, ctx))
+
+async def build_available_classes(student_id, page, ctx):
+    # Check if student exists in the database while reading the page of classes
+    student_found, (class_data, last_key) = await asyncio.gather(
+        ctx.student_exists(student_id),
+        page.read(ctx, qh.query_available_classes_page, student_id),
+    )
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    class_data = qh.query_available_classes(dynamodb_client, student_id)
+    # Only the first page being empty means there's nothing, a later one can end the list
     if not class_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes found")
+        if page.start_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes found")
+        class_data = []
     # If watlist full, don't show full classes with open waitlists
+    waitlist_status = await wh.batch_waitlist_status(ctx.redis, [item["id"] for item in class_data], student_id)
     filtered_class_data = []
     for item in class_data:
-        waitlist_key = f'waitlist:{item["id"]}'
-        waitlist_length = r.llen(waitlist_key)
+        status_data = waitlist_status[item["id"]]
         # If student is in the waitlist, don't show the class
-        id = f"s#{student_id}".encode('utf-8')
-        if id in r.lrange(waitlist_key, 0, -1):
+        if status_data["member"]:
             continue
         # Add the item to filtered_data only if the waitlist is not full
-        if waitlist_length < MAX_WAITLIST or r.exists(waitlist_key) == 0:
+        if status_data["length"] < MAX_WAITLIST:
             filtered_class_data.append(item)
 
-    return {"Classes" : filtered_class_data}
+    return {"Classes" : filtered_class_data, "NextCursor": qh.encode_cursor(last_key)}
 
 
 # DONE: GET currently enrolled classes for a student
 @router.get("/students/{student_id}/enrolled", tags=['Student'])
-def view_enrolled_classes(student_id: str):
-    # Check if student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def view_enrolled_classes(student_id: str, request: Request, page: Page = Depends(), ctx: DataContext = Depends(get_data_context)):
+    return await cached_listing(request, ctx, "enrolled", student_id, lambda: build_enrolled_classes(student_id, page, ctx))
+
+async def build_enrolled_classes(student_id, page, ctx):
+    # Check if student exists in the database while reading the page of classes
+    student_found, (class_data, last_key) = await asyncio.gather(
+        ctx.student_exists(student_id),
+        page.read(ctx, qh.query_enrolled_classes_page, student_id),
+    )
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    class_data = qh.query_enrolled_classes(dynamodb_client, student_id)
     if not class_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes found")
-
-    return {"Enrolled": class_data}
+        if page.start_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes found")
+        class_data = []
+
+    return {"Enrolled": class_data, "NextCursor": qh.encode_cursor(last_key)}
+
+# Serve a student listing from the response cache, build() makes the response on a miss.
+# Errors raised by build() aren't cached
+async def cached_listing(request, ctx, view, student_id, build):
+    query = request.url.query
+    try:
+        versions, entry = await rc.lookup(ctx.redis, view, student_id, query)
+    except Exception as error:
+        logger.warning("Response cache unavailable: %s", error)
+        return await build()
+    if entry is None:
+        metrics.record_response_cache(view, "miss")
+        body = json.dumps(jsonable_encoder(await build()), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = rc.store(ctx.pending_redis(), view, student_id, query, versions, body)
+    else:
+        metrics.record_response_cache(view, "hit")
+        etag, body = entry
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if rc.etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.record_response_cache(view, "not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# A waitlist reaching or leaving MAX_WAITLIST hides or shows its class in every student's available classes
+async def waitlist_changed(ctx, class_id, joined):
+    length = await wh.waitlist_length(ctx.redis, class_id)
+    if length == (MAX_WAITLIST if joined else MAX_WAITLIST - 1):
+        rc.classes_changed(ctx.pending_redis())
 
 # DONE
 # Enrolls a student into an available class,
 # or will automatically put the student on an open waitlist for a full class
 @router.post("/students/{student_id}/classes/{class_id}/enroll", tags=['Student'], summary="Enroll in a class")
-def enroll_student_in_class(student_id: str, class_id: str):
-    # Check if the student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def enroll_student_in_class(student_id: str, class_id: str, ctx: DataContext = Depends(get_data_context)):
+    # Check if the student and the class exist in the database
+    student_found, class_data = await asyncio.gather(ctx.student_exists(student_id), ctx.query_class(class_id))
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-
-    # Check if the class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
+    return await enroll_or_waitlist(ctx, student_id, class_id, class_data)
 
-    # Check if student is already enrolled in the class
-    enrolled_class = qh.query_enrolled_classes(dynamodb_client, student_id)
-    if enrolled_class:
-        class_ids = [item['id'] for item in enrolled_class]
-        if class_id in class_ids:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student is already enrolled in this class")
-    
+# Enroll a student in a class that exists, or waitlist them when it's full. Raises HTTPException when neither works
+async def enroll_or_waitlist(ctx, student_id, class_id, class_data):
     # Check if class is frozen
     if class_data['Frozen']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Enrollment is frozen")
-    
-    # Check if the class is full
-    if class_data['currentEnroll'] >= class_data['maxEnroll']:
-        print("Class is full")
-        # Waitlist handling
-        waitlist_key = f"waitlist:{class_id}"
-        # check if waitlist exists, add to wailist Redis with key waitlist:class_id, value s#student_id
-        if not r.exists(waitlist_key):
-            r.rpush(waitlist_key, f"s#{student_id}")
-            return {"message": "Student added to waitlist"}
-        else:
-            # check if student is already on waitlist
-            id = f"s#{student_id}".encode('utf-8')
-            if id in r.lrange(waitlist_key, 0, -1):
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student is already on waitlist")
-            # check if adding student to waitlist will exceed max waitlist
-            if r.llen(waitlist_key) < MAX_WAITLIST:
-                r.rpush(waitlist_key, f"s#{student_id}")
-                return {"message": "Student added to waitlist"}
-            else:
-                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unable to add student to waitlist due to already having max number of waitlists")
-
-    # Add student to enrolled class in the database
-
-    enrolled_class = qh.update_enrolled_class(dynamodb_client, student_id, class_id)
-    if not enrolled_class:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to enroll student in class")
-    
-    # Increment enrollment number in the database
-    new_enrollment = class_data['currentEnroll'] + 1
-    update_finished = qh.update_current_enroll(dynamodb_client, class_id, new_enrollment)
-    if not update_finished:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to update class enrollment")
-    
-    # Fetch the updated class data from the databas
-    updated_class_data = qh.query_class(dynamodb_client, class_id)
 
-    return updated_class_data["Detail"]
+    # Always try to enroll the student in one conditional transaction, the capacity check happens in DynamoDB.
+    # class_data may be a cached copy that is behind on currentEnroll, it can't decide the class is full
+    result = await ctx.run(qh.enroll_student_transaction, ctx.dynamodb_client, student_id, class_id, class_data)
+    if result in (qh.ENROLL_OK, qh.ENROLL_DUPLICATE):
+        ctx.enrolled_changed(student_id, class_id, True)
+        rc.student_changed(ctx.pending_redis(), student_id)
+    if result == qh.ENROLL_OK:
+        # A student who got a seat directly no longer waits for one
+        if await wh.remove_from_waitlist(ctx.redis, class_id, student_id):
+            await waitlist_changed(ctx, class_id, joined=False)
+        return class_data["Detail"]
+    if result == qh.ENROLL_DUPLICATE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student is already enrolled in this class")
+    if result == qh.ENROLL_FROZEN:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Enrollment is frozen")
+    if result == qh.ENROLL_ERROR:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to enroll student in class")
+    # ENROLL_FULL: no seat left, waitlist the student. The transaction already ruled out
+    # an existing enrollment, ENROLL_DUPLICATE would have been returned otherwise
+
+    # Class is full
+    logger.debug("Class %s is full, waitlisting student %s", class_id, student_id)
+    # Waitlist handling
+    # add to waitlist Redis with key waitlist:class_id, value s#student_id
+    # the script checks membership and max waitlist atomically
+    result = await wh.join_waitlist(ctx.redis, class_id, student_id, MAX_WAITLIST)
+    if result == wh.WAITLIST_ALREADY_PRESENT:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Student is already on waitlist")
+    if result == wh.WAITLIST_FULL:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unable to add student to waitlist due to already having max number of waitlists")
+    rc.student_changed(ctx.pending_redis(), student_id)
+    await waitlist_changed(ctx, class_id, joined=True)
+    return {"message": "Student added to waitlist"}
 
 # DONE
 # Have a student drop a class they're enrolled in
 @router.delete("/students/{student_id}/classes/{class_id}", tags=['Student'], summary="Drop a class")
-def drop_student_from_class(student_id: str, class_id: str):
-    # Check if the student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def drop_student_from_class(student_id: str, class_id: str, ctx: DataContext = Depends(get_data_context)):
+    # Check if the student and the class exist and if the student is enrolled, all at once
+    student_found, class_data, enrolled = await asyncio.gather(
+        ctx.student_exists(student_id),
+        ctx.query_class(class_id),
+        ctx.is_enrolled(student_id, class_id),
+    )
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    # Check if the class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
     # Check if student is enrolled in the class
-    enrolled_class = qh.query_enrolled_classes(dynamodb_client, student_id)
-    if not enrolled_class:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
-    class_ids = [item['id'] for item in enrolled_class]
-    if class_id not in class_ids:
+    if enrolled is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get enrolled classes")
+    if not enrolled:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
+    return await drop_and_promote(ctx, student_id, class_id, class_data)
+
+# Enroll a student in several classes at once, the student and their enrollments are read once
+# and every class in one BatchGetItem, each class then enrolls or waitlists on its own
+@router.post("/students/{student_id}/enroll-batch", tags=['Student'], summary="Enroll in several classes")
+async def enroll_student_in_classes(student_id: str, batch: ClassIdBatch, ctx: DataContext = Depends(get_data_context)):
+    class_ids = unique_class_ids(batch)
+    student_found, classes = await asyncio.gather(
+        ctx.student_exists(student_id),
+        ctx.run(qh.batch_query_classes, ctx.dynamodb_client, class_ids),
+    )
+    if not student_found:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
+    if classes is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get classes")
+    async def enroll(class_id):
+        if class_id not in classes:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
+        ctx.prime(("class", class_id), classes[class_id])
+        return await enroll_or_waitlist(ctx, student_id, class_id, classes[class_id])
+    return {"Results": await batch_results(class_ids, enroll)}
+
+# Drop several classes at once, validated against one read of the student's enrollments and one BatchGetItem
+@router.delete("/students/{student_id}/classes", tags=['Student'], summary="Drop several classes")
+async def drop_student_from_classes(student_id: str, batch: ClassIdBatch, ctx: DataContext = Depends(get_data_context)):
+    class_ids = unique_class_ids(batch)
+    student_found, classes, enrolled_ids = await asyncio.gather(
+        ctx.student_exists(student_id),
+        ctx.run(qh.batch_query_classes, ctx.dynamodb_client, class_ids),
+        ctx.enrolled_in(student_id, class_ids),
+    )
+    if not student_found:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
+    if classes is None or enrolled_ids is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get classes")
+    async def drop(class_id):
+        if class_id not in classes:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
+        if class_id not in enrolled_ids:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
+        ctx.prime(("class", class_id), classes[class_id])
+        return await drop_and_promote(ctx, student_id, class_id, classes[class_id])
+    return {"Results": await batch_results(class_ids, drop)}
+
+def unique_class_ids(batch):
+    class_ids = list(dict.fromkeys(batch.ClassIds))
+    if not class_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No classes given")
+    if len(class_ids) > MAX_BATCH_CLASSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_CLASSES} classes per request")
+    return class_ids
+
+# Run func for every class concurrently, each class gets its own status code and body or error
+async def batch_results(class_ids, func):
+    async def result(class_id):
+        try:
+            return {"ClassId": class_id, "Status": status.HTTP_200_OK, "Result": await func(class_id)}
+        except HTTPException as error:
+            return {"ClassId": class_id, "Status": error.status_code, "Error": error.detail}
+    return await asyncio.gather(*[result(class_id) for class_id in class_ids])
+
+# Drop a student and give the seat to the first student on the waitlist, shared by the student and instructor drop routes
+async def drop_and_promote(ctx, student_id, class_id, class_data):
     # Drop student from class
-    drop_finished = qh.drop_student_from_class(dynamodb_client, student_id, class_id)
-    if not drop_finished:
+    drop_result = await ctx.run(qh.drop_student_from_class, ctx.dynamodb_client, student_id, class_id, class_data["Detail"])
+    if drop_result != qh.DROP_ERROR:
+        ctx.enrolled_changed(student_id, class_id, False)
+        rc.student_changed(ctx.pending_redis(), student_id)
+    if drop_result == qh.DROP_NOT_ENROLLED:
+        # The enrolled set or GSI1 was behind, the student had already left the class
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
+    if drop_result != qh.DROP_OK:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to drop student from class")
+    # The drop is committed from here on, a retry would only get a 404, so what goes wrong
+    # freeing the seat is reported next to the drop instead of failing the request
     # Decrement enrollment number in the database
-    new_enrollment = class_data['currentEnroll'] - 1
-    update_finished = qh.update_current_enroll(dynamodb_client, class_id, new_enrollment)
+    update_finished = await ctx.run(qh.increment_current_enroll, ctx.dynamodb_client, class_id, -1, qh.counter_shards(class_data))
     if not update_finished:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to update class enrollment")
+        logger.error("Dropped student %s from class %s but couldn't decrement its enrollment", student_id, class_id)
+        return {"message": "Student dropped from class", "Promotion": "Unable to update class enrollment, waitlist not promoted"}
     # check if waitlist exists for class
     # check if freeze is on
     if not class_data['Frozen']:
-        if r.exists(f"waitlist:{class_id}"):
-            # first student on waitlist is automatically enrolled
-            waitlist_data = r.lrange(f"waitlist:{class_id}", 0, 0)
-            waitlist_data = [item.decode('utf-8')[2:] for item in waitlist_data]
-            # Enroll student in class
-            enrolled_class = qh.update_enrolled_class(dynamodb_client, waitlist_data[0], class_id)
-            if not enrolled_class:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to enroll student in class")
-            # Increment enrollment number in the database
-            new_enrollment = class_data['currentEnroll'] + 1
-            update_finished = qh.update_current_enroll(dynamodb_client, class_id, new_enrollment)
-            if not update_finished:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to update class enrollment")
-            # Remove student from waitlist
-            r.lrem(f"waitlist:{class_id}", 0, f"s#{waitlist_data[0]}")
-            # Fetch the updated class data from the databas
-            updated_class_data = qh.query_class(dynamodb_client, class_id)
-            return {"message": "Student dropped from class and first student on waitlist enrolled", "Class": updated_class_data["Detail"]}
+        # first student on waitlist is automatically enrolled
+        while waitlist_student_id := await wh.first_in_waitlist(ctx.redis, class_id):
+            # Enroll student in class, the transaction also increments the enrollment number
+            result = await ctx.run(qh.enroll_student_transaction, ctx.dynamodb_client, waitlist_student_id, class_id, class_data)
+            if result == qh.ENROLL_DUPLICATE:
+                # Enrolled without the waitlist in the meantime, the seat goes to the next student
+                await wh.remove_from_waitlist(ctx.redis, class_id, waitlist_student_id)
+                ctx.enrolled_changed(waitlist_student_id, class_id, True)
+                rc.student_changed(ctx.pending_redis(), waitlist_student_id)
+                await waitlist_changed(ctx, class_id, joined=False)
+                continue
+            if result in (qh.ENROLL_FULL, qh.ENROLL_FROZEN):
+                # The freed seat was already taken by a direct enrollment, or the class was frozen
+                # since it was read, keep the waitlist as is
+                return {"message": "Student dropped from class"}
+            if result != qh.ENROLL_OK:
+                logger.error("Dropped student %s from class %s but couldn't enroll %s from its waitlist", student_id, class_id, waitlist_student_id)
+                return {"message": "Student dropped from class", "Promotion": "Unable to enroll first student on waitlist"}
+            ctx.enrolled_changed(waitlist_student_id, class_id, True)
+            rc.student_changed(ctx.pending_redis(), waitlist_student_id)
+            # Remove student from waitlist, queued on the request pipeline
+            wh.queue_remove_from_waitlist(ctx.pending_redis(), class_id, waitlist_student_id)
+            await ctx.flush()
+            await waitlist_changed(ctx, class_id, joined=False)
+            # Class detail doesn't change on enrollment so the class read at the start is still valid
+            return {"message": "Student dropped from class and first student on waitlist enrolled", "Class": class_data["Detail"]}
     return {"message": "Student dropped from class"}
-    
+
 
 #==========================================wait list========================================== 
 
 
 # DONE: Get wait list position for a student in a class
 @router.get("/students/{student_id}/waitlist/{class_id}", tags=['Waitlist'], summary="Get waitlist position for a student in a class")
-def view_waiting_list(student_id: str, class_id: str):
-    # check if student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def view_waiting_list(student_id: str, class_id: str, ctx: DataContext = Depends(get_data_context)):
+    # check if student and class exist in the database
+    student_found, class_data = await asyncio.gather(ctx.student_exists(student_id), ctx.query_class(class_id))
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    # check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    waitlist_key = f"waitlist:{class_id}"
-    if not r.exists(waitlist_key):
+    if not await wh.waitlist_length(ctx.redis, class_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    waitlist_data = r.lrange(waitlist_key, 0, -1)
-    if not waitlist_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    # Check if student is on waitlist
-    id = f"s#{student_id}".encode('utf-8')
-    if id not in waitlist_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not on waitlist")
     # Get student's position on waitlist
-    position = waitlist_data.index(id) + 1
+    position = await wh.waitlist_position(ctx.redis, class_id, student_id)
+    if position is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not on waitlist")
     return {"Waitlist Position": position}
 
 # DONE: remove a student from a waiting list
 @router.delete("/students/{student_id}/waitlist/{class_id}", tags=['Waitlist'], summary="Remove a student from a waiting list")
-def remove_from_waitlist(student_id: str, class_id: str):
-    # check if student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
+async def remove_from_waitlist(student_id: str, class_id: str, ctx: DataContext = Depends(get_data_context)):
+    # check if student and class exist in the database
+    student_found, class_data = await asyncio.gather(ctx.student_exists(student_id), ctx.query_class(class_id))
+    if not student_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    # check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    waitlist_key = f"waitlist:{class_id}"
-    if not r.exists(waitlist_key):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    waitlist_data = r.lrange(waitlist_key, 0, -1)
-    if not waitlist_data:
+    if not await wh.waitlist_length(ctx.redis, class_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    # Check if student is on waitlist
-    id = f"s#{student_id}".encode('utf-8')
-    if id not in waitlist_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not on waitlist")
     # Remove student from waitlist
-    r.lrem(waitlist_key, 0, id)
+    if not await wh.remove_from_waitlist(ctx.redis, class_id, student_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not on waitlist")
+    rc.student_changed(ctx.pending_redis(), student_id)
+    await waitlist_changed(ctx, class_id, joined=False)
     return {"message": "Student removed from the waiting list"}
 
 # DONE: Get waitlist for a class
 @router.get("/classes/{class_id}/waitlist",tags=['Waitlist'], summary="Get waitlist for a class")
-def view_current_waitlist(class_id: str):
+async def view_current_waitlist(class_id: str, page: Page = Depends(), ctx: DataContext = Depends(get_data_context)):
     # Check if class exist
-    class_data = qh.query_class(dynamodb_client, class_id)
+    class_data = await ctx.query_class(class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    waitlist_key = f"waitlist:{class_id}"
-    if not r.exists(waitlist_key):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    waitlist_data = r.lrange(waitlist_key, 0, -1)
+    # Waitlist cursor is the offset into the sorted set
+    offset = page.start_key.get("offset", 0) if page.start_key else 0
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    end = offset + page.limit if page.limit else 0
+    waitlist_data = await wh.waitlist_members(ctx.redis, class_id, offset, end - 1)
+    next_cursor = None
+    if page.limit and len(waitlist_data) == page.limit:
+        next_cursor = qh.encode_cursor({"offset": offset + page.limit})
     if not waitlist_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
-    waitlist_data = [item.decode('utf-8') for item in waitlist_data]
+        if not offset:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No waitlist found")
+        return {"Waitlist": [], "NextCursor": None}
     # Get student info from waitlist_data
-    waitlist_data = qh.batch_query_student(dynamodb_client, waitlist_data)
-    return {"Waitlist": waitlist_data}
+    waitlist_data = await ctx.run(qh.batch_query_student, ctx.dynamodb_client, waitlist_data)
+    return {"Waitlist": waitlist_data, "NextCursor": next_cursor}
 
 
 #==========================================Instructor==================================================
 
 
-# DONE: view current enrollment for class
-@router.get("/instructors/{instructor_id}/classes/{class_id}/enrollment", tags=['Instructor'], summary="Get current enrollment for class")
-def get_instructor_enrollment(instructor_id: str, class_id: str):
-    # check if instructor exists in the database
-    instructor_data = qh.query_instructor(dynamodb_client, instructor_id)
-    if not instructor_data:
+"""Run validation checks concurrently, raise the first failure and cancel the checks still running
+   Returns the results of all checks in order when none fails"""
+async def validate(*checks):
+    tasks = [asyncio.ensure_future(check) for check in checks]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [task.result() for task in tasks]
+
+# Check an instructor owns a class, the instructor's GSI2 row for the class answers for both existing
+# Only when it's missing are the instructor and class read to tell which one is wrong
+async def require_class_instructor(ctx, instructor_id, class_id):
+    if await ctx.query_class_instructor(instructor_id, class_id):
+        return
+    instructor_found, class_data = await asyncio.gather(ctx.instructor_exists(instructor_id), ctx.query_class(class_id))
+    if not instructor_found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
-    # check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    # check if instructor is assigned to class
-    class_instructor = qh.query_class_instructor(dynamodb_client, instructor_id, class_id)
-    if not class_instructor:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor is not assigned to this class")
-    # get enrollment data
-    enrollment_data = qh.query_enrolled_students(dynamodb_client, class_id)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor is not assigned to this class")
+
+async def require_student(ctx, student_id):
+    if not await ctx.student_exists(student_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
+
+async def require_enrolled(ctx, student_id, class_id):
+    enrolled = await ctx.is_enrolled(student_id, class_id)
+    if enrolled is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get enrolled classes")
+    if not enrolled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
+
+
+# DONE: view current enrollment for class
+@router.get("/instructors/{instructor_id}/classes/{class_id}/enrollment", tags=['Instructor'], summary="Get current enrollment for class")
+async def get_instructor_enrollment(instructor_id: str, class_id: str, page: Page = Depends(), ctx: DataContext = Depends(get_data_context)):
+    # check the instructor owns the class while reading the page of enrolled students
+    _, (enrollment_data, last_key) = await validate(
+        require_class_instructor(ctx, instructor_id, class_id),
+        page.read(ctx, qh.query_enrolled_students_page, class_id),
+    )
     if not enrollment_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No enrollment found")
-    return {"Enrollment": enrollment_data}
+        if page.start_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No enrollment found")
+        enrollment_data = []
+    return {"Enrollment": enrollment_data, "NextCursor": qh.encode_cursor(last_key)}
 
 # DONE: view students who have dropped the class
 @router.get("/instructors/{instructor_id}/classes/{class_id}/drop", tags=['Instructor'], summary="Get students who dropped the class")
-def get_instructor_dropped(instructor_id: str, class_id: str):
-    # check if instructor exists in the database
-    instructor_data = qh.query_instructor(dynamodb_client, instructor_id)
-    if not instructor_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
-    # check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
-    if not class_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    # check if instructor is assigned to class
-    class_instructor = qh.query_class_instructor(dynamodb_client, instructor_id, class_id)
-    if not class_instructor:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor is not assigned to this class")
-    # get dropped data
-    dropped_data = qh.query_dropped_students(dynamodb_client, class_id)
+async def get_instructor_dropped(instructor_id: str, class_id: str, page: Page = Depends(), ctx: DataContext = Depends(get_data_context)):
+    # check the instructor owns the class while reading the page of dropped students
+    _, (dropped_data, last_key) = await validate(
+        require_class_instructor(ctx, instructor_id, class_id),
+        page.read(ctx, qh.query_dropped_students_page, class_id),
+    )
     if not dropped_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No dropped found")
+        if page.start_key is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No dropped found")
+        dropped_data = []
     
-    return {"Dropped": dropped_data}
+    return {"Dropped": dropped_data, "NextCursor": qh.encode_cursor(last_key)}
 
 # DONE: Instructor administratively drop students
 @router.post("/instructors/{instructor_id}/classes/{class_id}/students/{student_id}/drop", tags=['Instructor'], summary="Instructor administratively drop students")
-def instructor_drop_class(instructor_id: str, class_id: str, student_id: str):
-    # check if instructor exists in the database
-    instructor_data = qh.query_instructor(dynamodb_client, instructor_id)
-    if not instructor_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
-    # check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
+async def instructor_drop_class(instructor_id: str, class_id: str, student_id: str, ctx: DataContext = Depends(get_data_context)):
+    # ownership, student and enrollment checks don't depend on each other, run them all at once
+    _, _, _, class_data = await validate(
+        require_class_instructor(ctx, instructor_id, class_id),
+        require_student(ctx, student_id),
+        require_enrolled(ctx, student_id, class_id),
+        ctx.query_class(class_id),
+    )
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    # check if instructor is assigned to class
-    class_instructor = qh.query_class_instructor(dynamodb_client, instructor_id, class_id)
-    if not class_instructor:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor is not assigned to this class")
-    # check if student exists in the database
-    student_data = qh.query_student(dynamodb_client, student_id)
-    if not student_data:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No student found")
-    # check if student is enrolled in the class
-    enrolled_class = qh.query_enrolled_classes(dynamodb_client, student_id)
-    if not enrolled_class:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
-    class_ids = [item['id'] for item in enrolled_class]
-    if class_id not in class_ids:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student is not enrolled in this class")
-    # Drop student from class
-    drop_finished = qh.drop_student_from_class(dynamodb_client, student_id, class_id)
-    if not drop_finished:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to drop student from class")
-    # Decrement enrollment number in the database
-    new_enrollment = class_data['currentEnroll'] - 1
-    update_finished = qh.update_current_enroll(dynamodb_client, class_id, new_enrollment)
-    if not update_finished:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to update class enrollment")
-    # check if waitlist exists for class
-    # check if freeze is on
-    if not class_data['Frozen']:
-        if r.exists(f"waitlist:{class_id}"):
-            # first student on waitlist is automatically enrolled
-            waitlist_data = r.lrange(f"waitlist:{class_id}", 0, 0)
-            waitlist_data = [item.decode('utf-8')[2:] for item in waitlist_data]
-            # Enroll student in class
-            enrolled_class = qh.update_enrolled_class(dynamodb_client, waitlist_data[0], class_id)
-            if not enrolled_class:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to enroll student in class")
-            # Increment enrollment number in the database
-            new_enrollment = class_data['currentEnroll'] + 1
-            update_finished = qh.update_current_enroll(dynamodb_client, class_id, new_enrollment)
-            if not update_finished:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to update class enrollment")
-            # Remove student from waitlist
-            r.lrem(f"waitlist:{class_id}", 0, f"s#{waitlist_data[0]}")
-            # Fetch the updated class data from the databas
-            updated_class_data = qh.query_class(dynamodb_client, class_id)
-            return {"message": "Student dropped from class and first student on waitlist enrolled", "Class": updated_class_data["Detail"]}
-    return {"message": "Student dropped from class"}
+    return await drop_and_promote(ctx, student_id, class_id, class_data)
+
+
+# Enrollment, dropped students and waitlist of every class an instructor teaches, in one call
+@router.get("/instructors/{instructor_id}/dashboard", tags=['Instructor'], summary="Get enrollment, drops and waitlists for all classes of an instructor")
+async def get_instructor_dashboard(instructor_id: str, ctx: DataContext = Depends(get_data_context)):
+    # check if instructor exists while finding their classes through GSI2
+    instructor_data, class_ids = await asyncio.gather(
+        ctx.query_instructor(instructor_id),
+        ctx.run(qh.query_instructor_classes, ctx.dynamodb_client, instructor_id),
+    )
+    if not instructor_data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
+    if class_ids is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get instructor classes")
+    if not class_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No classes found")
+    # Class items, every roster and all waitlists are independent reads
+    roster_states = ("enrolled", "dropped")
+    classes, waitlists, *rosters = await asyncio.gather(
+        ctx.run(qh.batch_query_classes, ctx.dynamodb_client, class_ids),
+        wh.batch_waitlist_members(ctx.redis, class_ids),
+        *[ctx.run(qh.query_roster_keys, ctx.dynamodb_client, class_id, state) for class_id in class_ids for state in roster_states],
+    )
+    if classes is None or any(roster is None for roster in rosters):
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get instructor classes")
+    # One batched lookup for every student on any roster or waitlist
+    student_keys = {key for roster in rosters for key in roster}
+    student_keys.update(key for members in waitlists.values() for key in members)
+    students = await ctx.run(qh.batch_query_student, ctx.dynamodb_client, sorted(student_keys))
+    if students is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to get students")
+    students = {f"s#{student['id']}": student for student in students}
+    dashboard = []
+    for index, class_id in enumerate(class_ids):
+        class_data = classes.get(class_id)
+        # The class is being deleted, its instructor row goes last
+        if class_data is None:
+            continue
+        enrolled, dropped = rosters[2 * index], rosters[2 * index + 1]
+        dashboard.append({
+            "id": class_id,
+            "Detail": class_data["Detail"],
+            "currentEnroll": class_data["currentEnroll"],
+            "maxEnroll": class_data["maxEnroll"],
+            "Frozen": class_data["Frozen"],
+            "Enrollment": [students[key] for key in enrolled if key in students],
+            "Dropped": [students[key] for key in dropped if key in students],
+            "Waitlist": [students[key] for key in waitlists[class_id] if key in students],
+        })
+    return {"Instructor": instructor_data, "Classes": dashboard}
 
 
 #==========================================registrar==================================================
@@ -357,60 +536,294 @@ def instructor_drop_class(instructor_id: str, class_id: str, student_id: str):
 
 # DONE: Create a new class
 @router.post("/registrar/classes/", tags=['Registrar'])
-def create_class(class_data: Class):
+async def create_class(class_data: Class, ctx: DataContext = Depends(get_data_context)):
     # Check instructor exists in the database
-    instructor_data = qh.query_instructor(dynamodb_client, class_data.InstructorId)
+    instructor_data = await ctx.query_instructor(class_data.InstructorId)
     if not instructor_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
-    class_created = qh.create_class(dynamodb_client, class_data)
-    if not class_created:
+    class_id = await ctx.run(qh.create_class, ctx.dynamodb_client, class_data)
+    if not class_id:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to create class")
+    # Open the class to students with batched writes, large audiences run as a background job
+    student_ids = await ctx.run(qh.query_class_audience, ctx.dynamodb_client)
+    if student_ids is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to create class")
-    return {"message": "Class created successfully"}
+    if len(student_ids) > BACKGROUND_FANOUT_THRESHOLD:
+        job_id = await jobs.start_job_async(ctx.redis, r, "create_class", len(student_ids), open_class_job, class_id, class_data, student_ids)
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"message": "Class created, opening it to students in the background", "ClassId": class_id, "JobId": job_id})
+    opened = await ctx.run(qh.open_class_for_students, ctx.dynamodb_client, class_id, class_data, student_ids)
+    rc.classes_changed(ctx.pending_redis())
+    if not opened:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to create class")
+    return {"message": "Class created successfully", "ClassId": class_id}
+
+def open_class_job(class_id, class_data, student_ids, progress):
+    try:
+        return qh.open_class_for_students(dynamodb_client, class_id, class_data, student_ids, progress)
+    finally:
+        rc.classes_changed(r)
+
+# Get status and progress of a background registrar job
+@router.get("/registrar/jobs/{job_id}", tags=['Registrar'])
+async def get_job_status(job_id: str):
+    job = await jobs.get_job(async_r, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No job found")
+    return {"Job": job}
 
 # DONE: Remove a class
 @router.delete("/registrar/classes/{class_id}", tags=['Registrar'])
-def remove_class(class_id: str):
+async def remove_class(class_id: str, ctx: DataContext = Depends(get_data_context)):
     # Check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
+    class_data = await ctx.query_class(class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    removed_class = qh.delete_class(dynamodb_client, class_id)
-    if not removed_class:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to remove class")
-    return {"message": "Class removed successfully"}
+    # Large classes have thousands of rows, delete them in the background and report progress
+    job_id = await jobs.start_job_async(ctx.redis, r, "delete_class", 0, delete_class_job, class_id)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"message": "Class removal started", "ClassId": class_id, "JobId": job_id})
+
+def delete_class_job(class_id, progress):
+    deleted = qh.delete_class(dynamodb_client, class_id, progress)
+    wh.delete_waitlist(r, class_id)
+    rc.classes_changed(r)
+    return deleted
 
 # DONE: Change the assigned instructor for a class
 @router.put("/registrar/classes/{class_id}/instructors/{instructor_id}", tags=['Registrar'])
-def change_instructor(class_id: str, instructor_id: str):
-    # Check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
+async def change_instructor(class_id: str, instructor_id: str, ctx: DataContext = Depends(get_data_context)):
+    # Check if class and instructor exist in the database
+    class_data, instructor_data = await asyncio.gather(ctx.query_class(class_id), ctx.query_instructor(instructor_id))
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
-    # Check if instructor exists in the database
-    instructor_data = qh.query_instructor(dynamodb_client, instructor_id)
     if not instructor_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No instructor found")
     # Change the assigned instructor for the class
-    instructor_changed = qh.change_instructor(dynamodb_client, class_id, instructor_id)
+    instructor_changed = await ctx.run(qh.change_instructor, ctx.dynamodb_client, class_id, instructor_id)
     if not instructor_changed:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to change instructor")
+    # Available class listings show the instructor
+    rc.classes_changed(ctx.pending_redis())
     # return success message
     return {"message": "Instructor changed"}
 
 
 # DONE: Freeze enrollment for classes
 @router.put("/registrar/classes/{class_id}/freeze", tags=['Registrar'])
-def freeze_automatic_enrollment(class_id: str):
+async def freeze_automatic_enrollment(class_id: str, ctx: DataContext = Depends(get_data_context)):
     # Check if class exists in the database
-    class_data = qh.query_class(dynamodb_client, class_id)
+    class_data = await ctx.query_class(class_id)
     if not class_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
     # Check if class is already frozen
     if class_data['Frozen']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Class is already frozen")
     # Freeze the class
-    freeze_finished = qh.freeze_enrollment(dynamodb_client, class_id)
+    freeze_finished = await ctx.run(qh.freeze_enrollment, ctx.dynamodb_client, class_id)
     if not freeze_finished:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to freeze enrollment")
     # return success message
-    return {"message": "Enrollment frozen"}
\ No newline at end of file
+    return {"message": "Enrollment frozen"}
+
+
+# Mark a class hot, its enrollment count is spread over shards counter items so a popular class
+# doesn't throttle on its class item when enrollment opens
+@router.put("/registrar/classes/{class_id}/hot", tags=['Registrar'], summary="Shard the enrollment counter of a class")
+async def enable_hot_class(class_id: str, shards: int = Query(8, ge=2, le=qh.MAX_COUNTER_SHARDS), ctx: DataContext = Depends(get_data_context)):
+    class_data = await ctx.query_class(class_id)
+    if not class_data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
+    if qh.counter_shards(class_data):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Class is already hot")
+    if shards > class_data['maxEnroll']:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="More shards than seats in the class")
+    enabled = await ctx.run(qh.enable_counter_shards, ctx.dynamodb_client, class_id, shards)
+    if not enabled:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to shard enrollment counter")
+    return {"message": "Class is hot", "CounterShards": shards}
+
+# Merge the counter shards of a hot class back into currentEnroll
+@router.delete("/registrar/classes/{class_id}/hot", tags=['Registrar'], summary="Merge the enrollment counter of a class")
+async def disable_hot_class(class_id: str, ctx: DataContext = Depends(get_data_context)):
+    class_data = await ctx.query_class(class_id)
+    if not class_data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No class found")
+    if not qh.counter_shards(class_data):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Class is not hot")
+    disabled = await ctx.run(qh.disable_counter_shards, ctx.dynamodb_client, class_id)
+    if not disabled:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to merge enrollment counter")
+    return {"message": "Class is no longer hot"}
+
+
+#==========================================registrar bulk==================================================
+
+
+# Bulk bodies are a JSON array or NDJSON, one item per line. Each item gets its own result line,
+# bad items don't fail the request. Items are written in chunks of BULK_CHUNK_SIZE, BULK_CONCURRENCY
+# chunks at a time, results stream back as chunks finish and a Summary line closes the response.
+
+# DONE: Create many classes
+@router.post("/registrar/bulk/classes", tags=['Registrar'], summary="Create classes in bulk")
+async def bulk_create_classes(request: Request):
+    items = await read_bulk_items(request, Class)
+    created = []
+    def create_chunk(class_details):
+        results = qh.create_classes(dynamodb_client, class_details)
+        created.extend((result, class_detail) for (code, result), class_detail in zip(results, class_details) if code == status.HTTP_201_CREATED)
+        return results
+    # Open every new class to students with one background job once all chunks are written
+    def open_created():
+        if not created:
+            return {}
+        student_ids = qh.query_class_audience(dynamodb_client)
+        if student_ids is None:
+            return {"Error": "Unable to open classes to students"}
+        job_id = jobs.start_job(r, "bulk_create_classes", len(student_ids) * len(created), open_classes_job, list(created), student_ids)
+        return {"JobId": job_id}
+    return bulk_response("create_classes", items, create_chunk, lambda item: None, open_created)
+
+def open_classes_job(classes, student_ids, progress):
+    try:
+        return qh.open_classes_for_students(dynamodb_client, classes, student_ids, progress)
+    finally:
+        rc.classes_changed(r)
+
+# DONE: Change the assigned instructor of many classes
+@router.put("/registrar/bulk/instructors", tags=['Registrar'], summary="Change instructors in bulk")
+async def bulk_change_instructors(request: Request):
+    items = await read_bulk_items(request, InstructorChange, unique_class_ids=True)
+    def change_chunk(changes):
+        results = qh.change_instructors(dynamodb_client, [(change.ClassId, change.InstructorId) for change in changes])
+        # Available class listings show the instructor
+        if any(code < 400 for code, _ in results):
+            rc.classes_changed(r)
+        return results
+    return bulk_response("change_instructors", items, change_chunk, lambda item: item.ClassId)
+
+# DONE: Freeze enrollment for many classes
+@router.put("/registrar/bulk/freeze", tags=['Registrar'], summary="Freeze enrollment in bulk")
+async def bulk_freeze_enrollment(request: Request):
+    items = await read_bulk_items(request, ClassRef, unique_class_ids=True)
+    def freeze_chunk(refs):
+        return qh.freeze_classes(dynamodb_client, [ref.ClassId for ref in refs])
+    return bulk_response("freeze_classes", items, freeze_chunk, lambda item: item.ClassId)
+
+"""Parse a bulk body into a list of (index, model or error message)
+   A class id listed twice in one request would race with itself, later copies are rejected"""
+async def read_bulk_items(request, model, unique_class_ids=False):
+    if "ndjson" in request.headers.get("content-type", ""):
+        raw_items = []
+        for line in (await request.body()).splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(json.loads(line))
+            except ValueError:
+                raw_items.append(ValueError("Invalid JSON"))
+    else:
+        try:
+            raw_items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+    if not raw_items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No items given")
+    if len(raw_items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    items = []
+    seen = set()
+    for index, raw_item in enumerate(raw_items):
+        if isinstance(raw_item, ValueError):
+            items.append((index, str(raw_item)))
+            continue
+        try:
+            item = model.model_validate(raw_item)
+        except ValidationError as error:
+            items.append((index, "; ".join(f"{'.'.join(map(str, e['loc'])) or 'item'}: {e['msg']}" for e in error.errors())))
+            continue
+        if unique_class_ids:
+            if item.ClassId in seen:
+                items.append((index, "Class listed more than once"))
+                continue
+            seen.add(item.ClassId)
+        items.append((index, item))
+    return items
+
+"""Stream one NDJSON line per item and a closing Summary line
+   func(chunk of models) runs on the backend executor and returns one (status code, result) per model,
+   class_id(model) gives the ClassId for the result line and finish() adds fields to the Summary.
+   Uses the module clients, the request's DataContext is closed before the body streams"""
+def bulk_response(operation, items, func, class_id, finish=None):
+    async def stream():
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+        counts = {"Succeeded": 0, "Failed": 0}
+
+        def line(index, code, item_class_id, result):
+            counts["Succeeded" if code < 400 else "Failed"] += 1
+            entry = {"Index": index, "Status": code}
+            if item_class_id is not None:
+                entry["ClassId"] = item_class_id
+            entry["Result" if code < 400 else "Error"] = result
+            return json.dumps(entry) + "\n"
+
+        async def run_chunk(chunk):
+            async with semaphore:
+                chunk_start = time.perf_counter()
+                try:
+                    results = await loop.run_in_executor(backend_executor, metrics.in_context(func), [item for _, item in chunk])
+                except Exception:
+                    logger.exception("Bulk %s chunk failed", operation)
+                    results = [(status.HTTP_500_INTERNAL_SERVER_ERROR, "Unexpected error")] * len(chunk)
+                metrics.record_bulk_chunk(operation, [code for code, _ in results], time.perf_counter() - chunk_start)
+                return chunk, results
+
+        valid = [(index, item) for index, item in items if not isinstance(item, str)]
+        for index, error in items:
+            if isinstance(error, str):
+                metrics.record_bulk_items(operation, [BULK_INVALID_ITEM])
+                yield line(index, BULK_INVALID_ITEM, None, error)
+        tasks = [asyncio.ensure_future(run_chunk(valid[i:i + BULK_CHUNK_SIZE])) for i in range(0, len(valid), BULK_CHUNK_SIZE)]
+        try:
+            for next_chunk in asyncio.as_completed(tasks):
+                chunk, results = await next_chunk
+                for (index, item), (code, result) in zip(chunk, results):
+                    item_class_id = result if code == status.HTTP_201_CREATED else class_id(item)
+                    yield line(index, code, item_class_id, result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        summary = {"Items": len(items), **counts}
+        if finish is not None:
+            summary.update(await loop.run_in_executor(backend_executor, metrics.in_context(finish)))
+        seconds = time.perf_counter() - start
+        summary["Seconds"] = round(seconds, 3)
+        summary["ItemsPerSecond"] = round(len(items) / seconds, 1) if seconds else None
+        yield json.dumps({"Summary": summary}) + "\n"
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+#==========================================monitoring==================================================
+
+
+# Class cache hit/miss counters for this worker
+@router.get("/cache/stats", tags=['Monitoring'], summary="Get class cache statistics")
+async def get_cache_stats():
+    return {"ClassCache": qh.class_cache.stats(), "ClassReads": qh.class_flights.stats()}
+
+# Prometheus metrics for this worker, scrape each enrollment_service port
+@router.get("/metrics", tags=['Monitoring'], summary="Get Prometheus metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    stats = qh.class_cache.stats()
+    flights = qh.class_flights.stats()
+    return metrics.render({
+        "enrollment_class_cache_local_hits_total": ("counter", "Class cache hits served by this worker", stats["local_hits"]),
+        "enrollment_class_cache_redis_hits_total": ("counter", "Class cache hits served by Redis", stats["redis_hits"]),
+        "enrollment_class_cache_misses_total": ("counter", "Class cache misses", stats["misses"]),
+        "enrollment_class_cache_invalidations_total": ("counter", "Class cache invalidations", stats["invalidations"]),
+        "enrollment_class_cache_stale_sets_total": ("counter", "Class reads not cached because the class was invalidated while they ran", stats["stale_sets"]),
+        "enrollment_class_cache_size": ("gauge", "Classes in this worker's cache", stats["size"]),
+        "enrollment_class_read_coalescing_ratio": ("gauge", "Share of class cache misses that joined another request's DynamoDB read", flights["coalescing_ratio"]),
+    })
@@ -0,0 +1,101 @@
+''' This file contains request coalescing for hot reads.
+    SingleFlight lets threads of one worker that ask for the same key at the same time share
+    one backend call: the first caller runs it, the others wait for its result.
+    RedisLease does the same across workers with a short-lived Redis key, the worker holding it
+    reads from DynamoDB and fills the shared cache, the others wait for the cache entry instead.'''
+import copy
+import threading
+import uuid
+
+import enrollment_service.metrics as metrics
+
+# KEYS[1] lease key, ARGV[1] token, only the holder may release a lease
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    """Run func(*args) once for all concurrent callers with the same key
+       Every caller gets its own deep copy of the result so callers can't change each other's data"""
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        metrics.record_single_flight(self.name, "leader" if leader else "follower")
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = func(*args)
+            return copy.deepcopy(call.result)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            call.done.set()
+
+    """Let callers after a write start a new call instead of joining one that read before it"""
+    def forget(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            calls = self.leaders + self.followers
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "coalescing_ratio": self.followers / calls if calls else 0.0,
+            }
+
+
+class RedisLease:
+    def __init__(self, prefix, lease_ms):
+        self.prefix = prefix
+        self.lease_ms = lease_ms
+        self.release_script = None
+
+    def key(self, name):
+        return f"{self.prefix}:{name}"
+
+    """Try to take the lease, returns a token to release it with or None if another worker holds it"""
+    def acquire(self, r, name):
+        token = uuid.uuid4().hex
+        if r.set(self.key(name), token, nx=True, px=self.lease_ms):
+            return token
+        return None
+
+    def release(self, r, name, token):
+        if self.release_script is None:
+            self.release_script = r.register_script(RELEASE_LEASE_SCRIPT)
+        self.release_script(keys=[self.key(name)], args=[token], client=r)
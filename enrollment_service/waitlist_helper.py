@@ -0,0 +1,104 @@
+''' This file contains the Redis waitlist helpers for the enrollment service.
+    Each waitlist is a sorted set keyed waitlist:{class_id} with members s#{student_id}
+    scored by join time in microseconds, so FIFO order is the score order and
+    membership, position and removal don't need the whole list.
+    Routes call these with a redis.asyncio client and await them, delete_waitlist runs
+    in a background job on the blocking client.'''
+import time
+
+WAITLIST_ADDED = 0
+WAITLIST_ALREADY_PRESENT = 1
+WAITLIST_FULL = 2
+
+# KEYS[1] waitlist key, ARGV[1] member, ARGV[2] max waitlist size
+# Checks membership and capacity and adds the member in one atomic step, scored by server time
+JOIN_WAITLIST_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return 1
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 2
+end
+local now = redis.call('TIME')
+-- build the microsecond score as a string, Lua would print the number in exponent form
+redis.call('ZADD', KEYS[1], now[1] .. string.format('%06d', now[2]), ARGV[1])
+return 0
+"""
+_join_waitlist_script = None
+
+
+def waitlist_key(class_id):
+    return f"waitlist:{class_id}"
+
+def waitlist_member(student_id):
+    return f"s#{student_id}"
+
+def join_score():
+    return time.time_ns() // 1000
+
+
+"""Atomically join a waitlist if the student isn't on it and it isn't full
+   Returns WAITLIST_ADDED, WAITLIST_ALREADY_PRESENT or WAITLIST_FULL"""
+async def join_waitlist(r, class_id, student_id, max_waitlist):
+    global _join_waitlist_script
+    if _join_waitlist_script is None:
+        _join_waitlist_script = r.register_script(JOIN_WAITLIST_SCRIPT)
+    return await _join_waitlist_script(keys=[waitlist_key(class_id)], args=[waitlist_member(student_id), max_waitlist], client=r)
+
+"""Get 1-based waitlist position of a student, None if not on the waitlist"""
+async def waitlist_position(r, class_id, student_id):
+    rank = await r.zrank(waitlist_key(class_id), waitlist_member(student_id))
+    if rank is None:
+        return None
+    return rank + 1
+
+"""Remove student from a waitlist, returns False if they weren't on it"""
+async def remove_from_waitlist(r, class_id, student_id):
+    return await r.zrem(waitlist_key(class_id), waitlist_member(student_id)) == 1
+
+"""Queue removing a student from a waitlist on a pipeline"""
+def queue_remove_from_waitlist(pipe, class_id, student_id):
+    pipe.zrem(waitlist_key(class_id), waitlist_member(student_id))
+
+"""Get number of students on a waitlist"""
+async def waitlist_length(r, class_id):
+    return await r.zcard(waitlist_key(class_id))
+
+"""Get waitlist members in FIFO order as s#student_id strings"""
+async def waitlist_members(r, class_id, start=0, end=-1):
+    return [item.decode('utf-8') for item in await r.zrange(waitlist_key(class_id), start, end)]
+
+"""Get the student id at the head of a waitlist, None if empty"""
+async def first_in_waitlist(r, class_id):
+    members = await waitlist_members(r, class_id, 0, 0)
+    if not members:
+        return None
+    return members[0][2:]
+
+"""Delete a whole waitlist, used when its class is removed"""
+def delete_waitlist(r, class_id):
+    return r.delete(waitlist_key(class_id)) == 1
+
+"""Get waitlist length and membership of a student for many classes in one round trip
+   Returns a dict of class_id -> {"length": int, "member": bool}"""
+async def batch_waitlist_status(r, class_ids, student_id):
+    member = waitlist_member(student_id)
+    pipe = r.pipeline(transaction=False)
+    for class_id in class_ids:
+        pipe.zcard(waitlist_key(class_id))
+        pipe.zscore(waitlist_key(class_id), member)
+    results = await pipe.execute()
+    status = {}
+    for index, class_id in enumerate(class_ids):
+        length, score = results[2 * index], results[2 * index + 1]
+        status[class_id] = {"length": length, "member": score is not None}
+    return status
+
+"""Get the members of many waitlists in one round trip
+   Returns a dict of class_id -> list of s#student_id strings in FIFO order"""
+async def batch_waitlist_members(r, class_ids):
+    pipe = r.pipeline(transaction=False)
+    for class_id in class_ids:
+        pipe.zrange(waitlist_key(class_id), 0, -1)
+    results = await pipe.execute()
+    return {class_id: [item.decode('utf-8') for item in members] for class_id, members in zip(class_ids, results)}
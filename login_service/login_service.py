@@ -1,9 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from login_service.routes import router 
+from Utility import log
 
 app = FastAPI()
 
 app.include_router(router)
+
+# Tag every log line of a request with its id, callers can pass their own X-Request-ID
+@app.middleware("http")
+async def request_id(request: Request, call_next):
+    value, token = log.start_request(request.headers.get("X-Request-ID"))
+    try:
+        response = await call_next(request)
+    finally:
+        log.end_request(token)
+    response.headers["X-Request-ID"] = value
+    return response
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8080)
@@ -4,13 +4,14 @@ import sqlite3
 
 from fastapi import Depends, HTTPException, APIRouter, status
 from login_service.database.schemas import Users,Userlogin
-from Utility import utils
+from Utility import log, utils
 
 router = APIRouter()
 
 database = "./var/primary/fuse/database.db"
 database_reps = itertools.cycle(["./var/secondary/fuse/database.db", "./var/tertiary/fuse/database.db"])
 ALLOWED_ROLES = {"student", "professor", "registrar"}
+logger = log.get_logger(__name__)
 
 # Connect to the database
 def get_db():
@@ -37,7 +38,7 @@ def get_db_replicas():
             }
         )
 
-    print(curr_db)
+    logger.debug("Reading from replica %s", curr_db)
 
     with contextlib.closing(connection) as db:
             db.row_factory = sqlite3.Row
@@ -0,0 +1,94 @@
+''' Shared fixtures: a moto DynamoDB table seeded from TitanOnline.json and fakeredis
+    clients on one in-memory server, swapped into the routes module for every test.'''
+import json
+import os
+import pathlib
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import boto3
+import fakeredis
+import fakeredis.aioredis
+import pytest
+from fastapi.testclient import TestClient
+from moto import mock_aws
+
+import enrollment_service.metrics as metrics
+import enrollment_service.query_helper as qh
+import enrollment_service.routes as routes
+from enrollment_service.enrollment_service import app
+
+TABLE_NAME = "TitanOnlineEnrollment"
+DATA_MODEL = pathlib.Path(__file__).resolve().parent.parent / "TitanOnline.json"
+
+
+def create_table(client):
+    model = json.loads(DATA_MODEL.read_text())["DataModel"][0]
+    attributes = {"PK", "SK"}
+    indexes = []
+    for index in model["GlobalSecondaryIndexes"]:
+        keys = index["KeyAttributes"]
+        partition, sort = keys["PartitionKey"]["AttributeName"], keys["SortKey"]["AttributeName"]
+        attributes |= {partition, sort}
+        indexes.append({
+            "IndexName": index["IndexName"],
+            "KeySchema": [{"AttributeName": partition, "KeyType": "HASH"}, {"AttributeName": sort, "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": index["Projection"]["ProjectionType"]},
+        })
+    client.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": name, "AttributeType": "S"} for name in sorted(attributes)],
+        GlobalSecondaryIndexes=indexes,
+        BillingMode="PAY_PER_REQUEST",
+    )
+    for item in model["TableData"]:
+        client.put_item(TableName=TABLE_NAME, Item=item)
+
+
+@pytest.fixture
+def dynamodb():
+    with mock_aws():
+        client = boto3.client("dynamodb")
+        create_table(client)
+        yield metrics.InstrumentedDynamoDB(client)
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def sync_redis(redis_server):
+    return metrics.InstrumentedRedis(fakeredis.FakeRedis(server=redis_server))
+
+@pytest.fixture
+def async_redis(redis_server):
+    return metrics.InstrumentedAsyncRedis(fakeredis.aioredis.FakeRedis(server=redis_server))
+
+
+@pytest.fixture(autouse=True)
+def class_cache():
+    # Every test starts with an empty class cache that isn't backed by Redis
+    cache = qh.ClassCache()
+    original = qh.class_cache
+    qh.class_cache = cache
+    yield cache
+    qh.class_cache = original
+
+
+@pytest.fixture
+def client(dynamodb, sync_redis, async_redis, class_cache, monkeypatch):
+    monkeypatch.setattr(routes, "dynamodb_client", dynamodb)
+    monkeypatch.setattr(routes, "r", sync_redis)
+    monkeypatch.setattr(routes, "async_r", async_redis)
+    class_cache.redis_client = sync_redis
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def class_count(dynamodb, class_id):
+    return qh.fetch_class(dynamodb, class_id)["currentEnroll"]
@@ -0,0 +1,31 @@
+import enrollment_service.auth as auth
+
+
+def test_claims_are_ignored_by_default(monkeypatch):
+    monkeypatch.setattr(auth, "TRUST_GATEWAY_CLAIMS", False)
+    assert not auth.AuthContext("1", "student1", ["student"]).vouches_for("student", "0001")
+
+def test_login_uid_matches_the_padded_id(monkeypatch):
+    monkeypatch.setattr(auth, "TRUST_GATEWAY_CLAIMS", True)
+    context = auth.AuthContext("1", "student1", auth.parse_roles("student, professor"))
+    assert context.vouches_for("student", "0001")
+    assert context.vouches_for("professor", "1")
+    assert not context.vouches_for("student", "0002")
+    assert not context.vouches_for("registrar", "0001")
+    assert not auth.ANONYMOUS.vouches_for("student", "0001")
+
+def test_normalize_id():
+    assert auth.normalize_id("0001") == auth.normalize_id(1) == "1"
+    assert auth.normalize_id("0") == "0"
+    assert auth.normalize_id("abc") == "abc"
+
+def test_claims_skip_the_caller_lookup(client, monkeypatch):
+    monkeypatch.setattr(auth, "TRUST_GATEWAY_CLAIMS", True)
+    headers = {"x-cwid": "2", "x-user": "tuffy", "x-roles": "student"}
+    trusted = client.post("/students/0002/classes/0002/enroll", headers=headers)
+    assert trusted.status_code == 200
+    client.delete("/students/0002/classes/0002", headers=headers)
+    monkeypatch.setattr(auth, "TRUST_GATEWAY_CLAIMS", False)
+    untrusted = client.post("/students/0002/classes/0002/enroll", headers=headers)
+    assert untrusted.status_code == 200
+    assert int(untrusted.headers["X-Backend-Calls"]) == int(trusted.headers["X-Backend-Calls"]) + 1
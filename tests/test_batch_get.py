@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+import enrollment_service.query_helper as qh
+
+
+# Passes calls through and records the number of keys in every batch_get_item request
+class RecordingClient:
+    def __init__(self, client, unprocessed=0):
+        self.client = client
+        self.unprocessed = unprocessed
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        keys = RequestItems["TitanOnlineEnrollment"]["Keys"]
+        with self.lock:
+            self.requests.append(len(keys))
+            # Leave the first keys of a request unprocessed, the way a throttled table does
+            held_back, self.unprocessed = keys[:self.unprocessed], 0
+        request = dict(RequestItems["TitanOnlineEnrollment"], Keys=keys[len(held_back):])
+        response = self.client.batch_get_item(RequestItems={"TitanOnlineEnrollment": request}, **kwargs)
+        if held_back:
+            response["UnprocessedKeys"] = {"TitanOnlineEnrollment": dict(request, Keys=held_back)}
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def add_students(dynamodb, count):
+    student_ids = [f"s#{n:04}" for n in range(100, 100 + count)]
+    for student_id in student_ids:
+        dynamodb.put_item(TableName="TitanOnlineEnrollment", Item={"PK": {"S": student_id}, "SK": {"S": student_id}, "EntityType": {"S": "student"}, "Name": {"S": student_id}})
+    return student_ids
+
+def test_lookups_over_the_batch_limit_are_chunked(dynamodb):
+    student_ids = add_students(dynamodb, 250)
+    client = RecordingClient(dynamodb)
+    students = qh.batch_query_student(client, list(reversed(student_ids)) + ["s#9999"])
+    assert sorted(client.requests) == [51, 100, 100]
+    # Results keep the order asked for and skip students that don't exist
+    assert [student["id"] for student in students] == [student_id[2:] for student_id in reversed(student_ids)]
+
+def test_duplicate_keys_are_read_once(dynamodb):
+    client = RecordingClient(dynamodb)
+    students = qh.batch_query_student(client, ["s#0001", "s#0002", "s#0001"])
+    assert client.requests == [2]
+    assert [student["id"] for student in students] == ["0001", "0002", "0001"]
+
+def test_unprocessed_keys_are_retried(dynamodb, monkeypatch):
+    monkeypatch.setattr(qh, "BATCH_GET_BACKOFF", 0)
+    client = RecordingClient(dynamodb, unprocessed=2)
+    students = qh.batch_query_student(client, ["s#0001", "s#0002", "s#0003"])
+    assert client.requests == [3, 2]
+    assert [student["id"] for student in students] == ["0001", "0002", "0003"]
+
+def test_keys_left_unprocessed_give_up(dynamodb, monkeypatch):
+    monkeypatch.setattr(qh, "BATCH_GET_BACKOFF", 0)
+    class Throttled(RecordingClient):
+        def batch_get_item(self, RequestItems, **kwargs):
+            self.requests.append(len(RequestItems["TitanOnlineEnrollment"]["Keys"]))
+            return {"Responses": {}, "UnprocessedKeys": RequestItems}
+    client = Throttled(dynamodb)
+    with pytest.raises(RuntimeError):
+        qh.batch_get_items(client, [{"PK": {"S": "s#0001"}, "SK": {"S": "s#0001"}}])
+    assert len(client.requests) == qh.BATCH_GET_RETRIES + 1
+    assert qh.batch_query_student(client, ["s#0001"]) is None
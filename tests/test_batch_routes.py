@@ -0,0 +1,33 @@
+from tests.conftest import class_count
+
+
+def results(response):
+    assert response.status_code == 200
+    return {result["ClassId"]: result for result in response.json()["Results"]}
+
+def test_batch_enroll_reports_each_class(client, dynamodb):
+    response = client.post("/students/0002/enroll-batch", json={"ClassIds": ["0002", "0001", "9999", "0002"]})
+    by_class = results(response)
+    # Duplicates are only enrolled once, the order of first appearance is kept
+    assert [result["ClassId"] for result in response.json()["Results"]] == ["0002", "0001", "9999"]
+    assert by_class["0002"]["Status"] == 200
+    assert by_class["0001"]["Result"] == {"message": "Student added to waitlist"}
+    assert by_class["9999"] == {"ClassId": "9999", "Status": 404, "Error": "No class found"}
+    assert class_count(dynamodb, "0002") == 10
+
+def test_batch_drop_reports_each_class(client, dynamodb):
+    client.post("/students/0001/classes/0002/enroll")
+    response = client.request("DELETE", "/students/0001/classes", json={"ClassIds": ["0001", "0002", "9999"]})
+    by_class = results(response)
+    assert by_class["0001"]["Status"] == by_class["0002"]["Status"] == 200
+    assert by_class["9999"]["Status"] == 404
+    assert class_count(dynamodb, "0001") == 9
+    assert class_count(dynamodb, "0002") == 9
+    response = client.request("DELETE", "/students/0001/classes", json={"ClassIds": ["0001"]})
+    assert results(response)["0001"] == {"ClassId": "0001", "Status": 404, "Error": "Student is not enrolled in this class"}
+
+def test_batch_limits(client):
+    assert client.post("/students/0002/enroll-batch", json={"ClassIds": []}).status_code == 400
+    too_many = [f"{n:04}" for n in range(11)]
+    assert client.post("/students/0002/enroll-batch", json={"ClassIds": too_many}).status_code == 400
+    assert client.post("/students/9999/enroll-batch", json={"ClassIds": ["0002"]}).status_code == 404
@@ -0,0 +1,46 @@
+import json
+
+import enrollment_service.metrics as metrics
+import enrollment_service.query_helper as qh
+from tests.test_jobs import wait_for_job
+
+
+def bulk_lines(response):
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    return sorted(lines[:-1], key=lambda line: line["Index"]), lines[-1]["Summary"]
+
+def test_bulk_freeze_reports_each_item(client, dynamodb):
+    body = "\n".join([json.dumps({"ClassId": "0002"}), "not json", json.dumps({"ClassId": "9999"}), json.dumps({"ClassId": "0002"})])
+    response = client.put("/registrar/bulk/freeze", content=body, headers={"Content-Type": "application/x-ndjson"})
+    lines, summary = bulk_lines(response)
+    assert [(line["Index"], line["Status"]) for line in lines] == [(0, 200), (1, 422), (2, 404), (3, 422)]
+    assert lines[3]["Error"] == "Class listed more than once"
+    assert (summary["Items"], summary["Succeeded"], summary["Failed"]) == (4, 1, 3)
+    assert qh.fetch_class(dynamodb, "0002")["Frozen"]
+
+def test_bulk_create_classes(client):
+    new_class = {"Name": "Compilers", "Department": "Computer Science", "CourseCode": "CPSC323", "SectionNumber": "1", "maxEnroll": 30}
+    response = client.post("/registrar/bulk/classes", json=[dict(new_class, InstructorId="0002"), dict(new_class, InstructorId="9999"), new_class])
+    lines, summary = bulk_lines(response)
+    assert [line["Status"] for line in lines] == [201, 404, 422]
+    created = lines[0]["ClassId"]
+    assert wait_for_job(client, summary["JobId"])["status"] == "finished"
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert created in [item["id"] for item in listing]
+
+def test_bulk_body_must_be_a_list(client):
+    assert client.put("/registrar/bulk/freeze", json={"ClassId": "0002"}).status_code == 400
+    assert client.put("/registrar/bulk/freeze", json=[]).status_code == 400
+
+def test_invalid_bulk_items_arent_timed(client):
+    def chunk_count():
+        histogram = metrics.registry.histograms.get(("enrollment_bulk_chunk_seconds", (("operation", "change_instructors"),)))
+        return histogram.count if histogram else 0
+    def invalid_count():
+        return metrics.registry.counters.get(("enrollment_bulk_items_total", (("operation", "change_instructors"), ("status", "422"))), 0)
+    chunks, invalid = chunk_count(), invalid_count()
+    lines, _ = bulk_lines(client.put("/registrar/bulk/instructors", json=[{"ClassId": "0002"}, {"InstructorId": "0002"}]))
+    assert [line["Status"] for line in lines] == [422, 422]
+    assert chunk_count() == chunks
+    assert invalid_count() == invalid + 2
@@ -0,0 +1,78 @@
+import enrollment_service.query_helper as qh
+from tests.conftest import class_count
+
+
+def test_query_class_is_served_from_the_cache(dynamodb, class_cache):
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 9
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 9
+    stats = class_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["local_hits"] == 1
+
+def test_cached_copies_are_independent(dynamodb):
+    qh.query_class(dynamodb, "0002")["Detail"]["Name"] = "changed"
+    assert qh.query_class(dynamodb, "0002")["Detail"]["Name"] != "changed"
+
+def test_a_write_invalidates_the_cached_class(dynamodb, class_cache):
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 9
+    assert qh.increment_current_enroll(dynamodb, "0002", 1)
+    assert class_cache.stats()["invalidations"] == 1
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 10
+
+def test_invalidate_reaches_the_redis_tier(dynamodb, class_cache, sync_redis):
+    class_cache.redis_client = sync_redis
+    qh.query_class(dynamodb, "0002")
+    assert sync_redis.get(class_cache.redis_key("0002")) is not None
+    class_cache.invalidate("0002")
+    assert sync_redis.get(class_cache.redis_key("0002")) is None
+
+
+def test_stale_class_data_doesnt_decide_capacity(dynamodb):
+    # The transaction checks capacity on the item, not on what the caller read
+    class_data = qh.fetch_class(dynamodb, "0002")
+    assert qh.enroll_student_transaction(dynamodb, "0001", "0002", qh.fetch_class(dynamodb, "0002")) == qh.ENROLL_OK
+    assert qh.enroll_student_transaction(dynamodb, "0003", "0002", class_data) == qh.ENROLL_FULL
+
+def test_stale_cached_class_doesnt_waitlist(client, dynamodb, class_cache):
+    # The cached copy says the class is full, DynamoDB still has a seat
+    class_data = qh.fetch_class(dynamodb, "0002")
+    class_cache.set_local("0002", dict(class_data, currentEnroll=10))
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 200
+    assert class_count(dynamodb, "0002") == 10
+
+def test_stale_cached_class_doesnt_overfill(client, dynamodb, class_cache):
+    class_data = qh.fetch_class(dynamodb, "0001")
+    class_cache.set_local("0001", dict(class_data, currentEnroll=5))
+    response = client.post("/students/0002/classes/0001/enroll")
+    assert response.json() == {"message": "Student added to waitlist"}
+    assert class_count(dynamodb, "0001") == 10
+
+
+def test_a_read_that_raced_an_invalidate_isnt_cached(class_cache):
+    generation = class_cache.generation("0002")
+    class_cache.invalidate("0002")
+    class_cache.set("0002", {"id": "0002", "currentEnroll": 9}, generation)
+    assert class_cache.get("0002") is None
+    assert class_cache.stats()["stale_sets"] == 1
+
+def test_another_workers_invalidate_stops_the_redis_set(class_cache, sync_redis):
+    class_cache.redis_client = sync_redis
+    generation = class_cache.generation("0002")
+    # Another worker bumps the shared generation, this worker's local one doesn't move
+    sync_redis.incr(class_cache.generation_key("0002"))
+    class_cache.set("0002", {"id": "0002", "currentEnroll": 9}, generation)
+    assert sync_redis.get(class_cache.redis_key("0002")) is None
+    assert class_cache.get("0002") is None
+    assert class_cache.stats()["stale_sets"] == 1
+
+def test_slow_read_during_a_write_doesnt_restore_the_old_class(dynamodb, monkeypatch):
+    fetch_class = qh.fetch_class
+    def slow_fetch_class(dynamodb_client, class_id):
+        class_data = fetch_class(dynamodb_client, class_id)
+        qh.increment_current_enroll(dynamodb_client, class_id, 1)
+        return class_data
+    monkeypatch.setattr(qh, "fetch_class", slow_fetch_class)
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 9
+    monkeypatch.setattr(qh, "fetch_class", fetch_class)
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 10
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import enrollment_service.query_helper as qh
+
+
+class CountingUpdates:
+    def __init__(self, client):
+        self.client = client
+        self.updates = 0
+
+    def update_item(self, **kwargs):
+        self.updates += 1
+        return self.client.update_item(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def test_ids_come_from_a_leased_block(dynamodb):
+    client = CountingUpdates(dynamodb)
+    allocator = qh.ClassIdAllocator(block_size=5)
+    assert [allocator.allocate(client) for _ in range(5)] == [10000, 10001, 10002, 10003, 10004]
+    assert client.updates == 1
+    # The sixth id needs a new lease
+    assert allocator.allocate(client) == 10005
+    assert client.updates == 2
+
+def test_workers_never_share_ids(dynamodb):
+    first, second = qh.ClassIdAllocator(block_size=3), qh.ClassIdAllocator(block_size=3)
+    ids = [allocator.allocate(dynamodb) for _ in range(4) for allocator in (first, second)]
+    assert len(set(ids)) == len(ids)
+    # Ids a worker leased stay its own, the next lease starts after both blocks
+    assert sorted(ids[::2]) == [10000, 10001, 10002, 10006]
+
+def test_threads_never_share_ids(dynamodb):
+    allocator = qh.ClassIdAllocator(block_size=4)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        ids = list(executor.map(lambda _: allocator.allocate(dynamodb), range(50)))
+    assert sorted(ids) == list(range(10000, 10050))
+
+def test_created_classes_get_new_ids(client):
+    new_class = {"Name": "Compilers", "Department": "Computer Science", "CourseCode": "CPSC323", "SectionNumber": "1", "maxEnroll": 30, "InstructorId": "0002"}
+    class_ids = [client.post("/registrar/classes/", json=new_class).json()["ClassId"] for _ in range(3)]
+    assert len(set(class_ids)) == 3
+    assert all(client.get(f"/classes/{class_id}/waitlist").json()["detail"] == "No waitlist found" for class_id in class_ids)
@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+
+import enrollment_service.codec as codec
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+ITEM = {
+    "Name": "Backend Engineering",
+    "maxEnroll": 30,
+    "ratio": Decimal("0.5"),
+    "Frozen": False,
+    "Missing": None,
+    "Tags": ["a", 1, {"nested": True}],
+    "Detail": {"Department": "Computer Science", "Sections": {"1", "2"}},
+    "Rooms": {101, 102},
+    "Raw": Binary(b"\x00\x01"),
+}
+
+
+def test_decodes_what_boto3_serializes():
+    item = {k: serializer.serialize(v) for k, v in ITEM.items()}
+    decoded = codec.decode_item(item)
+    assert decoded["Name"] == "Backend Engineering"
+    assert decoded["maxEnroll"] == 30 and isinstance(decoded["maxEnroll"], int)
+    assert decoded["ratio"] == 0.5 and isinstance(decoded["ratio"], float)
+    assert decoded["Frozen"] is False
+    assert decoded["Missing"] is None
+    assert decoded["Tags"] == ["a", 1, {"nested": True}]
+    assert sorted(decoded["Detail"]["Sections"]) == ["1", "2"]
+    assert sorted(decoded["Rooms"]) == [101, 102]
+    assert decoded["Raw"] == "AAE="
+
+def test_matches_type_deserializer_on_plain_values():
+    item = {k: serializer.serialize(v) for k, v in ITEM.items() if k in ("Name", "maxEnroll", "Frozen", "Tags")}
+    expected = {k: deserializer.deserialize(v) for k, v in item.items()}
+    assert codec.decode_item(item) == expected
+
+def test_unknown_type_is_an_error():
+    with pytest.raises(TypeError):
+        codec.decode_value({"X": "1"})
+
+def test_skips_key_attributes():
+    item = {"PK": {"S": "s#0001"}, "SK": {"S": "s#0001"}, "EntityType": {"S": "student"}, "Name": {"S": "Ann"}}
+    assert codec.Student.from_item(item).to_dict() == {"Name": "Ann", "id": "0001"}
+
+def test_class_record():
+    item = {
+        "PK": {"S": "c#0002"}, "SK": {"S": "c#0002"}, "GSI3_SK": {"S": "i#0001"},
+        "Detail": {"M": {"Name": {"S": "Backend"}}},
+        "currentEnroll": {"N": "9"}, "maxEnroll": {"N": "10"}, "Frozen": {"BOOL": True},
+    }
+    assert codec.ClassRecord.from_item(item).to_dict() == {
+        "Detail": {"Name": "Backend"}, "currentEnroll": 9, "maxEnroll": 10, "Frozen": True, "id": "0002", "instructorId": "0001",
+    }
+    item["CounterShards"] = {"N": "4"}
+    assert codec.ClassRecord.from_item(item).to_dict()["CounterShards"] == 4
+
+def test_listing_and_key_ids():
+    item = {"PK": {"S": "c#0002"}, "GSI1_SK": {"S": "c#open#0002"}, "Detail": {"M": {"Name": {"S": "Backend"}}}}
+    assert codec.ClassListing.from_open_item(item).to_dict() == {"Name": "Backend", "id": "0002"}
+    assert codec.ClassListing.from_enrolled_item(item).to_dict() == {"Name": "Backend", "id": "0002"}
+    assert codec.key_id("s#enrolled#0001") == "0001"
@@ -0,0 +1,62 @@
+import enrollment_service.query_helper as qh
+from tests.conftest import class_count
+
+
+def enroll(dynamodb, student_id, class_id):
+    return qh.enroll_student_transaction(dynamodb, student_id, class_id, qh.fetch_class(dynamodb, class_id))
+
+
+def test_split_counter():
+    assert qh.split_counter(7, 10, 4) == [(3, 3), (3, 3), (1, 2), (0, 2)]
+    # Students enrolled past maxEnroll stay on the last shard
+    assert qh.split_counter(12, 10, 2) == [(5, 5), (7, 5)]
+
+def test_sharded_counter_enrolls_to_capacity(dynamodb):
+    assert qh.enable_counter_shards(dynamodb, "0002", 3)
+    class_data = qh.fetch_class(dynamodb, "0002")
+    assert qh.counter_shards(class_data) == 3
+    assert class_data["currentEnroll"] == 9
+    assert sum(count for count, _ in qh.query_counter_shards(dynamodb, "0002", consistent=True)) == 9
+    assert enroll(dynamodb, "0001", "0002") == qh.ENROLL_OK
+    assert enroll(dynamodb, "0003", "0002") == qh.ENROLL_FULL
+    assert class_count(dynamodb, "0002") == 10
+
+def test_sharded_counter_decrement_and_merge(dynamodb):
+    assert qh.enable_counter_shards(dynamodb, "0001", 4)
+    assert qh.increment_current_enroll(dynamodb, "0001", -1, 4)
+    assert class_count(dynamodb, "0001") == 9
+    assert qh.disable_counter_shards(dynamodb, "0001")
+    class_data = qh.fetch_class(dynamodb, "0001")
+    assert qh.counter_shards(class_data) == 0
+    assert class_data["currentEnroll"] == 9
+    assert qh.query_counter_shards(dynamodb, "0001", consistent=True) == []
+
+def test_decrement_follows_a_class_that_became_hot(dynamodb):
+    # Called with the class as read before it was sharded
+    assert qh.enable_counter_shards(dynamodb, "0001", 2)
+    assert qh.increment_current_enroll(dynamodb, "0001", -1)
+    assert class_count(dynamodb, "0001") == 9
+
+def test_enroll_follows_a_class_that_became_hot(dynamodb):
+    class_data = qh.fetch_class(dynamodb, "0002")
+    assert qh.enable_counter_shards(dynamodb, "0002", 2)
+    assert qh.enroll_student_transaction(dynamodb, "0001", "0002", class_data) == qh.ENROLL_OK
+    assert class_count(dynamodb, "0002") == 10
+
+def test_hot_class_routes(client, dynamodb):
+    assert client.put("/registrar/classes/0002/hot", params={"shards": 4}).status_code == 200
+    assert client.post("/students/0002/classes/0002/enroll").status_code == 200
+    assert client.post("/students/0003/classes/0002/enroll").json() == {"message": "Student added to waitlist"}
+    assert client.delete("/students/0002/classes/0002").status_code == 200
+    assert class_count(dynamodb, "0002") == 10
+    assert client.delete("/registrar/classes/0002/hot").status_code == 200
+    assert qh.counter_shards(qh.fetch_class(dynamodb, "0002")) == 0
+    assert class_count(dynamodb, "0002") == 10
+
+
+def test_committed_drop_isnt_a_server_error(client, dynamodb, monkeypatch):
+    monkeypatch.setattr(qh, "increment_current_enroll", lambda *args: False)
+    response = client.delete("/students/0001/classes/0001")
+    assert response.status_code == 200
+    assert response.json() == {"message": "Student dropped from class", "Promotion": "Unable to update class enrollment, waitlist not promoted"}
+    assert "0001" not in qh.query_enrolled_class_ids(dynamodb, "0001")
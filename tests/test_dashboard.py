@@ -0,0 +1,29 @@
+def test_dashboard_shape(client):
+    client.post("/students/0002/classes/0001/enroll")
+    client.post("/students/0003/classes/0002/enroll")
+    client.delete("/students/0003/classes/0002")
+    response = client.get("/instructors/0001/dashboard")
+    assert response.status_code == 200
+    dashboard = response.json()
+    assert dashboard["Instructor"]["id"] == "0001"
+    classes = {item["id"]: item for item in dashboard["Classes"]}
+    assert set(classes) == {"0001", "0002"}
+    assert set(classes["0001"]) == {"id", "Detail", "currentEnroll", "maxEnroll", "Frozen", "Enrollment", "Dropped", "Waitlist"}
+    assert [student["id"] for student in classes["0001"]["Enrollment"]] == ["0001"]
+    assert [student["id"] for student in classes["0001"]["Waitlist"]] == ["0002"]
+    assert [student["id"] for student in classes["0002"]["Dropped"]] == ["0003"]
+    assert classes["0002"]["currentEnroll"] == 9
+    assert classes["0002"]["Detail"]["CourseCode"] == "CPSC449"
+
+def test_dashboard_calls_dont_grow_with_students(client):
+    # The instructor, its class ids, the class items and the students are one read each, plus two rosters per class
+    before = client.get("/instructors/0001/dashboard")
+    assert before.headers["X-Backend-Calls"] == str(4 + 2 * len(before.json()["Classes"]))
+    client.post("/students/0002/classes/0001/enroll")
+    client.post("/students/0003/classes/0002/enroll")
+    client.delete("/students/0003/classes/0002")
+    after = client.get("/instructors/0001/dashboard")
+    assert after.headers["X-Backend-Calls"] == before.headers["X-Backend-Calls"]
+
+def test_dashboard_of_unknown_instructor(client):
+    assert client.get("/instructors/9999/dashboard").json()["detail"] == "No instructor found"
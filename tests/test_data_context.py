@@ -0,0 +1,56 @@
+import asyncio
+
+import enrollment_service.metrics as metrics
+import enrollment_service.response_cache as rc
+from enrollment_service.data_context import DataContext
+from tests.conftest import class_count
+
+FLUSH_ERRORS = ("enrollment_cache_flush_errors_total", (("route", "/students/{student_id}/classes/{class_id}/enroll"),))
+
+
+def test_reads_are_shared_within_a_request(dynamodb, async_redis):
+    async def scenario():
+        ctx = DataContext(dynamodb, async_redis)
+        first, second = await asyncio.gather(ctx.query_student("0001"), ctx.query_student("0001"))
+        assert first == second and first["id"] == "0001"
+        await ctx.query_student("0001")
+        return ctx.backend_calls
+    assert asyncio.run(scenario()) == 1
+
+def test_forget_reads_again(dynamodb, async_redis):
+    async def scenario():
+        ctx = DataContext(dynamodb, async_redis)
+        await ctx.query_student("0001")
+        ctx.forget(("student", "0001"))
+        await ctx.query_student("0001")
+        return ctx.backend_calls
+    assert asyncio.run(scenario()) == 2
+
+def test_queued_writes_go_out_in_one_pipeline(dynamodb, async_redis, sync_redis):
+    async def scenario():
+        ctx = DataContext(dynamodb, async_redis)
+        rc.student_changed(ctx.pending_redis(), "0001")
+        rc.classes_changed(ctx.pending_redis())
+        assert sync_redis.get(rc.CLASSES_VERSION_KEY) is None
+        await ctx.flush()
+        return ctx.backend_calls
+    assert asyncio.run(scenario()) == 1
+    assert sync_redis.get(rc.student_version_key("0001")) == b"1"
+    assert sync_redis.get(rc.CLASSES_VERSION_KEY) == b"1"
+
+def test_writes_are_flushed_with_the_response(client, sync_redis):
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 200
+    assert sync_redis.get(rc.student_version_key("0002")) == b"1"
+    assert int(response.headers["X-Backend-Calls"]) > 0
+
+def test_failed_flush_keeps_the_response(client, dynamodb, monkeypatch):
+    async def failing_flush(self):
+        raise ConnectionError("Redis is down")
+    monkeypatch.setattr(DataContext, "flush", failing_flush)
+    before = metrics.registry.counters.get(FLUSH_ERRORS, 0)
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 200
+    assert response.json()["Name"]
+    assert class_count(dynamodb, "0002") == 10
+    assert metrics.registry.counters[FLUSH_ERRORS] == before + 1
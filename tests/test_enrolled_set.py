@@ -0,0 +1,64 @@
+import asyncio
+
+import enrollment_service.enrolled_helper as eh
+import enrollment_service.query_helper as qh
+from tests.conftest import class_count
+
+
+def test_unbuilt_set_is_a_miss(async_redis):
+    assert asyncio.run(eh.enrolled_members(async_redis, "0001", ["0001"])) is None
+
+def test_add_doesnt_create_a_partial_set(sync_redis, async_redis):
+    eh.add_enrolled(sync_redis, "0001", "0002")
+    assert not sync_redis.exists(eh.enrolled_key("0001"))
+    assert asyncio.run(eh.enrolled_members(async_redis, "0001", ["0002"])) is None
+
+def test_add_and_remove_keep_a_built_set_current(sync_redis, async_redis):
+    eh.rebuild_enrolled(sync_redis, "0001", ["0001"])
+    sync_redis.expire(eh.enrolled_key("0001"), 5)
+    eh.add_enrolled(sync_redis, "0001", "0002")
+    assert sync_redis.ttl(eh.enrolled_key("0001")) > 5
+    assert asyncio.run(eh.enrolled_members(async_redis, "0001", ["0001", "0002", "0003"])) == {"0001", "0002"}
+    eh.remove_enrolled(sync_redis, "0001", "0001")
+    assert asyncio.run(eh.enrolled_members(async_redis, "0001", ["0001", "0002"])) == {"0002"}
+
+def test_add_queued_after_a_rebuild_on_one_pipeline(sync_redis, async_redis):
+    pipeline = sync_redis.pipeline(transaction=False)
+    eh.rebuild_enrolled(pipeline, "0001", ["0001"])
+    eh.add_enrolled(pipeline, "0001", "0002")
+    pipeline.execute()
+    assert asyncio.run(eh.enrolled_members(async_redis, "0001", ["0001", "0002"])) == {"0001", "0002"}
+
+
+def test_drop_is_conditional(dynamodb):
+    class_detail = qh.query_class(dynamodb, "0001")["Detail"]
+    assert qh.drop_student_from_class(dynamodb, "0001", "0001", class_detail) == qh.DROP_OK
+    assert qh.drop_student_from_class(dynamodb, "0001", "0001", class_detail) == qh.DROP_NOT_ENROLLED
+
+def test_drop_of_a_class_deleted_meanwhile(client, dynamodb, monkeypatch):
+    drop_student_from_class = qh.drop_student_from_class
+    def drop_after_delete(dynamodb_client, student_id, class_id, class_detail):
+        dynamodb_client.delete_item(TableName="TitanOnlineEnrollment", Key={"PK": {"S": f"c#{class_id}"}, "SK": {"S": f"c#{class_id}"}})
+        qh.class_cache.invalidate(class_id)
+        return drop_student_from_class(dynamodb_client, student_id, class_id, class_detail)
+    monkeypatch.setattr(qh, "drop_student_from_class", drop_after_delete)
+    response = client.delete("/students/0001/classes/0001")
+    assert response.status_code == 200
+    dropped = dynamodb.get_item(TableName="TitanOnlineEnrollment", Key={"PK": {"S": "c#0001"}, "SK": {"S": "s#dropped#0001"}})
+    assert dropped["Item"]["Detail"]["M"]["Name"]
+
+def test_enrolled_set_follows_enroll_and_drop(client, sync_redis):
+    key = eh.enrolled_key("0001")
+    # The drop's enrollment check builds the set, the drop and the enroll after it update it
+    assert client.delete("/students/0001/classes/0001").status_code == 200
+    assert sync_redis.smembers(key) == {b"-"}
+    assert client.post("/students/0001/classes/0002/enroll").status_code == 200
+    assert sync_redis.smembers(key) == {b"-", b"0002"}
+    assert client.delete("/students/0001/classes/0001").status_code == 404
+
+def test_stale_enrolled_set_cant_double_drop(client, dynamodb, sync_redis):
+    client.delete("/students/0001/classes/0001")
+    # A set that missed the drop still lists the class
+    sync_redis.sadd(eh.enrolled_key("0001"), "0001")
+    assert client.delete("/students/0001/classes/0001").status_code == 404
+    assert class_count(dynamodb, "0001") == 9
@@ -0,0 +1,86 @@
+import enrollment_service.query_helper as qh
+import enrollment_service.waitlist_helper as wh
+from tests.conftest import class_count
+
+
+def enroll(dynamodb, student_id, class_id):
+    return qh.enroll_student_transaction(dynamodb, student_id, class_id, qh.fetch_class(dynamodb, class_id))
+
+
+def test_enroll_takes_the_last_seat(dynamodb):
+    assert enroll(dynamodb, "0001", "0002") == qh.ENROLL_OK
+    assert class_count(dynamodb, "0002") == 10
+    assert "0002" in qh.query_enrolled_class_ids(dynamodb, "0001")
+
+def test_enroll_twice_is_a_duplicate(dynamodb):
+    assert enroll(dynamodb, "0001", "0002") == qh.ENROLL_OK
+    assert enroll(dynamodb, "0001", "0002") == qh.ENROLL_DUPLICATE
+    assert class_count(dynamodb, "0002") == 10
+
+def test_enroll_in_a_full_class(dynamodb):
+    assert enroll(dynamodb, "0002", "0001") == qh.ENROLL_FULL
+    assert class_count(dynamodb, "0001") == 10
+
+def test_enroll_in_a_frozen_class(dynamodb):
+    assert qh.freeze_enrollment(dynamodb, "0002")
+    assert enroll(dynamodb, "0001", "0002") == qh.ENROLL_FROZEN
+    assert class_count(dynamodb, "0002") == 9
+
+
+def test_enroll_and_drop(client, dynamodb):
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 200
+    assert response.json()["Name"]
+    assert class_count(dynamodb, "0002") == 10
+    assert client.post("/students/0002/classes/0002/enroll").status_code == 400
+    assert client.delete("/students/0002/classes/0002").status_code == 200
+    assert class_count(dynamodb, "0002") == 9
+
+def test_full_class_waitlists(client, sync_redis):
+    response = client.post("/students/0002/classes/0001/enroll")
+    assert response.json() == {"message": "Student added to waitlist"}
+    assert sync_redis.zrange(wh.waitlist_key("0001"), 0, -1) == [b"s#0002"]
+    assert client.post("/students/0002/classes/0001/enroll").json()["detail"] == "Student is already on waitlist"
+
+def test_frozen_class_is_refused(client):
+    assert client.put("/registrar/classes/0002/freeze").status_code == 200
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Enrollment is frozen"
+
+def test_drop_promotes_the_waitlist(client, dynamodb, sync_redis):
+    client.post("/students/0002/classes/0001/enroll")
+    response = client.delete("/students/0001/classes/0001")
+    assert response.status_code == 200
+    assert response.json()["message"] == "Student dropped from class and first student on waitlist enrolled"
+    assert sync_redis.zcard(wh.waitlist_key("0001")) == 0
+    assert class_count(dynamodb, "0001") == 10
+    assert "0001" in qh.query_enrolled_class_ids(dynamodb, "0002")
+
+def test_direct_enroll_leaves_the_waitlist(client, dynamodb, sync_redis):
+    client.post("/students/0002/classes/0001/enroll")
+    # A seat frees up without going through the waitlist
+    assert qh.increment_current_enroll(dynamodb, "0001", -1)
+    assert client.post("/students/0002/classes/0001/enroll").status_code == 200
+    assert sync_redis.zcard(wh.waitlist_key("0001")) == 0
+
+def test_promotion_skips_students_already_enrolled(client, dynamodb, sync_redis):
+    client.post("/students/0002/classes/0001/enroll")
+    client.post("/students/0003/classes/0001/enroll")
+    # 0002 gets a seat some other way and is still first on the waitlist
+    assert qh.increment_current_enroll(dynamodb, "0001", -1)
+    assert enroll(dynamodb, "0002", "0001") == qh.ENROLL_OK
+    response = client.delete("/students/0001/classes/0001")
+    assert response.json()["message"] == "Student dropped from class and first student on waitlist enrolled"
+    assert class_count(dynamodb, "0001") == 10
+    assert "0001" in qh.query_enrolled_class_ids(dynamodb, "0003")
+    assert sync_redis.zcard(wh.waitlist_key("0001")) == 0
+
+def test_promotion_of_only_enrolled_students_frees_the_seat(client, dynamodb, sync_redis):
+    client.post("/students/0002/classes/0001/enroll")
+    assert qh.increment_current_enroll(dynamodb, "0001", -1)
+    assert enroll(dynamodb, "0002", "0001") == qh.ENROLL_OK
+    response = client.delete("/students/0001/classes/0001")
+    assert response.json() == {"message": "Student dropped from class"}
+    assert class_count(dynamodb, "0001") == 9
+    assert sync_redis.zcard(wh.waitlist_key("0001")) == 0
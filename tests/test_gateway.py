@@ -0,0 +1,45 @@
+import json
+import pathlib
+
+import enrollment_service.routes as routes
+
+GATEWAY = json.loads((pathlib.Path(__file__).resolve().parent.parent / "etc" / "krakend.json").read_text())
+
+
+def gateway_endpoints(method, url_pattern):
+    return [endpoint for endpoint in GATEWAY["endpoints"]
+            if endpoint["method"] == method and any(backend["url_pattern"] == url_pattern for backend in endpoint["backend"])]
+
+def paginated_routes():
+    for route in routes.router.routes:
+        dependencies = getattr(getattr(route, "dependant", None), "dependencies", [])
+        if any(dependency.call is routes.Page for dependency in dependencies):
+            yield route
+
+def test_paginated_routes_get_their_query_strings():
+    paths = []
+    for route in paginated_routes():
+        endpoints = gateway_endpoints("GET", route.path)
+        assert endpoints, f"{route.path} isn't exposed through the gateway"
+        for endpoint in endpoints:
+            assert {"limit", "cursor"} <= set(endpoint.get("input_query_strings", [])), endpoint["endpoint"]
+        paths.append(route.path)
+    assert "/students/{student_id}/enrolled" in paths
+
+def test_instructor_dashboard_is_exposed_to_instructors():
+    [endpoint] = gateway_endpoints("GET", "/instructors/{instructor_id}/dashboard")
+    validator = endpoint["extra_config"]["auth/validator"]
+    assert validator["roles"] == ["professor", "registrar"]
+    assert ["jti", "x-cwid"] in validator["propagate_claims"]
+    assert "x-cwid" in endpoint["input_headers"]
+
+def test_job_status_is_registrar_only():
+    [endpoint] = gateway_endpoints("GET", "/registrar/jobs/{job_id}")
+    assert endpoint["extra_config"]["auth/validator"]["roles"] == ["registrar"]
+
+def test_cached_listings_pass_etags_through():
+    for url_pattern in ("/students/{student_id}/classes", "/students/{student_id}/enrolled"):
+        [endpoint] = gateway_endpoints("GET", url_pattern)
+        assert "If-None-Match" in endpoint["input_headers"]
+        assert endpoint["output_encoding"] == "no-op"
+        assert all(backend["encoding"] == "no-op" for backend in endpoint["backend"])
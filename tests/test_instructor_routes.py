@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import enrollment_service.routes as routes
+
+
+def test_validate_returns_every_result():
+    async def value(result, delay):
+        await asyncio.sleep(delay)
+        return result
+    assert asyncio.run(routes.validate(value("a", 0.02), value("b", 0))) == ["a", "b"]
+
+def test_validate_raises_the_first_failure_and_cancels_the_rest():
+    cancelled = []
+    async def fails(detail, delay):
+        await asyncio.sleep(delay)
+        raise HTTPException(status_code=404, detail=detail)
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await routes.validate(fails("late", 0.05), slow(), fails("early", 0.01))
+        assert error.value.detail == "early"
+        await asyncio.sleep(0)
+    asyncio.run(scenario())
+    assert cancelled == [True]
+
+
+def test_enrollment_of_an_owned_class(client):
+    response = client.get("/instructors/0001/classes/0001/enrollment")
+    assert response.status_code == 200
+    assert "0001" in [student["id"] for student in response.json()["Enrollment"]]
+
+@pytest.mark.parametrize("instructor_id, class_id, detail", [
+    ("9999", "0001", "No instructor found"),
+    ("0001", "9999", "No class found"),
+    ("0002", "0001", "Instructor is not assigned to this class"),
+])
+def test_ownership_failures(client, instructor_id, class_id, detail):
+    for view in ("enrollment", "drop"):
+        response = client.get(f"/instructors/{instructor_id}/classes/{class_id}/{view}")
+        assert response.status_code == 404
+        assert response.json()["detail"] == detail
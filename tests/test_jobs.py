@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import enrollment_service.jobs as jobs
+import enrollment_service.query_helper as qh
+import enrollment_service.routes as routes
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/registrar/jobs/{job_id}").json()["Job"]
+        if job["status"] in ("finished", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} didn't finish")
+
+def wait_for_hash(r, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = asyncio.run(jobs.get_job(r, job_id))
+        if job["status"] in ("finished", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} didn't finish")
+
+NEW_CLASS = {"Name": "Compilers", "Department": "Computer Science", "CourseCode": "CPSC323", "SectionNumber": "1", "maxEnroll": 30, "InstructorId": "0002"}
+
+
+def test_job_reports_progress_until_finished(sync_redis, async_redis):
+    def count_to(n, progress):
+        for _ in range(n):
+            progress(1)
+        return True
+    job_id = jobs.start_job(sync_redis, "count", 3, count_to, 3)
+    job = wait_for_hash(async_redis, job_id)
+    assert job["status"] == "finished"
+    assert (job["done"], job["total"], job["progress"]) == (3, 3, 1.0)
+    assert job["kind"] == "count"
+    assert job["finished"] >= job["started"] >= job["created"]
+
+def test_job_that_raises_is_failed(sync_redis, async_redis):
+    def broken(progress):
+        raise ValueError("no table")
+    job = wait_for_hash(async_redis, jobs.start_job(sync_redis, "broken", 0, broken))
+    assert job["status"] == "failed"
+    assert job["error"] == "no table"
+    assert job["progress"] == 0.0
+
+def test_unknown_job_is_not_found(client):
+    assert client.get("/registrar/jobs/missing").status_code == 404
+
+
+# Passes calls through, the first batch_write_item leaves some of its items unprocessed
+class ThrottledWrites:
+    def __init__(self, client, unprocessed):
+        self.client = client
+        self.unprocessed = unprocessed
+        self.requests = []
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        requests = RequestItems["TitanOnlineEnrollment"]
+        self.requests.append(len(requests))
+        held_back, self.unprocessed = requests[:self.unprocessed], 0
+        response = self.client.batch_write_item(RequestItems={"TitanOnlineEnrollment": requests[len(held_back):]}, **kwargs)
+        if held_back:
+            response["UnprocessedItems"] = {"TitanOnlineEnrollment": held_back}
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def test_unprocessed_items_are_retried(dynamodb, monkeypatch):
+    monkeypatch.setattr(qh, "BATCH_WRITE_BACKOFF", 0)
+    client = ThrottledWrites(dynamodb, unprocessed=5)
+    written = []
+    student_ids = [f"s#{n:04}" for n in range(100, 120)]
+    assert qh.open_class_for_students(client, "0009", routes.Class(**NEW_CLASS), student_ids, written.append)
+    assert client.requests == [20, 5]
+    assert sum(written) == 20
+    rows = dynamodb.query(TableName="TitanOnlineEnrollment", KeyConditionExpression="PK = :pk", ExpressionAttributeValues={":pk": {"S": "c#0009"}})
+    assert rows["Count"] == 20
+
+def test_writes_are_chunked(dynamodb):
+    client = ThrottledWrites(dynamodb, unprocessed=0)
+    student_ids = [f"s#{n:04}" for n in range(100, 160)]
+    assert qh.open_class_for_students(client, "0009", routes.Class(**NEW_CLASS), student_ids)
+    assert sorted(client.requests) == [10, 25, 25]
+
+def test_create_class_opens_it_to_students(client):
+    response = client.post("/registrar/classes/", json=NEW_CLASS)
+    assert response.status_code == 200
+    class_id = response.json()["ClassId"]
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert class_id in [item["id"] for item in listing]
+
+def test_large_audiences_open_in_the_background(client, monkeypatch):
+    monkeypatch.setattr(routes, "BACKGROUND_FANOUT_THRESHOLD", 0)
+    response = client.post("/registrar/classes/", json=NEW_CLASS)
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["JobId"])
+    assert job["status"] == "finished"
+    assert job["done"] == job["total"] > 0
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert response.json()["ClassId"] in [item["id"] for item in listing]
+
+
+def partition_size(dynamodb, class_id):
+    rows = dynamodb.query(TableName="TitanOnlineEnrollment", KeyConditionExpression="PK = :pk", ExpressionAttributeValues={":pk": {"S": f"c#{class_id}"}})
+    return rows["Count"]
+
+def test_remove_class_runs_in_the_background(client, dynamodb, sync_redis):
+    client.post("/students/0002/classes/0001/enroll")
+    rows = partition_size(dynamodb, "0001")
+    response = client.delete("/registrar/classes/0001")
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json()["JobId"])
+    assert job["status"] == "finished"
+    # The class item goes first, the job reports the rest of the partition
+    assert job["done"] == job["total"] == rows - 1
+    assert job["progress"] == 1.0
+    assert partition_size(dynamodb, "0001") == 0
+    assert not sync_redis.exists("waitlist:0001")
+    assert client.get("/classes/0001/waitlist").status_code == 404
+
+def test_delete_class_pages_through_big_classes(dynamodb, monkeypatch):
+    monkeypatch.setattr(qh, "DELETE_PAGE_SIZE", 3)
+    found = []
+    deleted = []
+    def progress(count, total=0):
+        found.append(total)
+        deleted.append(count)
+    rows = partition_size(dynamodb, "0001")
+    assert qh.delete_class(dynamodb, "0001", progress)
+    assert sum(found) == sum(deleted) == rows - 1
+    # Pages of 3 rows are handed to the writer as they're read
+    assert [total for total in found if total] == [3] * ((rows - 1) // 3) + ([(rows - 1) % 3] if (rows - 1) % 3 else [])
+    assert partition_size(dynamodb, "0001") == 0
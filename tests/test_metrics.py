@@ -0,0 +1,48 @@
+import re
+
+import enrollment_service.metrics as metrics
+
+ENROLL_ROUTE = "/students/{student_id}/classes/{class_id}/enroll"
+
+
+def route_calls(route, backend):
+    return sum(value for (name, labels), value in metrics.registry.counters.items()
+               if name == "enrollment_backend_calls_total" and ("route", route) in labels and ("backend", backend) in labels)
+
+def test_backend_calls_are_recorded_per_route(client):
+    before = route_calls(ENROLL_ROUTE, "dynamodb")
+    response = client.post("/students/0002/classes/0002/enroll")
+    assert response.status_code == 200
+    assert route_calls(ENROLL_ROUTE, "dynamodb") > before
+
+def test_job_calls_have_no_method():
+    metrics.Recorder(route="job:test").record("redis", "hset", "-", 0.001, 0.0, False)
+    labels = (("backend", "redis"), ("operation", "hset"), ("method", "-"), ("route", "job:test"), ("function", "-"))
+    assert metrics.registry.counters[("enrollment_backend_calls_total", labels)] >= 1
+
+def test_server_timing_reports_backends(client):
+    response = client.post("/students/0002/classes/0002/enroll")
+    timing = response.headers["Server-Timing"]
+    assert re.search(r'dynamodb;dur=[\d.]+;desc="\d+ calls"', timing)
+    assert re.search(r"total;dur=[\d.]+$", timing)
+
+def test_metrics_endpoint_is_prometheus_text(client):
+    client.post("/students/0002/classes/0002/enroll")
+    text = client.get("/metrics").text
+    assert "# TYPE enrollment_backend_calls_total counter" in text
+    assert "# TYPE enrollment_backend_call_seconds histogram" in text
+    assert re.search(r'enrollment_backend_calls_total\{backend="dynamodb",operation="transact_write_items",method="POST",route="/students/\{student_id\}/classes/\{class_id\}/enroll"[^}]*\} \d+', text)
+    assert 'enrollment_http_requests_total{method="POST",route="/students/{student_id}/classes/{class_id}/enroll",status="200"}' in text
+    assert "enrollment_class_cache_misses_total" in text
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    registry.describe("latency", "histogram", "Latency")
+    for value in (0.001, 0.001, 100.0):
+        registry.observe("latency", (("route", "/a"),), value)
+    lines = registry.render()
+    assert lines[:2] == ["# HELP latency Latency", "# TYPE latency histogram"]
+    buckets = [int(line.rsplit(" ", 1)[1]) for line in lines if line.startswith("latency_bucket")]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == 3
+    assert 'latency_count{route="/a"} 3' in lines
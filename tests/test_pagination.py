@@ -0,0 +1,100 @@
+import base64
+
+import pytest
+
+import enrollment_service.query_helper as qh
+
+
+def test_cursor_round_trip():
+    key = {"PK": {"S": "c#0002"}, "SK": {"S": "s#0001"}, "GSI1_PK": {"S": "s#0001"}}
+    cursor = qh.encode_cursor(key)
+    assert "=" not in cursor.rstrip("=") and "/" not in cursor and "+" not in cursor
+    assert qh.decode_cursor(cursor) == key
+    assert qh.encode_cursor(None) is None
+    assert qh.decode_cursor(None) is None
+
+@pytest.mark.parametrize("cursor", ["not a cursor", base64.urlsafe_b64encode(b"[1, 2]").decode("ascii")])
+def test_decode_rejects_bad_cursors(cursor):
+    with pytest.raises(qh.InvalidCursor):
+        qh.decode_cursor(cursor)
+
+def test_pages_join_up_to_the_full_list(dynamodb):
+    everything, last_key = qh.query_available_classes_page(dynamodb, "0002")
+    assert last_key is None
+    seen = []
+    start_key = None
+    while True:
+        page, start_key = qh.query_available_classes_page(dynamodb, "0002", 1, qh.decode_cursor(qh.encode_cursor(start_key)))
+        seen += page or []
+        if start_key is None:
+            break
+    assert sorted(item["id"] for item in seen) == sorted(item["id"] for item in everything)
+
+
+def test_route_pages_follow_the_cursor(client):
+    ids = []
+    cursor = None
+    for _ in range(10):
+        params = {"limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/students/0002/classes", params=params)
+        assert response.status_code == 200
+        ids += [item["id"] for item in response.json()["Classes"]]
+        cursor = response.json()["NextCursor"]
+        if cursor is None:
+            break
+    assert sorted(ids) == ["0001", "0002"]
+
+def test_malformed_cursor_is_a_bad_request(client):
+    response = client.get("/students/0002/classes", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+
+def test_cursor_dynamodb_rejects_is_a_bad_request(client):
+    # Decodes fine, but botocore won't take a plain string as an attribute value
+    cursor = qh.encode_cursor({"PK": "c#0001", "SK": "s#0002"})
+    response = client.get("/students/0002/classes", params={"cursor": cursor, "limit": 1})
+    assert response.status_code == 400
+
+def test_empty_last_page_is_not_a_404(client):
+    cursor = qh.encode_cursor({"PK": {"S": "s#0002"}, "SK": {"S": "c#open#9999"}, "GSI1_PK": {"S": "s#0002"}, "GSI1_SK": {"S": "c#open#9999"}})
+    response = client.get("/students/0002/classes", params={"cursor": cursor, "limit": 1})
+    assert response.status_code == 200
+    assert response.json() == {"Classes": [], "NextCursor": None}
+
+def test_waitlist_page_past_the_end(client):
+    client.post("/students/0002/classes/0001/enroll")
+    response = client.get("/classes/0001/waitlist", params={"cursor": qh.encode_cursor({"offset": 5}), "limit": 5})
+    assert response.status_code == 200
+    assert response.json() == {"Waitlist": [], "NextCursor": None}
+
+def test_instructor_enrollment_pages(client, dynamodb):
+    client.post("/students/0002/classes/0002/enroll")
+    everything = client.get("/instructors/0001/classes/0002/enrollment").json()
+    assert everything["NextCursor"] is None
+    ids = []
+    cursor = None
+    while True:
+        params = {"limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/instructors/0001/classes/0002/enrollment", params=params)
+        assert response.status_code == 200
+        ids += [student["id"] for student in response.json()["Enrollment"]]
+        cursor = response.json()["NextCursor"]
+        if cursor is None:
+            break
+    assert ids == [student["id"] for student in everything["Enrollment"]]
+    assert "0002" in ids
+
+def test_enrolled_classes_pages(client):
+    client.post("/students/0001/classes/0002/enroll")
+    first = client.get("/students/0001/enrolled", params={"limit": 1}).json()
+    assert len(first["Enrolled"]) == 1
+    second = client.get("/students/0001/enrolled", params={"limit": 1, "cursor": first["NextCursor"]}).json()
+    ids = [item["id"] for item in first["Enrolled"] + second["Enrolled"]]
+    assert sorted(ids) == ["0001", "0002"]
+    if second["NextCursor"]:
+        last = client.get("/students/0001/enrolled", params={"limit": 1, "cursor": second["NextCursor"]})
+        assert last.status_code == 200
+        assert last.json() == {"Enrolled": [], "NextCursor": None}
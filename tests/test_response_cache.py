@@ -0,0 +1,43 @@
+import enrollment_service.response_cache as rc
+
+
+def test_listing_is_served_again_with_its_etag(client):
+    first = client.get("/students/0001/enrolled")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    second = client.get("/students/0001/enrolled")
+    assert second.headers["ETag"] == etag
+    assert second.json() == first.json()
+    assert int(second.headers["X-Backend-Calls"]) < int(first.headers["X-Backend-Calls"])
+    not_modified = client.get("/students/0001/enrolled", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+def test_enrolling_changes_the_students_listings(client):
+    before = client.get("/students/0001/enrolled")
+    assert client.post("/students/0001/classes/0002/enroll").status_code == 200
+    after = client.get("/students/0001/enrolled", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert sorted(item["id"] for item in after.json()["Enrolled"]) == ["0001", "0002"]
+
+def test_queries_are_cached_apart(client):
+    everything = client.get("/students/0002/classes").json()
+    first_page = client.get("/students/0002/classes", params={"limit": 1}).json()
+    assert len(first_page["Classes"]) == 1
+    assert len(everything["Classes"]) == 2
+
+def test_instructor_change_invalidates_listings(client, sync_redis):
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert {item["instructorId"] for item in listing} == {"0001"}
+    assert client.put("/registrar/classes/0001/instructors/0002").status_code == 200
+    assert sync_redis.get(rc.CLASSES_VERSION_KEY) == b"1"
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert {item["id"]: item["instructorId"] for item in listing}["0001"] == "0002"
+
+def test_bulk_instructor_change_invalidates_listings(client, sync_redis):
+    client.get("/students/0002/classes")
+    response = client.put("/registrar/bulk/instructors", json=[{"ClassId": "0002", "InstructorId": "0002"}])
+    assert response.status_code == 200
+    assert sync_redis.get(rc.CLASSES_VERSION_KEY) == b"1"
+    listing = client.get("/students/0002/classes").json()["Classes"]
+    assert {item["id"]: item["instructorId"] for item in listing}["0002"] == "0002"
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import enrollment_service.query_helper as qh
+from enrollment_service.single_flight import RedisLease, SingleFlight
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def slow_call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"currentEnroll": 9}
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("0002", slow_call)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("0002", slow_call))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flight.stats()["followers"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [{"currentEnroll": 9}] * 4
+    # Callers get their own copies
+    assert len({id(result) for result in results}) == 4
+    assert flight.stats()["coalescing_ratio"] == 0.75
+
+def test_followers_get_the_leaders_error():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    def failing_call():
+        started.set()
+        release.wait(5)
+        raise ValueError("throttled")
+    errors = []
+    def call():
+        try:
+            flight.do("0002", failing_call)
+        except ValueError as error:
+            errors.append(str(error))
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flight.stats()["followers"] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ["throttled", "throttled"]
+
+def test_lease_has_one_holder(sync_redis):
+    lease = RedisLease("lease:test", 1000)
+    token = lease.acquire(sync_redis, "0002")
+    assert token is not None
+    assert lease.acquire(sync_redis, "0002") is None
+    # Only the holder's token releases it
+    lease.release(sync_redis, "0002", "someone else")
+    assert lease.acquire(sync_redis, "0002") is None
+    lease.release(sync_redis, "0002", token)
+    assert lease.acquire(sync_redis, "0002") is not None
+
+def test_worker_without_the_lease_waits_for_the_cache(dynamodb, class_cache, sync_redis, monkeypatch):
+    class_cache.redis_client = sync_redis
+    monkeypatch.setattr(qh.class_lease, "lease_ms", 2000)
+    class_data = qh.fetch_class(dynamodb, "0002")
+    # Another worker holds the lease and fills the Redis tier a little later
+    assert qh.class_lease.acquire(sync_redis, "0002")
+    other = qh.ClassCache()
+    other.redis_client = sync_redis
+    filler = threading.Timer(0.05, other.set, ("0002", class_data, other.generation("0002")))
+    def no_reads(*args):
+        raise AssertionError("read DynamoDB while another worker held the lease")
+    monkeypatch.setattr(qh, "fetch_class", no_reads)
+    filler.start()
+    assert qh.query_class(dynamodb, "0002")["currentEnroll"] == 9
+    filler.join()
+    assert class_cache.stats()["misses"] == 1
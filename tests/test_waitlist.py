@@ -0,0 +1,63 @@
+import asyncio
+
+import enrollment_service.waitlist_helper as wh
+
+
+def test_batch_waitlist_status(async_redis):
+    async def scenario():
+        await wh.join_waitlist(async_redis, "0001", "0002", 10)
+        await wh.join_waitlist(async_redis, "0001", "0003", 10)
+        return await wh.batch_waitlist_status(async_redis, ["0001", "0002"], "0002")
+    assert asyncio.run(scenario()) == {
+        "0001": {"length": 2, "member": True},
+        "0002": {"length": 0, "member": False},
+    }
+
+def test_listing_hides_classes_with_full_waitlists(client, sync_redis):
+    for student_id in ["0003", "0004", "0005"]:
+        sync_redis.zadd(wh.waitlist_key("0001"), {wh.waitlist_member(student_id): 1})
+    response = client.get("/students/0002/classes")
+    assert [item["id"] for item in response.json()["Classes"]] == ["0002"]
+
+def test_waitlist_is_fifo(async_redis):
+    async def scenario():
+        for student_id in ["0003", "0001", "0002"]:
+            assert await wh.join_waitlist(async_redis, "0001", student_id, 10) == wh.WAITLIST_ADDED
+        assert await wh.waitlist_members(async_redis, "0001") == ["s#0003", "s#0001", "s#0002"]
+        assert await wh.waitlist_position(async_redis, "0001", "0002") == 3
+        assert await wh.first_in_waitlist(async_redis, "0001") == "0003"
+        assert await wh.remove_from_waitlist(async_redis, "0001", "0003")
+        assert not await wh.remove_from_waitlist(async_redis, "0001", "0003")
+        assert await wh.waitlist_position(async_redis, "0001", "0002") == 2
+        assert await wh.waitlist_position(async_redis, "0001", "0003") is None
+    asyncio.run(scenario())
+
+def test_scores_are_whole_microseconds(async_redis, sync_redis):
+    asyncio.run(wh.join_waitlist(async_redis, "0001", "0002", 10))
+    score = sync_redis.zscore(wh.waitlist_key("0001"), wh.waitlist_member("0002"))
+    assert score == int(score) and score > 10 ** 15
+
+def test_waitlist_position_route(client):
+    client.post("/students/0002/classes/0001/enroll")
+    client.post("/students/0003/classes/0001/enroll")
+    assert client.get("/students/0003/waitlist/0001").json()["Waitlist Position"] == 2
+    assert client.delete("/students/0002/waitlist/0001").status_code == 200
+    assert client.get("/students/0003/waitlist/0001").json()["Waitlist Position"] == 1
+
+def test_join_waitlist_script(async_redis):
+    async def scenario():
+        assert await wh.join_waitlist(async_redis, "0001", "0002", 2) == wh.WAITLIST_ADDED
+        assert await wh.join_waitlist(async_redis, "0001", "0002", 2) == wh.WAITLIST_ALREADY_PRESENT
+        assert await wh.join_waitlist(async_redis, "0001", "0003", 2) == wh.WAITLIST_ADDED
+        assert await wh.join_waitlist(async_redis, "0001", "0004", 2) == wh.WAITLIST_FULL
+        # A student already on a full waitlist is still reported as present
+        assert await wh.join_waitlist(async_redis, "0001", "0003", 2) == wh.WAITLIST_ALREADY_PRESENT
+        assert await wh.waitlist_length(async_redis, "0001") == 2
+    asyncio.run(scenario())
+
+def test_concurrent_joins_dont_overfill(async_redis):
+    async def scenario():
+        return await asyncio.gather(*[wh.join_waitlist(async_redis, "0001", f"{n:04}", 3) for n in range(10)])
+    results = asyncio.run(scenario())
+    assert results.count(wh.WAITLIST_ADDED) == 3
+    assert results.count(wh.WAITLIST_FULL) == 7